@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+
+class Admission:
+    """In-memory admission control for order intake, checked before an order costs anything.
+
+    Each user has a token bucket refilled at `user_rate` orders per second up to `user_burst`.
+    Each item admits at most `max_depth` orders at once, counted from admission until the
+    request is answered. An admitted order that waited more than `max_age` seconds for its
+    item's writer is dropped instead of matched against a book that has since moved. A zero
+    rate, depth or age turns that check off.
+    """
+
+    def __init__(
+        self,
+        user_rate: float = 0.0,
+        user_burst: Optional[float] = None,
+        max_depth: int = 0,
+        max_age: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst or max(user_rate, 1.0)
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, List[float]] = {}  # user id -> [tokens, when last refilled]
+        self._depths: Dict[int, int] = defaultdict(int)
+
+    def take(self, user_id: int, tokens: int = 1) -> Optional[float]:
+        """Spend the user's tokens; None when they had enough, else seconds until they will."""
+        if not self.user_rate:
+            return None
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = [self.user_burst, now]
+            bucket[0] = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+            bucket[1] = now
+            if bucket[0] < tokens:
+                return (tokens - bucket[0]) / self.user_rate
+            bucket[0] -= tokens
+            return None
+
+    def enter(self, item_id: int) -> bool:
+        """Take a place in the item's queue; False when it is full. Admitted orders must `leave`."""
+        with self._lock:
+            if self.max_depth and self._depths[item_id] >= self.max_depth:
+                return False
+            self._depths[item_id] += 1
+            return True
+
+    def leave(self, item_id: int):
+        with self._lock:
+            self._depths[item_id] -= 1
+            if not self._depths[item_id]:
+                del self._depths[item_id]
+
+    def stale(self, admitted_at: float) -> bool:
+        """Whether an order admitted at `admitted_at` (on `clock`) waited too long to be matched."""
+        return bool(self.max_age) and self.clock() - admitted_at > self.max_age
+
+    def depths(self) -> Dict[int, int]:
+        """Orders admitted and not yet answered, per item that has any."""
+        with self._lock:
+            return dict(self._depths)
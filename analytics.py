@@ -0,0 +1,246 @@
+"""Column-oriented NumPy snapshots of an item's book and trades, for risk and research.
+
+Resting orders and trade history are loaded once into one array per column, and every metric
+is computed on whole arrays. Prices stay in integer ticks of the item and timestamps are
+naive UTC datetime64[us]. Needs the optional numpy package:
+
+    book = load_book(db, item_id)
+    trades = load_trades(db, item_id, start=datetime(2024, 1, 1), archive=trade_archive)
+    prices, cumulative = depth_curve(book, OrderType.Bid, levels=10)
+    starts, vwaps, volumes = vwap(trades, 3600)
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import String, cast, select
+from sqlalchemy.orm import Session
+
+try:
+    import numpy as np
+except ImportError:  # optional: only needed for analytics
+    np = None
+
+from archive import TradeArchive
+from models import ItemOrder, OrderKind, OrderType, Trade
+
+# Rows are turned into arrays this many at a time, so a long history never exists as one list of tuples
+LOAD_CHUNK_SIZE = 100_000
+SIDES = {OrderType.Bid: 0, OrderType.Ask: 1}
+KINDS = {kind: index for index, kind in enumerate(OrderKind)}
+NO_PRICE = -1  # market and stop orders in the price column
+INT32 = (-2 ** 31, 2 ** 31 - 1)
+
+
+def available() -> bool:
+    return np is not None
+
+
+@dataclass
+class BookColumns:
+    """An item's resting orders in id order, untriggered stops included."""
+    id: "np.ndarray"
+    side: "np.ndarray"  # int8, see SIDES
+    kind: "np.ndarray"  # int8, see KINDS
+    price: "np.ndarray"  # ticks, NO_PRICE when the order has none
+    remaining: "np.ndarray"
+    user_id: "np.ndarray"
+
+    def limits(self, side: OrderType) -> "np.ndarray":
+        """Mask of the side's limit orders, the ones that make up its price levels."""
+        return (self.side == SIDES[side]) & (self.kind == KINDS[OrderKind.Limit])
+
+
+@dataclass
+class TradeColumns:
+    """An item's trades in id order."""
+    id: "np.ndarray"
+    buyer_id: "np.ndarray"
+    seller_id: "np.ndarray"
+    price: "np.ndarray"  # ticks
+    quantity: "np.ndarray"
+    timestamp: "np.ndarray"  # datetime64[us]; NaT for trades from before timestamps were kept
+
+    def __len__(self):
+        return len(self.id)
+
+
+def load_book(db: Session, item_id: int) -> BookColumns:
+    rows = db.execute(
+        select(ItemOrder.id, ItemOrder.side, ItemOrder.kind, ItemOrder.price, ItemOrder.remaining, ItemOrder.user_id)
+        .where(ItemOrder.item_id == item_id)
+        .order_by(ItemOrder.id)
+    )
+    ids, sides, kinds, prices, remaining, users = chunked_columns(rows, 6, [
+        lambda v: np.array(v, dtype=np.int64),
+        lambda v: np.fromiter((SIDES[s] for s in v), dtype=np.int8, count=len(v)),
+        lambda v: np.fromiter((KINDS[k] for k in v), dtype=np.int8, count=len(v)),
+        lambda v: np.fromiter((NO_PRICE if p is None else p for p in v), dtype=np.int64, count=len(v)),
+        lambda v: np.array(v, dtype=np.int64),
+        lambda v: np.array(v, dtype=np.int64),
+    ])
+    return BookColumns(compact(ids), sides, kinds, compact(prices), compact(remaining), compact(users))
+
+
+def load_trades(
+    db: Session,
+    item_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    archive: Optional[TradeArchive] = None,
+) -> TradeColumns:
+    """Trades of the item with start <= timestamp < end, archived ones first when an archive is given."""
+    parts = [archived_columns(archive, item_id, start, end)] if archive is not None else []
+
+    # Timestamps are read as the text SQLite stores, which NumPy parses far faster than datetimes
+    query = select(Trade.id, Trade.buyer_id, Trade.seller_id, Trade.price, Trade.quantity, cast(Trade.timestamp, String))
+    query = query.where(Trade.item_id == item_id).order_by(Trade.id)
+    if start is not None:
+        query = query.where(Trade.timestamp >= start)
+    if end is not None:
+        query = query.where(Trade.timestamp < end)
+    integers = lambda v: np.array(v, dtype=np.int64)
+    parts.append(chunked_columns(db.execute(query), 6, [integers] * 5 + [lambda v: np.array(v, dtype="datetime64[us]")]))
+
+    columns = [np.concatenate(column) for column in zip(*parts)]
+    ids, buyers, sellers, prices, quantities, timestamps = columns
+    return TradeColumns(compact(ids), compact(buyers), compact(sellers), compact(prices), compact(quantities), timestamps)
+
+
+def archived_columns(archive: TradeArchive, item_id: int, start: Optional[datetime], end: Optional[datetime]) -> list:
+    days = [
+        day for day in archive.days(item_id)
+        if (start is None or day >= start.date()) and (end is None or day <= end.date())
+    ]
+    columns = [[] for _ in range(6)]
+    for day in days:
+        for column, values in zip(columns, archive.columns(item_id, day)):
+            column.append(np.frombuffer(values, dtype=np.int64))
+    columns = [np.concatenate(c) if c else np.empty(0, dtype=np.int64) for c in columns]
+    columns[5] = columns[5].astype("datetime64[us]")  # microseconds since 1970, like the archive
+    keep = window_mask(columns[5], start, end)
+    return [column[keep] for column in columns]
+
+
+def chunked_columns(rows, width: int, converters: Sequence) -> List["np.ndarray"]:
+    chunks = [[] for _ in range(width)]
+    for partition in rows.partitions(LOAD_CHUNK_SIZE):
+        for chunk, values, convert in zip(chunks, zip(*partition), converters):
+            chunk.append(convert(values))
+    return [np.concatenate(c) if c else convert(()) for c, convert in zip(chunks, converters)]
+
+
+def compact(values: "np.ndarray") -> "np.ndarray":
+    """int32 when every value fits, which halves the memory of ids, prices and quantities."""
+    if not len(values) or (values.min() >= INT32[0] and values.max() <= INT32[1]):
+        return values.astype(np.int32)
+    return values
+
+
+def sum_by_price(prices: "np.ndarray", quantities: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Distinct prices, ascending, and the total quantity at each."""
+    if not len(prices):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    low, high = int(prices.min()), int(prices.max())
+    if high - low <= 4 * len(prices):
+        # Prices cluster in a narrow band of ticks, so count into a dense array instead of sorting
+        totals = np.bincount(prices - low, weights=quantities, minlength=high - low + 1)
+        present = np.flatnonzero(totals)  # quantities are positive
+        return present + low, totals[present].astype(np.int64)
+    distinct, inverse = np.unique(prices, return_inverse=True)
+    return distinct, np.bincount(inverse, weights=quantities).astype(np.int64)
+
+
+def window_mask(timestamps: "np.ndarray", start: Optional[datetime], end: Optional[datetime]) -> "np.ndarray":
+    keep = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        keep &= timestamps >= np.datetime64(start, "us")
+    if end is not None:
+        keep &= timestamps < np.datetime64(end, "us")
+    return keep
+
+
+# ---- Book metrics ----
+
+def depth_curve(book: BookColumns, side: OrderType, levels: Optional[int] = None) -> Tuple["np.ndarray", "np.ndarray"]:
+    """The side's price levels, best first, and the quantity resting at or better than each."""
+    mask = book.limits(side)
+    prices, quantities = sum_by_price(book.price[mask], book.remaining[mask])
+    if side == OrderType.Bid:
+        prices, quantities = prices[::-1], quantities[::-1]
+    return prices[:levels], np.cumsum(quantities[:levels])
+
+
+def best_prices(book: BookColumns) -> Tuple[Optional[int], Optional[int]]:
+    bids, asks = book.price[book.limits(OrderType.Bid)], book.price[book.limits(OrderType.Ask)]
+    return (int(bids.max()) if len(bids) else None), (int(asks.min()) if len(asks) else None)
+
+
+def spread(book: BookColumns) -> Optional[int]:
+    best_bid, best_ask = best_prices(book)
+    return None if best_bid is None or best_ask is None else best_ask - best_bid
+
+
+def imbalance(book: BookColumns, levels: Optional[int] = None) -> Optional[float]:
+    """(bid - ask) / (bid + ask) quantity within the best `levels` of each side, from -1 to 1."""
+    return curve_imbalance(depth_curve(book, OrderType.Bid, levels)[1], depth_curve(book, OrderType.Ask, levels)[1])
+
+
+def curve_imbalance(bids: "np.ndarray", asks: "np.ndarray") -> Optional[float]:
+    bid, ask = (int(bids[-1]) if len(bids) else 0), (int(asks[-1]) if len(asks) else 0)
+    return (bid - ask) / (bid + ask) if bid + ask else None
+
+
+# ---- Trade metrics ----
+
+def volume_at_price(trades: TradeColumns) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Every traded price, ascending, and the total quantity traded at it."""
+    return sum_by_price(trades.price, trades.quantity)
+
+
+def total_vwap(trades: TradeColumns) -> Optional[float]:
+    """Volume weighted average price in ticks."""
+    volume = trades.quantity.sum(dtype=np.int64)
+    return float(np.dot(trades.price.astype(np.float64), trades.quantity) / volume) if volume else None
+
+
+def vwap(trades: TradeColumns, seconds: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """VWAP in ticks per window of `seconds` aligned to the epoch, like candles: start, VWAP, volume.
+
+    Windows without trades are left out, as are trades without a timestamp.
+    """
+    timestamps, prices, quantities = trades.timestamp, trades.price, trades.quantity
+    timed = ~np.isnat(timestamps)
+    if not timed.all():
+        timestamps, prices, quantities = timestamps[timed], prices[timed], quantities[timed]
+    if not len(timestamps):
+        return np.empty(0, dtype="datetime64[us]"), np.empty(0), np.empty(0, dtype=np.int64)
+    windows = timestamps.view(np.int64) // (seconds * 1_000_000)
+    if np.any(windows[1:] < windows[:-1]):
+        # Ids follow time almost everywhere; sort only when they don't
+        order = np.argsort(windows, kind="stable")
+        windows, prices, quantities = windows[order], prices[order], quantities[order]
+    starts = np.concatenate(([0], np.flatnonzero(windows[1:] != windows[:-1]) + 1))
+    notional = np.add.reduceat(prices.astype(np.float64) * quantities, starts)
+    volumes = np.add.reduceat(quantities.astype(np.int64), starts)
+    return (windows[starts] * seconds * 1_000_000).astype("datetime64[us]"), notional / volumes, volumes
+
+
+def book_summary(book: BookColumns, levels: Optional[int]) -> dict:
+    """Top of book, spread, imbalance and depth curves, in ticks."""
+    bids, asks = depth_curve(book, OrderType.Bid, levels), depth_curve(book, OrderType.Ask, levels)
+    best_bid = int(bids[0][0]) if len(bids[0]) else None
+    best_ask = int(asks[0][0]) if len(asks[0]) else None
+    return {
+        "best_bid": best_bid,
+        "best_ask": best_ask,
+        "spread": None if best_bid is None or best_ask is None else best_ask - best_bid,
+        "imbalance": curve_imbalance(bids[1], asks[1]),
+        "bids": bids,
+        "asks": asks,
+    }
+
+
+def to_prices(ticks: Iterable, tick_size: float, decimals: int) -> list:
+    """Whole ticks as API prices, rounded to the decimals of the tick size like `priced_rows`."""
+    return np.round(np.asarray(ticks, dtype=np.float64) * tick_size, decimals).tolist()
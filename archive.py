@@ -0,0 +1,200 @@
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import accumulate, groupby
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Trade
+from partitions import Partition
+
+# A file holds one item's trades of one UTC day: a header, then every column as a zlib
+# compressed array of int64. Ids and timestamps are stored as deltas, which compress well.
+HEADER = struct.Struct("<8sqI")  # magic, item id, row count
+COLUMN = struct.Struct("<I")  # compressed length
+MAGIC = b"VOBTRD01"
+SUFFIX = ".trades"
+DELTA_COLUMNS = (0, 5)  # id, timestamp
+EPOCH = datetime(1970, 1, 1)
+# Trades are moved out of the database this many rows at a time
+ARCHIVE_BATCH = 100_000
+
+
+class ArchivedTrade(NamedTuple):
+    # Columns in the order of the trades table, so rows read back line up with live ones
+    id: int
+    buyer_id: int
+    seller_id: int
+    item_id: int
+    price: int  # ticks
+    quantity: int
+    timestamp: datetime
+
+
+class TradeArchive:
+    """Old trades in per-item, per-day columnar files, read back by item and time window.
+
+    Writes replace a day's file atomically and merge with what it already holds by trade id,
+    so archiving the same trades twice (e.g. after a crash before they were deleted) is harmless.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def write(self, item_id: int, day: date, trades: Iterable[ArchivedTrade]):
+        path = self._path(item_id, day)
+        with self._lock:
+            merged = {t.id: t for t in self._read_file(path)} if os.path.exists(path) else {}
+            merged.update((t.id, t) for t in trades)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as f:
+                f.write(encode_day(item_id, [merged[i] for i in sorted(merged)]))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+
+    def read(
+        self,
+        item_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after_id: Optional[int] = None,
+    ) -> Iterator[ArchivedTrade]:
+        """Trades of the item with start <= timestamp < end and id > after_id, in id order."""
+        for day in self.days(item_id):
+            if (start is not None and day < start.date()) or (end is not None and day > end.date()):
+                continue
+            for trade in self._read_file(self._path(item_id, day)):
+                if start is not None and trade.timestamp < start:
+                    continue
+                if end is not None and trade.timestamp >= end:
+                    continue
+                if after_id is not None and trade.id <= after_id:
+                    continue
+                yield trade
+
+    def scan(self, partition: Partition = Partition()) -> Iterator[ArchivedTrade]:
+        """Every archived trade of the partition's items, in id order within each item."""
+        for item_id in self.items():
+            if partition.owns(item_id):
+                yield from self.read(item_id)
+
+    def columns(self, item_id: int, day: date) -> List[array]:
+        """A day's trades as int64 columns: ids, buyers, sellers, prices, quantities, microseconds."""
+        with open(self._path(item_id, day), "rb") as f:
+            return decode_columns(f.read())[1]
+
+    def items(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name) for name in os.listdir(self.directory) if name.isdigit())
+
+    def days(self, item_id: int) -> List[date]:
+        directory = os.path.join(self.directory, str(item_id))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(date.fromisoformat(name[:-len(SUFFIX)]) for name in os.listdir(directory) if name.endswith(SUFFIX))
+
+    def _path(self, item_id: int, day: date) -> str:
+        return os.path.join(self.directory, str(item_id), day.isoformat() + SUFFIX)
+
+    @staticmethod
+    def _read_file(path: str) -> List[ArchivedTrade]:
+        with open(path, "rb") as f:
+            return decode_day(f.read())
+
+
+def encode_day(item_id: int, trades: List[ArchivedTrade]) -> bytes:
+    columns = [
+        [t.id for t in trades],
+        [t.buyer_id for t in trades],
+        [t.seller_id for t in trades],
+        [t.price for t in trades],
+        [t.quantity for t in trades],
+        [to_micros(t.timestamp) for t in trades],
+    ]
+    chunks = [HEADER.pack(MAGIC, item_id, len(trades))]
+    for index, values in enumerate(columns):
+        if index in DELTA_COLUMNS:
+            values = [b - a for a, b in zip([0] + values, values)]
+        data = array("q", values)
+        if sys.byteorder == "big":
+            data.byteswap()
+        compressed = zlib.compress(data.tobytes())
+        chunks += [COLUMN.pack(len(compressed)), compressed]
+    return b"".join(chunks)
+
+
+def decode_day(data: bytes) -> List[ArchivedTrade]:
+    item_id, columns = decode_columns(data)
+    ids, buyers, sellers, prices, quantities, times = columns
+    return [
+        ArchivedTrade(ids[i], buyers[i], sellers[i], item_id, prices[i], quantities[i], from_micros(times[i]))
+        for i in range(len(ids))
+    ]
+
+
+def decode_columns(data: bytes) -> Tuple[int, List[array]]:
+    """The item id of a day file and its columns, with the deltas summed back up."""
+    magic, item_id, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a trade archive file")
+    offset = HEADER.size
+    columns = []
+    for index in range(6):
+        (length,) = COLUMN.unpack_from(data, offset)
+        offset += COLUMN.size
+        values = array("q", zlib.decompress(data[offset:offset + length]))
+        offset += length
+        if sys.byteorder == "big":
+            values.byteswap()
+        if index in DELTA_COLUMNS:
+            values = array("q", accumulate(values))
+        columns.append(values)
+    return item_id, columns
+
+
+def to_micros(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def archive_trades(db: Session, archive: TradeArchive, before: datetime, partition: Partition = Partition()) -> Set[int]:
+    """Move the partition's trades older than `before` from the database into the archive.
+
+    Returns the ids of the items whose trades moved. Trades without a timestamp stay put.
+    """
+    archived: Set[int] = set()
+    while True:
+        rows = (
+            db.query(Trade.id, Trade.buyer_id, Trade.seller_id, Trade.item_id, Trade.price, Trade.quantity,
+                     Trade.timestamp)
+            .filter(Trade.timestamp < before, Trade.item_id % partition.count == partition.index)
+            .order_by(Trade.item_id, Trade.id)
+            .limit(ARCHIVE_BATCH)
+            .all()
+        )
+        if not rows:
+            return archived
+        # Files are written before the rows are deleted, so a crash in between only archives them twice
+        for (item_id, day), group in groupby(rows, key=lambda r: (r.item_id, r.timestamp.date())):
+            trades = [ArchivedTrade(*row) for row in group]
+            archive.write(item_id, day, trades)
+            # Per item, ids grow with time, so the group is exactly the old trades in its id range
+            db.query(Trade).filter(
+                Trade.item_id == item_id,
+                Trade.id.between(trades[0].id, trades[-1].id),
+                Trade.timestamp < before,
+            ).delete(synchronize_session=False)
+            archived.add(item_id)
+        db.commit()
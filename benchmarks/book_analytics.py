@@ -0,0 +1,79 @@
+"""Time of the analytics metrics over synthetic trade columns and a deep book.
+
+Trades follow a random walk in ticks, one every few milliseconds, and the book has limit orders
+around the last price on both sides. Only the computation is timed: the columns are built in
+memory as load_trades and load_book would return them. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/book_analytics.py --trades 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analytics import KINDS, SIDES, BookColumns, TradeColumns, compact, book_summary, total_vwap, volume_at_price, \
+    vwap
+from models import OrderKind, OrderType
+
+
+def make_trades(count: int, rng) -> TradeColumns:
+    ids = np.arange(1, count + 1, dtype=np.int64)
+    prices = 10_000 + np.cumsum(rng.integers(-1, 2, count))
+    start = np.datetime64("2024-01-01T00:00:00", "us")
+    timestamps = start + np.cumsum(rng.integers(0, 5_000, count)).astype("timedelta64[us]")
+    return TradeColumns(
+        compact(ids),
+        compact(rng.integers(1, 10_000, count)),
+        compact(rng.integers(1, 10_000, count)),
+        compact(prices),
+        compact(rng.integers(1, 100, count)),
+        timestamps,
+    )
+
+
+def make_book(count: int, mid: int, rng) -> BookColumns:
+    sides = rng.integers(0, 2, count).astype(np.int8)
+    offsets = rng.integers(1, 500, count)
+    prices = np.where(sides == SIDES[OrderType.Bid], mid - offsets, mid + offsets)
+    return BookColumns(
+        compact(np.arange(1, count + 1)),
+        sides,
+        np.full(count, KINDS[OrderKind.Limit], dtype=np.int8),
+        compact(prices),
+        compact(rng.integers(1, 100, count)),
+        compact(rng.integers(1, 10_000, count)),
+    )
+
+
+def timed(name: str, function, *args) -> float:
+    began = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - began
+    print(f"{name:<24}{elapsed * 1000:>10.1f} ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=10_000_000)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    trades = make_trades(args.trades, rng)
+    book = make_book(args.orders, int(trades.price[-1]), rng)
+    print(f"{args.trades:,} trades, {args.orders:,} resting orders")
+
+    total = sum([
+        timed("volume at price", volume_at_price, trades),
+        timed("vwap", total_vwap, trades),
+        timed("vwap per 1m window", vwap, trades, 60),
+        timed("vwap per 1h window", vwap, trades, 3600),
+        timed("book depth and spread", book_summary, book, None),
+    ])
+    print(f"{'total':<24}{total * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
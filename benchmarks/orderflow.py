@@ -0,0 +1,308 @@
+"""Synthetic order flow against the order endpoints, with latency percentiles per endpoint.
+
+Drives the app in-process (a TestClient on a fresh temporary database) or a running server
+over HTTP, at increasing book depths, and writes the results as JSON so runs from different
+commits can be compared. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/orderflow.py --depths 10,1000,100000
+    PYTHONPATH=. python benchmarks/orderflow.py --url http://localhost:8000 --depths 10,1000
+    PYTHONPATH=. python benchmarks/orderflow.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+MID_PRICE = 1_000
+SEED_BATCH_SIZE = 1_000
+ENDPOINTS = ["POST /orders/", "POST /orders/delete/", "GET /orders/", "GET /trades/"]
+
+
+@dataclass
+class FlowConfig:
+    items: int = 10
+    users: int = 100
+    market_ratio: float = 0.1  # share of new orders that are market orders
+    cross_ratio: float = 0.3  # share of limit orders priced through the opposite side
+    cancel_ratio: float = 0.2  # share of operations that cancel one of our resting orders
+    max_quantity: int = 5
+    seed: int = 42
+
+
+class OrderFlow:
+    """Generates the next operation; remembers which of its orders are resting so it can cancel them."""
+
+    def __init__(self, config: FlowConfig, item_ids: List[int], user_ids: List[int]):
+        self.config = config
+        self.item_ids = item_ids
+        self.user_ids = user_ids
+        self.rng = random.Random(config.seed)
+        self.resting: List[int] = []
+        self._lock = threading.Lock()
+
+    def next(self) -> tuple:
+        with self._lock:
+            if self.resting and self.rng.random() < self.config.cancel_ratio:
+                index = self.rng.randrange(len(self.resting))
+                self.resting[index], self.resting[-1] = self.resting[-1], self.resting[index]
+                return "cancel", {"order_id": self.resting.pop()}
+            return "order", self.order()
+
+    def order(self, resting: bool = False) -> dict:
+        side = self.rng.choice(["Bid", "Ask"])
+        order = {
+            "side": side,
+            "item_id": self.rng.choice(self.item_ids),
+            "user_id": self.rng.choice(self.user_ids),
+            "quantity": self.rng.randint(1, self.config.max_quantity),
+        }
+        if not resting and self.rng.random() < self.config.market_ratio:
+            # Market orders carry a placeholder price, which the API ignores but older trees require
+            order["kind"] = "Market"
+            order["price"] = 0
+            return order
+        # Resting orders sit 1..100 ticks away from the mid; crossing ones are priced through it
+        offset = self.rng.randint(1, 100)
+        if not resting and self.rng.random() < self.config.cross_ratio:
+            offset = -offset
+        order["kind"] = "Limit"
+        order["price"] = MID_PRICE - offset if side == "Bid" else MID_PRICE + offset
+        return order
+
+    def rested(self, order: dict):
+        if order["id"] != -1 and order["remaining"] > 0:
+            with self._lock:
+                self.resting.append(order["id"])
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies: List[float], elapsed: float, statuses: Dict[int, int]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "p999_ms": percentile(latencies, 0.999) * 1000 if latencies else None,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {endpoint: [] for endpoint in ENDPOINTS}
+        self.statuses: Dict[str, Dict[int, int]] = {endpoint: {} for endpoint in ENDPOINTS}
+
+    def timed(self, endpoint: str, call):
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            statuses = self.statuses[endpoint]
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return response
+
+
+def setup(client, config: FlowConfig) -> OrderFlow:
+    item_ids = [client.post("/items/", json={"name": f"bench-item-{i}"}).json()["id"] for i in range(config.items)]
+    user_ids = [client.post("/users/", json={"name": f"bench-user-{i}"}).json()["id"] for i in range(config.users)]
+    return OrderFlow(config, item_ids, user_ids)
+
+
+def seed(client, flow: OrderFlow, count: int):
+    """Rest `count` non-crossing orders, through the batch endpoint."""
+    while count > 0:
+        size = min(count, SEED_BATCH_SIZE)
+        response = client.post("/orders/batch", json={"orders": [flow.order(resting=True) for _ in range(size)]})
+        response.raise_for_status()
+        for result in response.json()["results"]:
+            flow.rested(result["order"])
+        count -= size
+
+
+def run_flow(client, flow: OrderFlow, operations: int, reads: int, page_size: int, concurrency: int) -> dict:
+    recorder = Recorder()
+
+    def operate(_):
+        kind, body = flow.next()
+        if kind == "cancel":
+            recorder.timed("POST /orders/delete/", lambda: client.post("/orders/delete/", json=body))
+        else:
+            response = recorder.timed("POST /orders/", lambda: client.post("/orders/", json=body))
+            if response.status_code == 200:
+                flow.rested(response.json())
+
+    def read(i):
+        item_id = flow.item_ids[i % len(flow.item_ids)]
+        endpoint, path = ("GET /orders/", "/orders/") if i % 2 == 0 else ("GET /trades/", "/trades/")
+        recorder.timed(endpoint, lambda: client.get(path, params={"item_id": item_id, "limit": page_size}))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        list(pool.map(operate, range(operations)))
+        write_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        list(pool.map(read, range(reads)))
+        read_elapsed = time.perf_counter() - started
+    for endpoint in ENDPOINTS:
+        elapsed = read_elapsed if endpoint.startswith("GET") else write_elapsed
+        results[endpoint] = summarize(recorder.latencies[endpoint], elapsed, recorder.statuses[endpoint])
+    return results
+
+
+def run(args) -> dict:
+    config = FlowConfig(
+        items=args.items,
+        users=args.users,
+        market_ratio=args.market_ratio,
+        cross_ratio=args.cross_ratio,
+        cancel_ratio=args.cancel_ratio,
+        seed=args.seed,
+    )
+    depths = sorted(int(d) for d in args.depths.split(","))
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "target": args.url or "in-process",
+        "config": asdict(config),
+        "operations": args.operations,
+        "reads": args.reads,
+        "page_size": args.page_size,
+        "concurrency": args.concurrency,
+        "depths": [],
+    }
+
+    with open_client(args) as client:
+        flow = setup(client, config)
+        # Depths are cumulative: each step tops the book up to the next size before measuring
+        seeded = 0
+        for depth in depths:
+            started = time.perf_counter()
+            seed(client, flow, depth - seeded)
+            seeded = depth
+            seed_seconds = time.perf_counter() - started
+            results = run_flow(client, flow, args.operations, args.reads, args.page_size, args.concurrency)
+            report["depths"].append({"depth": depth, "seed_seconds": seed_seconds, "endpoints": results})
+            print_depth(depth, results)
+    return report
+
+
+class open_client:
+    """An httpx client for --url, else a TestClient on a temporary database."""
+
+    def __init__(self, args):
+        self.args = args
+        self.directory = None
+
+    def __enter__(self):
+        if self.args.url:
+            import httpx
+
+            self.client = httpx.Client(base_url=self.args.url, timeout=60)
+            return self.client
+
+        self.directory = tempfile.TemporaryDirectory()
+        # main builds its engine on import, so the database has to be chosen first
+        os.environ["DATABASE_URL"] = f"sqlite:///{self.directory.name}/bench.db"
+        from fastapi.testclient import TestClient
+        from main import app
+
+        self.client = TestClient(app).__enter__()
+        return self.client
+
+    def __exit__(self, *exc):
+        if self.args.url:
+            self.client.close()
+        else:
+            self.client.__exit__(*exc)
+            self.directory.cleanup()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_depth(depth: int, results: dict):
+    print(f"depth {depth}")
+    for endpoint, r in results.items():
+        if r["count"]:
+            print(
+                f"  {endpoint:<22}{r['throughput']:>9.0f}/s  p50 {r['p50_ms']:>8.2f} ms"
+                f"  p99 {r['p99_ms']:>8.2f} ms  p999 {r['p999_ms']:>8.2f} ms"
+            )
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = {d["depth"]: d["endpoints"] for d in json.load(f)["depths"]}
+    with open(new_path) as f:
+        new = {d["depth"]: d["endpoints"] for d in json.load(f)["depths"]}
+    for depth in sorted(old.keys() & new.keys()):
+        print(f"depth {depth}")
+        for endpoint in ENDPOINTS:
+            before, after = old[depth].get(endpoint), new[depth].get(endpoint)
+            if not before or not after or not before["count"] or not after["count"]:
+                continue
+            changes = "  ".join(
+                f"{metric} {after[metric] / before[metric] - 1:+.1%}"
+                for metric in ("throughput", "p50_ms", "p99_ms", "p999_ms")
+                if before[metric]
+            )
+            print(f"  {endpoint:<22}{changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--depths", default="10,1000,10000", help="comma-separated resting order counts")
+    parser.add_argument("--operations", type=int, default=2_000, help="orders and cancels per depth")
+    parser.add_argument("--reads", type=int, default=1_000, help="GET /orders/ and /trades/ requests per depth")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--items", type=int, default=FlowConfig.items)
+    parser.add_argument("--users", type=int, default=FlowConfig.users)
+    parser.add_argument("--market-ratio", type=float, default=FlowConfig.market_ratio)
+    parser.add_argument("--cross-ratio", type=float, default=FlowConfig.cross_ratio)
+    parser.add_argument("--cancel-ratio", type=float, default=FlowConfig.cancel_ratio)
+    parser.add_argument("--seed", type=int, default=FlowConfig.seed)
+    parser.add_argument("--output", help="where to write the JSON report (default: benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args)
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(os.path.dirname(__file__), "results"), exist_ok=True)
+        name = f"orderflow-{(report['commit'] or 'unknown')[:8]}-{int(time.time())}.json"
+        output = os.path.join(os.path.dirname(__file__), "results", name)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
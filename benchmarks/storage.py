@@ -0,0 +1,103 @@
+"""Read/write concurrency of the SQLite storage profiles.
+
+Writer threads insert orders with a commit each, as POST /orders/ does, while reader threads
+run the GET /orders/ page query. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/storage.py --seconds 5
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, GroupCommitter, create_db_engine
+from models import ItemOrder
+
+CONFIGS = [
+    ("default", False),
+    ("wal", False),
+    ("wal", True),
+]
+
+
+def run(profile: str, group_commit: bool, writers: int, readers: int, seconds: float, directory: str) -> dict:
+    path = os.path.join(directory, f"{profile}-{int(group_commit)}.db")
+    engine = create_db_engine(f"sqlite:///{path}", profile, pool_size=writers + readers + 1)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    committer = GroupCommitter(SessionLocal) if group_commit else None
+
+    stop = threading.Event()
+    writes = [0] * writers
+    read_latencies = [[] for _ in range(readers)]
+
+    def write(index: int):
+        order_id = index
+        while not stop.is_set():
+            order = ItemOrder(
+                id=order_id, side="Bid", kind="Limit", price=100, quantity=1, remaining=1,
+                item_id=order_id % 10, user_id=1,
+            )
+            if committer is not None:
+                committer.submit(lambda session, order=order: session.add(order)).result()
+            else:
+                with SessionLocal() as session:
+                    session.add(order)
+                    session.commit()
+            writes[index] += 1
+            order_id += writers
+
+    def read(index: int):
+        while not stop.is_set():
+            started = time.perf_counter()
+            with SessionLocal() as session:
+                session.query(ItemOrder).filter(ItemOrder.item_id == index % 10) \
+                    .order_by(ItemOrder.id.desc()).limit(100).all()
+            read_latencies[index].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if committer is not None:
+        committer.shutdown()
+    engine.dispose()
+
+    latencies = sorted(l for per_reader in read_latencies for l in per_reader)
+    return {
+        "profile": profile,
+        "group_commit": group_commit,
+        "writes_per_s": sum(writes) / seconds,
+        "reads_per_s": len(latencies) / seconds,
+        "read_p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "read_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'group':>7}{'writes/s':>11}{'reads/s':>10}{'read p50 ms':>13}{'read p99 ms':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for profile, group_commit in CONFIGS:
+            r = run(profile, group_commit, args.writers, args.readers, args.seconds, directory)
+            print(
+                f"{r['profile']:<10}{str(r['group_commit']):>7}{r['writes_per_s']:>11.0f}{r['reads_per_s']:>10.0f}"
+                f"{r['read_p50_ms']:>13.2f}{r['read_p99_ms']:>13.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
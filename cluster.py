@@ -0,0 +1,295 @@
+"""Run the order book as several matching processes behind one HTTP router.
+
+Items are split across worker processes by `item_id % workers`; each worker runs main:app on a
+Unix socket and keeps the books and trade aggregates of its own items only. The router forwards
+order entry, cancels and per-item reads to the item's worker, merges the market summary of all
+workers, sends a user's mass cancel to every worker, and sends everything else to worker 0. All
+workers share the one database, so items, users and order or trade lists without an item_id read
+the same rows from worker 0, but /metrics is worker 0's alone: its counters and latencies only
+cover the orders of worker 0's items. Run from the repository root:
+
+    python cluster.py --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from itertools import chain, islice
+from typing import List, Optional, Sequence, Union
+
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import websockets
+except ImportError:  # optional: only needed to proxy the /ws/book/ feeds
+    websockets = None
+
+from encoding import JSON, dumps
+from partitions import PARTITION_HEADER, Partition
+
+# Headers that describe one connection rather than the message, so they are not forwarded
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+              "transfer-encoding", "upgrade", "host"}
+WORKER_START_SECONDS = 30
+# Every worker answers these for its own items, as JSON lists in item id order
+GATHERED = {"/items/summary"}
+
+
+def target(method: str, path: str, query, body: bytes, workers: int) -> Optional[int]:
+    """The worker that must serve a request, or None when it spans several workers.
+
+    Requests that can't be parsed go to worker 0, which rejects them the usual way.
+    """
+    partition = Partition(count=workers)
+    parts = path.strip("/").split("/")
+    if len(parts) == 2 and parts[0] == "book":
+        return owner_of(partition, parts[1])
+    if len(parts) == 3 and parts[0] == "items" and parts[2] in ("stats", "candles", "analytics"):
+        return owner_of(partition, parts[1])
+    if len(parts) == 3 and parts[:2] == ["ws", "book"]:
+        return owner_of(partition, parts[2])
+    if method == "GET" and path in ("/orders/", "/trades/"):
+        return owner_of(partition, query.get("item_id"))
+    if method != "POST" or path not in ("/orders/", "/orders/delete/", "/orders/batch", "/orders/cancel"):
+        return 0
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return 0
+    if not isinstance(payload, dict):
+        return 0
+    if path == "/orders/":
+        return owner_of(partition, payload.get("item_id"))
+    if path == "/orders/cancel":
+        # Without an item the user's orders may be anywhere, see `broadcast_cancel`
+        return owner_of(partition, payload.get("item_id")) if payload.get("item_id") is not None else None
+    if path == "/orders/delete/":
+        # Order ids are numbered in the residue class of their item's partition
+        order_id = as_int(payload.get("order_id"))
+        return 0 if order_id is None else partition.order_owner(order_id)
+
+    owners = set()
+    for order in payload.get("orders") or []:
+        if isinstance(order, dict):
+            owners.add(owner_of(partition, order.get("item_id")))
+    for order_id in payload.get("cancel_order_ids") or []:
+        order_id = as_int(order_id)
+        owners.add(0 if order_id is None else partition.order_owner(order_id))
+    if len(owners) > 1:
+        return None
+    return owners.pop() if owners else 0
+
+
+def owner_of(partition: Partition, item_id) -> int:
+    item_id = as_int(item_id)
+    return 0 if item_id is None else partition.owner(item_id)
+
+
+def as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def create_router(
+    transports: Sequence[httpx.AsyncBaseTransport], sockets: Optional[Sequence[str]] = None
+) -> Starlette:
+    """An app forwarding each request to the worker behind the matching transport.
+
+    `sockets` are the workers' Unix socket paths, needed to proxy the book feeds.
+    """
+    clients = [httpx.AsyncClient(transport=t, base_url="http://worker", timeout=None) for t in transports]
+
+    async def send(worker: int, request: Request, body: bytes) -> httpx.Response:
+        upstream = clients[worker].build_request(
+            request.method,
+            httpx.URL(path=request.url.path, query=request.url.query.encode()),
+            headers=[(k, v) for k, v in request.headers.raw if k.decode().lower() not in HOP_BY_HOP],
+            content=body,
+        )
+        return await clients[worker].send(upstream, stream=True)
+
+    async def send_all(request: Request, body: bytes) -> Union[List[httpx.Response], Response]:
+        """Every worker's response, or the first that failed."""
+        responses = await asyncio.gather(*(send(worker, request, body) for worker in range(len(clients))))
+        try:
+            for response in responses:
+                await response.aread()
+                if response.status_code != 200:
+                    return Response(response.content, response.status_code, media_type=response.headers.get("content-type"))
+        finally:
+            for response in responses:
+                await response.aclose()
+        return responses
+
+    async def gather(request: Request) -> Response:
+        responses = await send_all(request, await request.body())
+        if isinstance(responses, Response):
+            return responses
+        # Each worker returned up to a page of its own items; the page is the first `limit` of them all
+        rows = heapq.merge(*(response.json() for response in responses), key=lambda row: row["item_id"])
+        limit = as_int(request.query_params.get("limit"))
+        rows = list(islice(rows, limit))
+        headers = {"X-Next-After-Id": str(rows[-1]["item_id"])} if limit and len(rows) == limit else {}
+        return Response(dumps(rows), media_type=JSON, headers=headers)
+
+    async def broadcast_cancel(request: Request, body: bytes) -> Response:
+        # Each worker cancels the user's orders on its own items
+        responses = await send_all(request, body)
+        if isinstance(responses, Response):
+            return responses
+        cancelled = sorted(chain.from_iterable(response.json()["cancelled"] for response in responses))
+        return Response(dumps({"cancelled": cancelled}), media_type=JSON)
+
+    async def forward(request: Request) -> Response:
+        if request.method == "GET" and request.url.path in GATHERED:
+            return await gather(request)
+        body = await request.body()
+        worker = target(request.method, request.url.path, request.query_params, body, len(clients))
+        if worker is None and request.url.path == "/orders/cancel":
+            return await broadcast_cancel(request, body)
+        if worker is None:
+            return JSONResponse({"detail": "A batch may only touch items of one partition"}, status_code=400)
+        response = await send(worker, request, body)
+        if response.status_code == 421 and PARTITION_HEADER in response.headers:
+            # e.g. a cancel of an order placed before the items were partitioned
+            await response.aclose()
+            response = await send(int(response.headers[PARTITION_HEADER]) % len(clients), request, body)
+
+        proxied = StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code, background=BackgroundTask(response.aclose)
+        )
+        proxied.raw_headers = [(k, v) for k, v in response.headers.raw if k.decode().lower() not in HOP_BY_HOP]
+        return proxied
+
+    async def feed(websocket: WebSocket):
+        if websockets is None or not sockets:
+            await websocket.close(code=1011, reason="Book feeds need the websockets package on the router")
+            return
+        worker = target("GET", websocket.url.path, websocket.query_params, b"", len(clients))
+        try:
+            upstream = await websockets.unix_connect(sockets[worker], f"ws://worker{websocket.url.path}")
+        except (OSError, websockets.exceptions.InvalidHandshake):
+            await websocket.close(code=4404, reason="Item not found")
+            return
+        await websocket.accept()
+
+        async def downstream():
+            async for message in upstream:
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+
+        async def requests():
+            while True:
+                await upstream.send(await websocket.receive_text())
+
+        tasks = {asyncio.create_task(downstream()), asyncio.create_task(requests())}
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+            try:
+                await websocket.close()
+            except (RuntimeError, WebSocketDisconnect):
+                pass  # the client already went away
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        yield
+        for client in clients:
+            await client.aclose()
+
+    methods = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+    return Starlette(
+        routes=[WebSocketRoute("/ws/book/{item_id}", feed), Route("/{path:path}", forward, methods=methods)],
+        lifespan=lifespan,
+    )
+
+
+def router_from_env() -> Starlette:
+    """Router over the worker sockets listed in CLUSTER_SOCKETS, for `uvicorn --factory`."""
+    sockets = os.environ["CLUSTER_SOCKETS"].split(os.pathsep)
+    return create_router([httpx.AsyncHTTPTransport(uds=path) for path in sockets], sockets)
+
+
+def start_workers(count: int, socket_dir: str) -> List[subprocess.Popen]:
+    journal_dir = os.getenv("JOURNAL_DIR")
+    processes = []
+    for index in range(count):
+        env = dict(os.environ, PARTITION=str(index), PARTITIONS=str(count))
+        # Every worker commits to the same SQLite file, so they need to write in as few transactions as possible
+        env.setdefault("GROUP_COMMIT", "1")
+        if journal_dir:
+            env["JOURNAL_DIR"] = os.path.join(journal_dir, f"partition-{index}")
+        socket = os.path.join(socket_dir, f"worker-{index}.sock")
+        if os.path.exists(socket):
+            os.unlink(socket)
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--uds", socket, "--log-level", "warning"], env=env,
+        ))
+    return processes
+
+
+def wait_for_sockets(processes: List[subprocess.Popen], sockets: List[str]):
+    deadline = time.monotonic() + WORKER_START_SECONDS
+    while not all(os.path.exists(socket) for socket in sockets):
+        if any(process.poll() is not None for process in processes):
+            raise SystemExit("A matching worker exited during startup")
+        if time.monotonic() > deadline:
+            raise SystemExit("Matching workers did not start")
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="matching processes")
+    parser.add_argument("--router-workers", type=int, default=1, help="processes running the router")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket-dir", help="where the workers' Unix sockets go; a new temporary directory by default")
+    args = parser.parse_args()
+
+    import uvicorn
+    import models  # noqa: F401  registers the tables
+    from database import Base, engine
+    from migrations import upgrade
+
+    # Create and migrate the schema once, before the workers race to do it
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+    engine.dispose()
+
+    socket_dir = args.socket_dir or tempfile.mkdtemp(prefix="orderbook-")
+    processes = start_workers(args.workers, socket_dir)
+    try:
+        sockets = [os.path.join(socket_dir, f"worker-{index}.sock") for index in range(args.workers)]
+        wait_for_sockets(processes, sockets)
+        os.environ["CLUSTER_SOCKETS"] = os.pathsep.join(sockets)
+        uvicorn.run("cluster:router_from_env", factory=True, host=args.host, port=args.port, workers=args.router_workers)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,153 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional
 
-DATABASE_URL = "sqlite:///./items.db"
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./items.db")
+# "async" serves requests with AsyncSession over aiosqlite; "sync" uses blocking sessions on the threadpool
+DB_MODE = os.getenv("DB_MODE", "sync")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+# Connection settings applied to every pooled connection; see STORAGE_PROFILES
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "wal")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+
+STORAGE_PROFILES = {
+    # SQLite's defaults: rollback journal, so a commit blocks every reader
+    "default": {},
+    # Readers never wait for the writer, and commits only sync the WAL at checkpoints
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,  # KiB
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 5_000,  # ms
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def create_db_engine(url: str = DATABASE_URL, profile: str = STORAGE_PROFILE, **kwargs) -> Engine:
+    pragmas = _profile_pragmas(profile, url, kwargs)
+    db_engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+    _set_pragmas(db_engine, pragmas)
+    return db_engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL, profile: str = STORAGE_PROFILE, **kwargs) -> AsyncEngine:
+    pragmas = _profile_pragmas(profile, url, kwargs)
+    db_engine = create_async_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+    _set_pragmas(db_engine.sync_engine, pragmas)
+    return db_engine
+
+
+def _profile_pragmas(profile: str, url: str, kwargs: dict) -> dict:
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Storage profile must be one of {', '.join(STORAGE_PROFILES)}")
+    pragmas = STORAGE_PROFILES[profile]
+    if pragmas and ":memory:" not in url and "poolclass" not in kwargs:
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+    return pragmas
+
+
+def _set_pragmas(db_engine: Engine, pragmas: dict):
+    if not pragmas:
+        return
+
+    @event.listens_for(db_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+engine = create_db_engine()
+# The async engine needs aiosqlite, so it is only created when async mode is selected
+async_engine = create_async_db_engine() if DB_MODE == "async" else None
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 Base = declarative_base()
+
+_STOP = object()
+
+
+class GroupCommitter:
+    """Applies writes from concurrent requests on one session and commits them together.
+
+    Each write is a function of the session. Whatever has queued up while the previous
+    transaction was committing goes into the next one, so a burst of orders costs one
+    commit (and one sync) instead of one each. If the transaction fails, every write in
+    it fails with the same error.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, max_batch: int = 256):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.failures = 0  # transactions that failed and were rolled back
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def shutdown(self):
+        with self._start_lock:
+            if self._thread is not None:
+                self._queue.put(_STOP)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, write: Callable[[Session], object]) -> Future:
+        """Queue `write`; the future resolves once the transaction containing it commits."""
+        self.start()
+        future: Future = Future()
+        self._queue.put((future, write))
+        return future
+
+    def drain(self):
+        """Wait until everything submitted so far is committed."""
+        self.submit(lambda session: None).result()
+
+    def _work(self):
+        while True:
+            batch: List[tuple] = []
+            task = self._queue.get()
+            while task is not _STOP:
+                batch.append(task)
+                if len(batch) == self.max_batch:
+                    break
+                try:
+                    task = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(batch)
+            if task is _STOP:
+                return
+
+    def _commit(self, batch: List[tuple]):
+        results = []
+        with self.session_factory() as session:
+            try:
+                for _, write in batch:
+                    results.append(write(session))
+                session.commit()
+            except BaseException as e:
+                session.rollback()
+                self.failures += 1
+                for future, _ in batch:
+                    future.set_exception(e)
+                return
+        for (future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is slower but produces the same JSON
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed to serve application/msgpack
+    msgpack = None
+
+# Media types for list responses. The columnar ones send the field names once, then one
+# array per row, which is smaller and faster to decode for bots reading whole books.
+JSON = "application/json"
+COLUMNS_JSON = "application/vnd.orderbook.columns+json"
+MSGPACK = "application/msgpack"
+
+
+def media_types() -> List[str]:
+    return [JSON, COLUMNS_JSON] + ([MSGPACK] if msgpack is not None else [])
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Pick a response media type for an Accept header; None when none offered is acceptable."""
+    if not accept:
+        return JSON
+    offered = media_types()
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_range, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media_range.lower()))
+    for _, _, media_range in sorted(ranges):
+        if media_range in ("*/*", "application/*"):
+            return JSON
+        if media_range in offered:
+            return media_range
+    return None
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+def encode_rows(fields: Sequence[str], rows: List[list], media_type: str) -> bytes:
+    """Encode column tuples as JSON objects, or as a columnar table for the compact media types."""
+    if media_type == JSON:
+        return dumps([dict(zip(fields, row)) for row in rows])
+    table = {"columns": list(fields), "rows": rows}
+    if media_type == MSGPACK:
+        return msgpack.packb(table, default=_default)
+    return dumps(table)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
@@ -1,7 +1,7 @@
 'use client'
 
 import React, {useState, useEffect} from "react";
-import {User, Item} from "@/lib/interfaces";
+import {User, Item, ItemSummary} from "@/lib/interfaces";
 import {UserSelect} from "@/components/UserSelect";
 import {AddUserButton} from "@/components/AddUserButton";
 import {AddItemButton} from "@/components/AddItemButton";
@@ -10,6 +10,7 @@ import {ItemCard} from "@/components/ItemCard";
 export default function Dashboard() {
     const [selectedUser, setSelectedUser] = useState<User | null>(null);
     const [items, setItems] = useState<Item[]>([]);
+    const [summaries, setSummaries] = useState<Record<number, ItemSummary>>({});
 
     useEffect(() => {
         async function fetchItems() {
@@ -18,11 +19,22 @@ export default function Dashboard() {
             setItems(data);
         }
 
+        // Book tops and trade stats of every item in one request, instead of two per card
+        async function fetchSummaries() {
+            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/items/summary`);
+            const data: ItemSummary[] = await res.json();
+            setSummaries(Object.fromEntries(data.map((summary) => [summary.item_id, summary])));
+        }
+
         fetchItems();
+        fetchSummaries();
     }, []);
 
-    function handleItemAdded(newItem: Item) {
+    async function handleItemAdded(newItem: Item) {
         setItems((prev) => [...prev, newItem]);
+        const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/items/summary?item_ids=${newItem.id}`);
+        const data: ItemSummary[] = await res.json();
+        setSummaries((prev) => ({...prev, ...Object.fromEntries(data.map((summary) => [summary.item_id, summary]))}));
     }
 
     return (
@@ -46,7 +58,7 @@ export default function Dashboard() {
                         </h2>
                         <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-4">
                             {items.map((item) => (
-                                <ItemCard key={item.id} item={item} user={selectedUser}/>
+                                <ItemCard key={item.id} item={item} user={selectedUser} summary={summaries[item.id]}/>
                             ))}
                         </div>
                     </>
@@ -2,7 +2,7 @@
 
 import React, { useEffect, useState } from "react";
 import { Card, CardContent } from "@/components/ui/card";
-import { Item, Order, OrderType, OrderKind, Trade, User } from "@/lib/interfaces";
+import { Book, Item, ItemSummary, Order, TradeStats, User } from "@/lib/interfaces";
 import { CreateOrderButton } from "@/components/CreateOrderButton";
 import { ViewOrdersButton } from "@/components/ViewOrdersButton";
 import { ViewTradesButton } from "@/components/ViewTradesButton";
@@ -10,11 +10,10 @@ import { ViewTradesButton } from "@/components/ViewTradesButton";
 interface ItemCardProps {
     item: Item;
     user: User | null;
+    summary?: ItemSummary;
 }
 
-export function ItemCard({ item, user }: ItemCardProps) {
-    const [orders, setOrders] = useState<Order[]>([]);
-    const [trades, setTrades] = useState<Trade[]>([]);
+export function ItemCard({ item, user, summary }: ItemCardProps) {
     const [avgPrice, setAvgPrice] = useState<string>("Loading...");
     const [stats, setStats] = useState({
         tradeCount: 0,
@@ -24,85 +23,60 @@ export function ItemCard({ item, user }: ItemCardProps) {
         totalAsks: 0,
     });
 
-    useEffect(() => {
-        async function fetchOrders() {
-            const res = await fetch(
-                `${process.env.NEXT_PUBLIC_API_URL}/orders/?item_id=${item.id}`
-            );
-            const data: Order[] = await res.json();
-            setOrders(data);
-            updateOrderPrice(data);
-            updateOrderStats(data);
-        }
-
-        async function fetchTrades() {
-            const res = await fetch(
-                `${process.env.NEXT_PUBLIC_API_URL}/trades/?item_id=${item.id}`
-            );
-            const data: Trade[] = await res.json();
-            setTrades(data);
-            updateTradeStats(data);
-        }
+    async function fetchBook() {
+        const res = await fetch(
+            `${process.env.NEXT_PUBLIC_API_URL}/book/${item.id}?depth=1`
+        );
+        const data: Book = await res.json();
+        updateOrderPrice(data);
+        updateOrderStats(data);
+    }
 
-        fetchOrders();
-        fetchTrades();
-    }, [item.id]);
+    async function fetchStats() {
+        const res = await fetch(
+            `${process.env.NEXT_PUBLIC_API_URL}/items/${item.id}/stats`
+        );
+        const data: TradeStats = await res.json();
+        updateTradeStats(data);
+    }
 
-    function updateOrderPrice(data: Order[]) {
-        if (data.length === 0) {
+    // The dashboard loads every card's figures at once; a card only fetches its own after an order
+    useEffect(() => {
+        if (!summary) return;
+        updateOrderPrice(summary);
+        updateOrderStats(summary);
+        updateTradeStats(summary);
+    }, [summary]);
+
+    function updateOrderPrice(book: Book | ItemSummary) {
+        if (book.mid_price == null) {
             setAvgPrice("no orders");
             return;
         }
-        const bids = data.filter((o) => o.side === OrderType.Bid && o.price != null).map((o) => o.price as number);
-        const asks = data.filter((o) => o.side === OrderType.Ask && o.price != null).map((o) => o.price as number);
-        const highestBid = bids.length > 0 ? Math.max(...bids) : null;
-        const lowestAsk = asks.length > 0 ? Math.min(...asks) : null;
-
-        if (highestBid !== null && lowestAsk !== null) {
-            setAvgPrice(((highestBid + lowestAsk) / 2).toFixed(2));
-        } else if (highestBid !== null) {
-            setAvgPrice(highestBid.toFixed(2));
-        } else if (lowestAsk !== null) {
-            setAvgPrice(lowestAsk.toFixed(2));
-        } else {
-            setAvgPrice("no orders");
-        }
+        setAvgPrice(book.mid_price.toFixed(2));
     }
 
-    function updateOrderStats(data: Order[]) {
-        const totalBids = data.filter((o) => o.side === OrderType.Bid && o.kind === OrderKind.Limit).length;
-        const totalAsks = data.filter((o) => o.side === OrderType.Ask && o.kind === OrderKind.Limit).length;
-        setStats((prev) => ({ ...prev, totalBids, totalAsks }));
+    function updateOrderStats(book: Book | ItemSummary) {
+        setStats((prev) => ({
+            ...prev,
+            totalBids: book.bid_orders,
+            totalAsks: book.ask_orders,
+            unmatchedOrders: book.bid_orders + book.ask_orders + book.market_bids + book.market_asks,
+        }));
     }
 
-    function updateTradeStats(trades: Trade[]) {
-        if (trades.length === 0) {
-            setStats((prev) => ({
-                ...prev,
-                tradeCount: 0,
-                avgTradePrice: "N/A",
-                unmatchedOrders: orders.length,
-            }));
-            return;
-        }
-
-        const avgTradePrice =
-            trades.reduce((sum, t) => sum + t.price, 0) / trades.length;
-
+    function updateTradeStats(data: TradeStats | ItemSummary) {
         setStats((prev) => ({
             ...prev,
-            tradeCount: trades.length,
-            avgTradePrice: avgTradePrice.toFixed(2),
-            unmatchedOrders: Math.max(orders.length - trades.length, 0),
+            tradeCount: data.trade_count,
+            avgTradePrice: data.average_price == null ? "N/A" : data.average_price.toFixed(2),
         }));
     }
 
     function handleOrderCreated(order: Order) {
-        const updated = [...orders, order];
-        setOrders(updated);
-        updateOrderPrice(updated);
-        updateOrderStats(updated);
-        updateTradeStats(trades);
+        // The new order may have traded, so re-read the aggregated book and stats
+        fetchBook();
+        fetchStats();
     }
 
     return (
@@ -27,10 +27,32 @@ export interface Order {
   side: OrderType;       // Bid or Ask
   kind: OrderKind;       // Limit or Market
   price?: number | null; // Optional because Market orders may not have price
+  quantity: number;
+  remaining: number;     // Quantity not yet filled
   item_id: number;
   user_id: number;
 }
 
+// ---- Book ----
+export interface BookLevel {
+  price: number;
+  quantity: number;      // Aggregated remaining quantity at this price
+  orders: number;
+}
+
+export interface Book {
+  item_id: number;
+  best_bid?: number | null;
+  best_ask?: number | null;
+  mid_price?: number | null;
+  bids: BookLevel[];
+  asks: BookLevel[];
+  bid_orders: number;    // Resting limit orders
+  ask_orders: number;
+  market_bids: number;   // Resting market orders
+  market_asks: number;
+}
+
 
 // ---- Trade ----
 export interface Trade {
@@ -39,4 +61,32 @@ export interface Trade {
   seller_id: number;
   item_id: number;
   price: number;
+  quantity: number;
+  timestamp?: string | null;
+}
+
+export interface TradeStats {
+  item_id: number;
+  trade_count: number;
+  volume: number;
+  average_price?: number | null;
+  vwap?: number | null;
+  last_price?: number | null;
+  high?: number | null;
+  low?: number | null;
+}
+
+export interface ItemSummary {
+  item_id: number;
+  name: string;
+  best_bid?: number | null;
+  best_ask?: number | null;
+  mid_price?: number | null;
+  bid_orders: number;
+  ask_orders: number;
+  market_bids: number;
+  market_asks: number;
+  trade_count: number;
+  average_price?: number | null;
+  last_price?: number | null;
 }
@@ -0,0 +1,392 @@
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from models import OrderType, OrderKind, TimeInForce
+from orderbook import BookOrder, MatchingEngine, MatchResult
+
+# Every record is framed as (crc32 of type+payload, payload length, type) followed by the payload
+FRAME = struct.Struct("<IIB")
+ORDER = struct.Struct("<qqqBBqqqd")  # id, item, user, side, kind, price ticks, quantity, remaining, time
+ORDER_TIF = struct.Struct("<qqqBBqqqdBd")  # as ORDER, then time in force and expiry; for all but plain GTC
+ORDER_STOP = struct.Struct("<qqqBBqqqdBdq")  # as ORDER_TIF, then stop price ticks; for stop orders
+CANCEL = struct.Struct("<qq")  # order id, item id
+TRADE = struct.Struct("<qqqqqqd")  # item, buyer, seller, price ticks, quantity, maker order id, time
+SNAPSHOT_HEADER = struct.Struct("<8sqqq")  # magic, journal offset, next order id, order count
+
+ORDER_RECORD, CANCEL_RECORD, TRADE_RECORD, ORDER_TIF_RECORD, ORDER_STOP_RECORD = 1, 2, 3, 4, 5
+ORDER_RECORDS = (ORDER_RECORD, ORDER_TIF_RECORD, ORDER_STOP_RECORD)
+SNAPSHOT_MAGIC = b"VOBSNAP2"
+# Snapshots and segments from before prices were journaled as integer ticks
+FLOAT_PRICE_MAGIC = b"VOBSNAP1"
+NO_PRICE = -(2 ** 63)  # market orders
+
+SIDES = list(OrderType)
+KINDS = list(OrderKind)
+TIFS = list(TimeInForce)
+EPOCH = datetime(1970, 1, 1)
+
+SEGMENT_NAME = re.compile(r"journal-(\d{16})\.log$")
+SNAPSHOT_NAME = re.compile(r"snapshot-(\d{16})\.bin$")
+
+
+class Entry(NamedTuple):
+    """Records appended together, and the logical offsets they occupy in the journal."""
+    ticket: int
+    start: int
+    end: int
+
+
+class Journal:
+    """Append-only log of accepted orders, cancels and trades, with periodic book snapshots.
+
+    Records are handed to a background thread that writes whatever has accumulated and
+    fsyncs once per batch (group commit). Callers block on the returned ticket until their
+    records are durable. On startup the books are rebuilt from the latest snapshot plus
+    the journal written after it.
+
+    The journal is written ahead of the database. The transaction that applies an entry
+    also records its offsets, and recovery only replays the entries it is given as
+    committed, so an entry whose transaction failed is skipped.
+    """
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = os.path.abspath(directory)
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending: List[bytes] = []
+        self._appended = 0  # tickets handed out
+        self._durable = 0  # tickets written and synced
+        self._offset = 0  # logical offset of the end of the journal, including pending records
+        self._segment = None
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._waiters: List[Tuple[int, Future]] = []
+
+    # ---- Writing ----
+
+    def start(self):
+        """Open the newest segment for appending and start the writer thread."""
+        segments = self._segments()
+        if segments:
+            start, path = segments[-1]
+            self._segment = open(path, "ab")
+            self._offset = start + self._segment.tell()
+        else:
+            snapshots = self._snapshots()
+            self._offset = snapshots[-1][0] if snapshots else 0
+            self._open_segment(self._offset)
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        if self._segment is not None:
+            self._segment.close()
+
+    def append(self, records: List[bytes]) -> int:
+        """Queue records for the next group commit; an empty list just requests a sync."""
+        return self.append_entry(records).ticket
+
+    def append_entry(self, records: List[bytes]) -> Entry:
+        """Like `append`, also returning where the records will be, for a transaction to confirm."""
+        with self._cond:
+            start = self._offset
+            self._pending.extend(records)
+            self._offset += sum(len(r) for r in records)
+            self._appended += 1
+            self._cond.notify_all()
+            return Entry(self._appended, start, self._offset)
+
+    def wait(self, ticket: int):
+        with self._cond:
+            while self._durable < ticket and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def durable(self, ticket: int) -> Future:
+        """A future that resolves once `ticket` is durable, for callers that can't block."""
+        future: Future = Future()
+        with self._cond:
+            if self._error is not None:
+                future.set_exception(self._error)
+            elif self._durable >= ticket:
+                future.set_result(None)
+            else:
+                self._waiters.append((ticket, future))
+        return future
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self._durable == self._appended and not self._closed:
+                    self._cond.wait()
+                if self._durable == self._appended:
+                    return
+                batch, self._pending = self._pending, []
+                ticket = self._appended
+            try:
+                self._segment.write(b"".join(batch))
+                self._segment.flush()
+                if self.fsync:
+                    os.fsync(self._segment.fileno())
+            except BaseException as e:
+                with self._cond:
+                    self._error = e
+                    for _, future in self._waiters:
+                        future.set_exception(e)
+                    self._waiters = []
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = ticket
+                waiting = []
+                for waiter in self._waiters:
+                    if waiter[0] <= ticket:
+                        waiter[1].set_result(None)
+                    else:
+                        waiting.append(waiter)
+                self._waiters = waiting
+                self._cond.notify_all()
+
+    def _open_segment(self, start: int):
+        self._segment = open(os.path.join(self.directory, f"journal-{start:016d}.log"), "ab")
+
+    # ---- Snapshots ----
+
+    def snapshot(self, engine: MatchingEngine) -> int:
+        """Write every resting order and start a new segment; returns the snapshot's offset.
+
+        Nothing may be matching while this runs, e.g. hold every sequencer writer.
+        """
+        self.wait(self.append([]))
+        with self._cond:
+            offset = self._offset
+            self._segment.close()
+            self._open_segment(offset)
+
+        orders = [o for book in list(engine.books.values()) for o in book.resting_orders()]
+        orders.sort(key=lambda o: o.id)
+        path = os.path.join(self.directory, f"snapshot-{offset:016d}.bin")
+        with open(path + ".tmp", "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, offset, engine.peek_next_id(), len(orders)))
+            for order in orders:
+                f.write(encode_order(order, order.remaining))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._prune(offset)
+        return offset
+
+    def _prune(self, offset: int):
+        # Segments that end before the new snapshot are no longer needed for recovery
+        for start, path in self._segments():
+            if start < offset:
+                os.remove(path)
+        for snapshot_offset, path in self._snapshots()[:-1]:
+            os.remove(path)
+
+    # ---- Recovery ----
+
+    def recover(self, engine: MatchingEngine, committed: Optional[Sequence[Tuple[int, int]]] = None) -> bool:
+        """Rebuild the engine from the latest snapshot and the journal after it.
+
+        `committed` holds the (start, end) offsets of the entries whose transactions committed,
+        in order. When it is given only their orders and cancels are replayed.
+
+        Returns False when there is no snapshot yet, or when a committed entry is missing from
+        the journal because it was lost in a crash after its transaction committed. The caller
+        then loads the books some other way and takes a new snapshot.
+        """
+        snapshots = self._snapshots()
+        if not snapshots:
+            return False
+        offset, path = snapshots[-1]
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, offset, next_id, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic == FLOAT_PRICE_MAGIC:
+            raise ValueError(f"{path} has float prices; remove {self.directory} to rebuild it from the database")
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a journal snapshot")
+        records = memoryview(data)[SNAPSHOT_HEADER.size:]
+        orders = [decode_order(records, position, record_type)[0] for record_type, position, _ in iter_records(records)]
+        if len(orders) != count:
+            raise ValueError(f"{path} is truncated or corrupt")
+        engine.load(orders)
+
+        last_id = next_id - 1
+        journal_end = offset
+        for start, segment in self._segments():
+            if start < offset:
+                continue
+            segment_last_id, journal_end = self._replay(segment, start, engine, committed)
+            last_id = max(last_id, segment_last_id)
+        if committed and max(end for _, end in committed) > journal_end:
+            return False
+        engine.reserve_ids(last_id)
+        return True
+
+    def _replay(
+        self, path: str, start: int, engine: MatchingEngine, committed: Optional[Sequence[Tuple[int, int]]]
+    ) -> Tuple[int, int]:
+        """Replay a segment; returns the last order id in it and the offset where it ends."""
+        starts = [entry_start for entry_start, _ in committed] if committed is not None else None
+        last_id = 0
+        end = 0
+        size = os.path.getsize(path)
+        if size:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for record_type, position, end in iter_records(data):
+                    if starts is not None:
+                        # Entries are contiguous and don't overlap, so at most one can hold the record
+                        index = bisect_right(starts, start + position) - 1
+                        if index < 0 or start + position >= committed[index][1]:
+                            continue
+                    if record_type in ORDER_RECORDS:
+                        order, timestamp = decode_order(data, position, record_type)
+                        engine.submit(
+                            item_id=order.item_id,
+                            user_id=order.user_id,
+                            side=order.side,
+                            kind=order.kind,
+                            price=order.price,
+                            quantity=order.quantity,
+                            timestamp=timestamp,
+                            order_id=order.id,
+                            time_in_force=order.time_in_force,
+                            expires_at=order.expires_at,
+                            stop_price=order.stop_price,
+                        )
+                        last_id = max(last_id, order.id)
+                    elif record_type == CANCEL_RECORD:
+                        order_id, _ = CANCEL.unpack_from(data, position)
+                        engine.cancel(order_id)
+        if end < size:
+            # Drop a record torn by a crash mid-write so new records follow the last good one
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        return last_id, start + end
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        return self._list(SEGMENT_NAME)
+
+    def _snapshots(self) -> List[Tuple[int, str]]:
+        return self._list(SNAPSHOT_NAME)
+
+    def _list(self, pattern) -> List[Tuple[int, str]]:
+        found = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+
+
+def iter_records(data) -> Iterator[Tuple[int, int, int]]:
+    """Yield (type, payload offset, end offset) for each intact record in `data`."""
+    position = 0
+    size = len(data)
+    while position + FRAME.size <= size:
+        crc, length, record_type = FRAME.unpack_from(data, position)
+        start = position + FRAME.size
+        end = start + length
+        if end > size or zlib.crc32(data[start - 1:end]) != crc:
+            return
+        yield record_type, start, end
+        position = end
+
+
+def _frame(record_type: int, payload: bytes) -> bytes:
+    return FRAME.pack(zlib.crc32(bytes([record_type]) + payload), len(payload), record_type) + payload
+
+
+def _seconds(timestamp: datetime) -> float:
+    return (timestamp - EPOCH).total_seconds()
+
+
+def encode_order(order: BookOrder, remaining: int, timestamp: Optional[datetime] = None) -> bytes:
+    fields = (
+        order.id,
+        order.item_id,
+        order.user_id,
+        SIDES.index(order.side),
+        KINDS.index(order.kind),
+        NO_PRICE if order.price is None else order.price,
+        order.quantity,
+        remaining,
+        _seconds(timestamp) if timestamp else 0.0,
+    )
+    if order.time_in_force == TimeInForce.GTC and order.stop_price is None:
+        return _frame(ORDER_RECORD, ORDER.pack(*fields))
+    fields += (TIFS.index(order.time_in_force), _seconds(order.expires_at) if order.expires_at else 0.0)
+    if order.stop_price is None:
+        return _frame(ORDER_TIF_RECORD, ORDER_TIF.pack(*fields))
+    # Triggered stops keep their stop price, so snapshots write them as stop records too
+    return _frame(ORDER_STOP_RECORD, ORDER_STOP.pack(*fields, order.stop_price))
+
+
+def decode_order(data, position: int, record_type: int = ORDER_RECORD) -> Tuple[BookOrder, Optional[datetime]]:
+    stop_price = None
+    if record_type == ORDER_STOP_RECORD:
+        *fields, time_in_force, expires, stop_price = ORDER_STOP.unpack_from(data, position)
+        time_in_force = TIFS[time_in_force]
+    elif record_type == ORDER_TIF_RECORD:
+        *fields, time_in_force, expires = ORDER_TIF.unpack_from(data, position)
+        time_in_force = TIFS[time_in_force]
+    else:
+        fields, time_in_force, expires = ORDER.unpack_from(data, position), TimeInForce.GTC, 0.0
+    order_id, item_id, user_id, side, kind, price, quantity, remaining, seconds = fields
+    order = BookOrder(
+        id=order_id,
+        item_id=item_id,
+        user_id=user_id,
+        side=SIDES[side],
+        kind=KINDS[kind],
+        price=None if price == NO_PRICE else price,
+        quantity=quantity,
+        remaining=remaining,
+        time_in_force=time_in_force,
+        expires_at=EPOCH + timedelta(seconds=expires) if expires else None,
+        stop_price=stop_price,
+    )
+    return order, EPOCH + timedelta(seconds=seconds) if seconds else None
+
+
+def encode_cancel(order_id: int, item_id: int) -> bytes:
+    return _frame(CANCEL_RECORD, CANCEL.pack(order_id, item_id))
+
+
+def match_records(result: MatchResult) -> List[bytes]:
+    """The accepted order, as submitted, followed by the trades it printed.
+
+    The stop orders it triggered are not journaled again: replaying the order triggers them the
+    same way. Their trades are.
+    """
+    records = [encode_order(result.order, result.order.quantity, result.timestamp)]
+    for step in result.cascade():
+        for fill in step.fills:
+            records.append(_frame(TRADE_RECORD, TRADE.pack(
+                result.order.item_id,
+                fill.buyer_id,
+                fill.seller_id,
+                fill.price,
+                fill.quantity,
+                fill.maker_id,
+                _seconds(result.timestamp),
+            )))
+    return records
@@ -1,28 +1,216 @@
-from typing import List, Optional
+import asyncio
+import heapq
+import math
+import os
+import time
+from concurrent.futures import Future
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-from fastapi import FastAPI, Depends, Query, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, Query, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import delete, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette.middleware.cors import CORSMiddleware
 
-from database import SessionLocal, engine
+import analytics
+from admission import Admission
+from archive import TradeArchive, archive_trades
+from encoding import JSON, dumps, encode_rows, negotiate
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine, GroupCommitter, DB_MODE
+from journal import Entry, Journal, encode_cancel, match_records
+from marketfeed import MarketFeed, Subscription, book_snapshot, match_events
+from metrics import Gauge, Metrics, PhaseTimer, intake_depths, resting_orders
+from migrations import upgrade
 from models import *
-from schemas import ItemOut, ItemCreate, OrderOut, OrderCreate, UserOut, UserCreate, TradeOut, DeleteOrderRequest
+from orderbook import MatchingEngine, MatchResult, PriceLevel, limit_price, stop_price
+from partitions import PARTITION_HEADER, Partition
+from readcache import CachedResponse, ReadCache
+from sequencer import OrderSequencer
+from ticks import tick_decimals, to_price
+from tradestats import Candle, TradeStats, INTERVALS
+from schemas import ItemOut, ItemCreate, OrderOut, OrderCreate, UserOut, UserCreate, TradeOut, DeleteOrderRequest, \
+    OrderBatch, OrderBatchOut, OrderBatchResult, BookOut, BookLevel, TradeStatsOut, CandleOut, ItemSummaryOut, \
+    MassCancelRequest, MassCancelOut, AnalyticsOut, DepthPoint, PriceVolume, VwapWindow, OrderPlacedOut
+
+# Upper bound for a single page of /orders/ or /trades/, and the fetch size when streaming
+MAX_PAGE_SIZE = 10_000
+STREAM_CHUNK_SIZE = 1_000
+# Writer threads for the order sequencer; each item is always matched by the same one
+MATCHING_WORKERS = int(os.getenv("MATCHING_WORKERS", "4"))
+# Directory for the order journal and book snapshots; unset keeps the database as the only record
+JOURNAL_DIR = os.getenv("JOURNAL_DIR")
+JOURNAL_SNAPSHOT_SECONDS = float(os.getenv("JOURNAL_SNAPSHOT_SECONDS", "300"))
+# Coalesce the commits of concurrent POST /orders/ calls into shared transactions; async mode always does
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+# Requests carrying this header get their phase timings back in a Server-Timing header
+PROFILE_HEADER = "X-Profile"
+# Rendered GET responses kept for revalidation and repeat reads; 0 disables the cache
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "1024"))
+# Directory for trades moved out of the database once older than TRADE_ARCHIVE_DAYS; unset keeps them all
+TRADE_ARCHIVE_DIR = os.getenv("TRADE_ARCHIVE_DIR")
+TRADE_ARCHIVE_DAYS = float(os.getenv("TRADE_ARCHIVE_DAYS", "30"))
+TRADE_ARCHIVE_SECONDS = float(os.getenv("TRADE_ARCHIVE_SECONDS", "3600"))
+# How often GTD orders past their expiry are taken off the books
+ORDER_EXPIRY_SECONDS = float(os.getenv("ORDER_EXPIRY_SECONDS", "1"))
+# Admission control for POST /orders/: orders in flight per item, how long one may wait for
+# its item's writer, and each user's sustained orders per second and burst. 0 turns a limit off.
+ORDER_QUEUE_DEPTH = int(os.getenv("ORDER_QUEUE_DEPTH", "1000"))
+ORDER_QUEUE_MAX_AGE = float(os.getenv("ORDER_QUEUE_MAX_AGE", "2"))
+USER_ORDER_RATE = float(os.getenv("USER_ORDER_RATE", "0"))
+USER_ORDER_BURST = float(os.getenv("USER_ORDER_BURST", "0"))
+# What a refused order is told to wait when only the load, not its user, is to blame
+QUEUE_RETRY_SECONDS = 1
+
+# PARTITION/PARTITIONS pick the items this process matches when cluster.py runs several
+partition = Partition.from_env()
+matching_engine = MatchingEngine(id_step=partition.count, id_offset=partition.index)
+trade_stats = TradeStats()
+market_feed = MarketFeed()
+metrics = Metrics()
+read_cache = ReadCache(READ_CACHE_SIZE)
+sequencer = OrderSequencer(workers=MATCHING_WORKERS, stride=partition.count)
+journal = Journal(JOURNAL_DIR) if JOURNAL_DIR else None
+committer = GroupCommitter(SessionLocal) if GROUP_COMMIT or DB_MODE == "async" else None
+trade_archive = TradeArchive(TRADE_ARCHIVE_DIR) if TRADE_ARCHIVE_DIR else None
+admission = Admission(USER_ORDER_RATE, USER_ORDER_BURST, ORDER_QUEUE_DEPTH, ORDER_QUEUE_MAX_AGE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prepare_database()
+    # Rebuild the in-memory books and trade aggregates from the database
+    db = SessionLocal()
+    try:
+        # With a journal the books come from its latest snapshot and tail instead of the orders table
+        committed = committed_entries(db, journal) if journal is not None else None
+        recovered = journal is not None and journal.recover(matching_engine, committed)
+        if not recovered:
+            matching_engine.load(partition_orders(db))
+        # Archived trades are older than every trade left in the table
+        archived = trade_archive.scan(partition) if trade_archive is not None else ()
+        trade_stats.load(chain(
+            archived,
+            db.query(Trade.item_id, Trade.price, Trade.quantity, Trade.timestamp)
+            .filter(Trade.item_id % partition.count == partition.index)
+            .order_by(Trade.id),
+        ))
+    finally:
+        db.close()
+    sequencer.start()
+    background = []
+    if journal is not None:
+        journal.start()
+        # A journal from before entries were confirmed gets a snapshot that later recoveries start from
+        if not recovered or committed is None:
+            snapshot_journal()
+        background.append(asyncio.create_task(snapshot_periodically()))
+    if trade_archive is not None:
+        background.append(asyncio.create_task(archive_periodically()))
+    background.append(asyncio.create_task(expire_periodically()))
+    yield
+    for task in background:
+        task.cancel()
+    sequencer.shutdown()
+    if committer is not None:
+        committer.shutdown()
+    if journal is not None:
+        journal.close()
+    if async_engine is not None:
+        # aiosqlite connections run on their own threads, which would keep the process alive
+        await async_engine.dispose()
+
+
+def prepare_database():
+    # Done at startup rather than on import, so importing main never creates or migrates a database
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+
+def partition_orders(db: Session):
+    return db.query(ItemOrder).filter(ItemOrder.item_id % partition.count == partition.index).order_by(ItemOrder.id)
+
+
+def committed_entries(db: Session, journal: Journal) -> Optional[List[Tuple[int, int]]]:
+    """Offsets of the journal's committed entries, or None for a journal from before they were kept."""
+    entries = db.query(JournalEntry.start, JournalEntry.end).filter(JournalEntry.journal == journal.directory)
+    return [tuple(entry) for entry in entries.order_by(JournalEntry.start)] or None
+
+
+def snapshot_journal():
+    # Park every writer so the snapshot sees no order halfway through matching
+    with sequencer.exclusive_all():
+        books = matching_engine
+        if committer is not None:
+            committer.drain()
+            if committer.failures:
+                # The books of a failed transaction are rolled back by its request, which may be
+                # waiting for these writers, so snapshot what the database committed instead
+                books = MatchingEngine(id_step=partition.count, id_offset=partition.index)
+                with SessionLocal() as db:
+                    books.load(partition_orders(db))
+                books.reserve_ids(matching_engine.peek_next_id() - 1)
+        offset = journal.snapshot(books)
+        with SessionLocal() as db:
+            settle_entries(db, journal, offset)
+            db.commit()
+
+
+def settle_entries(db: Session, journal: Journal, offset: int):
+    """Forget the entries a snapshot at `offset` covers, leaving an empty one at it.
+
+    The empty entry tells recovery that this journal's entries are confirmed, even when none
+    has been written since the snapshot.
+    """
+    db.query(JournalEntry).filter(JournalEntry.journal == journal.directory, JournalEntry.end <= offset) \
+        .delete(synchronize_session=False)
+    db.add(JournalEntry(journal=journal.directory, start=offset, end=offset))
+
+
+async def snapshot_periodically():
+    while True:
+        await asyncio.sleep(JOURNAL_SNAPSHOT_SECONDS)
+        await run_in_threadpool(snapshot_journal)
+
+
+def archive_old_trades():
+    before = utcnow() - timedelta(days=TRADE_ARCHIVE_DAYS)
+    with SessionLocal() as db:
+        archived = archive_trades(db, trade_archive, before, partition)
+    for item_id in archived:
+        read_cache.bump(item_scope(item_id))
+
+
+async def archive_periodically():
+    while True:
+        await run_in_threadpool(archive_old_trades)
+        await asyncio.sleep(TRADE_ARCHIVE_SECONDS)
+
+
+async def expire_periodically():
+    while True:
+        await asyncio.sleep(ORDER_EXPIRY_SECONDS)
+        await run_in_threadpool(
+            expire_orders, matching_engine, sequencer, SessionLocal, committer, journal, market_feed, read_cache, metrics
+        )
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI()
 
 origins = [
     "http://localhost:3000",  # React dev server
     "http://localhost",       # fallback
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,          # or ["*"] to allow all
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# create_app() mounts the handlers for one DB_MODE next to the routes both modes share
+routes = APIRouter()
+sync_routes = APIRouter()
+async_routes = APIRouter()
 
 
 def get_db():
@@ -32,375 +220,1713 @@ def get_db():
     finally:
         db.close()
 
-@app.post("/items/", response_model=ItemOut)
-def create_item(item: ItemCreate, db: Session = Depends(get_db)):
-    db_item = Item(name=item.name, description=item.description)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_matching_engine():
+    return matching_engine
+
+
+def get_trade_stats():
+    return trade_stats
+
+
+def get_market_feed():
+    return market_feed
+
+
+def get_sequencer():
+    return sequencer
+
+
+def get_journal():
+    return journal
+
+
+def get_committer():
+    return committer
+
+
+def get_metrics():
+    return metrics
+
+
+def get_read_cache():
+    return read_cache
+
+
+def get_partition():
+    return partition
+
+
+def get_trade_archive():
+    return trade_archive
+
+
+def get_admission():
+    return admission
+
+
+# Read cache scopes: the item and user lists, and everything read for one item
+ITEMS_SCOPE = "items"
+USERS_SCOPE = "users"
+
+
+def item_scope(item_id: int) -> tuple:
+    return "item", item_id
+
+
+def cached_read(
+    request: Request, read_cache: ReadCache, scope, media_type: str = JSON
+) -> Tuple[int, Optional[Response]]:
+    """Answer a GET from the read cache if possible, else return the version to cache it under."""
+    version = read_cache.version(scope)
+    key = cache_key(request, media_type)
+    etag = read_cache.etag(key, version)
+    if request.headers.get("if-none-match") == etag:
+        return version, Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    cached = read_cache.get(key, version)
+    if cached is not None:
+        return version, cached_response(cached, etag)
+    return version, None
+
+
+def cache_read(
+    request: Request, read_cache: ReadCache, version: int, body: bytes, media_type: str = JSON, headers=None
+) -> Response:
+    cached = CachedResponse(body, media_type, headers or {})
+    key = cache_key(request, media_type)
+    read_cache.put(key, version, cached)
+    return cached_response(cached, read_cache.etag(key, version))
+
+
+def cache_key(request: Request, media_type: str) -> tuple:
+    return request.url.path, request.url.query, media_type
+
+
+def cached_response(cached: CachedResponse, etag: str) -> Response:
+    return Response(
+        cached.body, media_type=cached.media_type, headers={**cached.headers, "ETag": etag, "Vary": "Accept"}
+    )
+
+
+def list_media_type(request: Request) -> str:
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail="Not Acceptable")
+    return media_type
+
+
+# List endpoints select these columns as plain tuples and encode them straight to bytes,
+# skipping ORM entities and per-row Pydantic models. Field order matches the schemas.
+ITEM_FIELDS = ("name", "description", "tick_size", "id")
+USER_FIELDS = ("name", "id")
+ORDER_FIELDS = (
+    "id", "side", "kind", "item_id", "user_id", "price", "quantity", "remaining", "time_in_force", "expires_at",
+    "stop_price",
+)
+TRADE_FIELDS = ("id", "buyer_id", "seller_id", "item_id", "price", "quantity", "timestamp")
+ITEM_COLUMNS = [getattr(Item, f) for f in ITEM_FIELDS]
+USER_COLUMNS = [getattr(User, f) for f in USER_FIELDS]
+ORDER_COLUMNS = [getattr(ItemOrder, f) for f in ORDER_FIELDS]
+TRADE_COLUMNS = [getattr(Trade, f) for f in TRADE_FIELDS]
+# Columns stored in ticks
+ORDER_PRICES = (ORDER_FIELDS.index("price"), ORDER_FIELDS.index("stop_price"))
+TRADE_PRICES = (TRADE_FIELDS.index("price"),)
+
+BOOK = TypeAdapter(BookOut)
+SUMMARIES = TypeAdapter(List[ItemSummaryOut])
+NO_TOP = (None, None, 0, 0, 0, 0)  # an item nobody has ordered yet
+
+
+def priced_rows(rows: Iterable, price_indexes: Tuple[int, ...], tick_size: float) -> Iterator[list]:
+    """Column tuples as lists, with the prices converted from ticks."""
+    decimals = tick_decimals(tick_size)
+    for row in rows:
+        yield priced_row(row, price_indexes, tick_size, decimals)
+
+
+def priced_row(row, price_indexes: Tuple[int, ...], tick_size: float, decimals: int) -> list:
+    row = list(row)
+    for index in price_indexes:
+        if row[index] is not None:
+            row[index] = round(row[index] * tick_size, decimals)
+    return row
+
+
+@sync_routes.post("/items/", response_model=ItemOut)
+def create_item(
+    item: ItemCreate, db: Session = Depends(get_db), read_cache: ReadCache = Depends(get_read_cache)
+):
+    db_item = Item(name=item.name, description=item.description, tick_size=item.tick_size)
     db.add(db_item)
     db.commit()
+    read_cache.bump(ITEMS_SCOPE)
     db.refresh(db_item)
     return db_item
 
 
-@app.get("/items/", response_model=list[ItemOut])
-def read_items(db: Session = Depends(get_db)):
-    return db.query(Item).all()
+@sync_routes.get("/items/", response_model=list[ItemOut])
+def read_items(request: Request, db: Session = Depends(get_db), read_cache: ReadCache = Depends(get_read_cache)):
+    media_type = list_media_type(request)
+    version, cached = cached_read(request, read_cache, ITEMS_SCOPE, media_type)
+    if cached is not None:
+        return cached
+    rows = [list(row) for row in db.query(*ITEM_COLUMNS).order_by(Item.id)]
+    return cache_read(request, read_cache, version, encode_rows(ITEM_FIELDS, rows, media_type), media_type)
+
+
+@sync_routes.get("/items/summary", response_model=List[ItemSummaryOut])
+def get_items_summary(
+    item_ids: Optional[List[int]] = Query(None),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    partition: Partition = Depends(get_partition),
+):
+    items = db.execute(summary_items_query(partition, item_ids, after_id, limit)).all()
+    tops = {}
+    for future in read_tops(sequencer, matching_engine, [item_id for item_id, _, _ in items]):
+        tops.update(future.result())
+    return summary_response(items, tops, trade_stats, limit)
+
+
+def summary_items_query(partition: Partition, item_ids: Optional[List[int]], after_id: Optional[int], limit: Optional[int]):
+    # In a cluster each worker summarizes the items it matches and the router merges the pages
+    query = select(Item.id, Item.name, Item.tick_size).where(Item.id % partition.count == partition.index)
+    if item_ids:
+        query = query.where(Item.id.in_(item_ids))
+    return paginate(query, Item.id, after_id, limit)
+
+
+def read_tops(sequencer: OrderSequencer, matching_engine: MatchingEngine, item_ids: List[int]) -> List[Future]:
+    """Top of book of many items, read on their writer threads with one task per thread."""
+    shards = defaultdict(list)
+    for item_id in item_ids:
+        shards[sequencer.shard(item_id)].append(item_id)
+    return [sequencer.submit(ids[0], book_tops, matching_engine, ids) for ids in shards.values()]
+
+
+def book_tops(matching_engine: MatchingEngine, item_ids: List[int]) -> dict:
+    tops = {}
+    for item_id in item_ids:
+        book = matching_engine.books.get(item_id)
+        if book is None:
+            continue
+        best_bid, best_ask = book.bids.best_level(), book.asks.best_level()
+        tops[item_id] = (
+            best_bid.price if best_bid else None,
+            best_ask.price if best_ask else None,
+            book.bids.order_count,
+            book.asks.order_count,
+            len(book.market_bids),
+            len(book.market_asks),
+        )
+    return tops
+
+
+def summary_response(items: list, tops: dict, trade_stats: TradeStats, limit: Optional[int]) -> Response:
+    summaries = []
+    for item_id, name, tick_size in items:
+        best_bid, best_ask, bid_orders, ask_orders, market_bids, market_asks = tops.get(item_id, NO_TOP)
+        stats = trade_stats.get(item_id)
+        best_bid, best_ask = to_price(best_bid, tick_size), to_price(best_ask, tick_size)
+        summaries.append(ItemSummaryOut(
+            item_id=item_id,
+            name=name,
+            best_bid=best_bid,
+            best_ask=best_ask,
+            mid_price=mid_price(best_bid, best_ask),
+            bid_orders=bid_orders,
+            ask_orders=ask_orders,
+            market_bids=market_bids,
+            market_asks=market_asks,
+            trade_count=stats.trade_count,
+            average_price=to_price(stats.average_price, tick_size),
+            last_price=to_price(stats.last_price, tick_size),
+        ))
+    return Response(SUMMARIES.dump_json(summaries), media_type=JSON, headers=next_page(items, limit))
+
+
+@sync_routes.get("/items/{item_id}/stats", response_model=TradeStatsOut)
+def get_item_stats(
+    item_id: int,
+    db: Session = Depends(get_db),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    return stats_response(item_id, trade_stats, found_item(db.get(Item, item_id)).tick_size)
+
+
+def found_item(item: Optional[Item]) -> Item:
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return item
+
+
+def check_owner(partition: Partition, item_id: int):
+    # Only the owner holds the item's book and trade aggregates; the cluster router retries there
+    if not partition.owns(item_id):
+        raise HTTPException(
+            status_code=421,
+            detail="Item is matched by another partition",
+            headers={PARTITION_HEADER: str(partition.owner(item_id))},
+        )
+
+
+def stats_response(item_id: int, trade_stats: TradeStats, tick_size: float) -> TradeStatsOut:
+    stats = trade_stats.get(item_id)
+    return TradeStatsOut(
+        item_id=item_id,
+        trade_count=stats.trade_count,
+        volume=stats.volume,
+        average_price=to_price(stats.average_price, tick_size),
+        vwap=to_price(stats.vwap, tick_size),
+        last_price=to_price(stats.last_price, tick_size),
+        high=to_price(stats.high, tick_size),
+        low=to_price(stats.low, tick_size),
+    )
+
+
+@sync_routes.get("/items/{item_id}/candles", response_model=List[CandleOut])
+def get_item_candles(
+    item_id: int,
+    interval: str = "1m",
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    check_interval(interval)
+    item = found_item(db.get(Item, item_id))
+
+    return candles_response(trade_stats.candles(item_id, interval, limit), item.tick_size)
+
+
+def check_interval(interval: str):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Interval must be one of {', '.join(INTERVALS)}")
+
+
+def candles_response(candles: List[Candle], tick_size: float) -> List[CandleOut]:
+    return [
+        CandleOut(
+            start=c.start,
+            open=to_price(c.open, tick_size),
+            high=to_price(c.high, tick_size),
+            low=to_price(c.low, tick_size),
+            close=to_price(c.close, tick_size),
+            volume=c.volume,
+            trades=c.trades,
+        )
+        for c in candles
+    ]
+
+
+@routes.get("/items/{item_id}/analytics", response_model=AnalyticsOut)
+def get_item_analytics(
+    item_id: int,
+    interval: str = "1h",
+    levels: Optional[int] = Query(None, ge=1),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    trade_archive: Optional[TradeArchive] = Depends(get_trade_archive),
+    partition: Partition = Depends(get_partition),
+):
+    """Depth curves, spread and imbalance of the book, and VWAP and volume at price of the trades.
 
+    Loads the item's resting orders and its trades in [start, end), archived ones included, into
+    NumPy columns. Sync in both modes since the work is all in NumPy.
+    """
+    if not analytics.available():
+        raise HTTPException(status_code=501, detail="Analytics need the numpy package")
+    check_owner(partition, item_id)
+    check_interval(interval)
+    item = found_item(db.get(Item, item_id))
+    book = analytics.book_summary(analytics.load_book(db, item_id), levels)
+    trades = analytics.load_trades(db, item_id, utc(start), utc(end), trade_archive)
+
+    tick_size, decimals = item.tick_size, tick_decimals(item.tick_size)
+    depth = lambda prices, quantities: [
+        DepthPoint(price=price, quantity=quantity)
+        for price, quantity in zip(analytics.to_prices(prices, tick_size, decimals), quantities.tolist())
+    ]
+    traded_prices, volumes = analytics.volume_at_price(trades)
+    window_starts, vwaps, window_volumes = analytics.vwap(trades, INTERVALS[interval])
+    return AnalyticsOut(
+        item_id=item_id,
+        best_bid=to_price(book["best_bid"], tick_size),
+        best_ask=to_price(book["best_ask"], tick_size),
+        spread=to_price(book["spread"], tick_size),
+        imbalance=book["imbalance"],
+        bids=depth(*book["bids"]),
+        asks=depth(*book["asks"]),
+        trade_count=len(trades),
+        volume=int(volumes.sum()),
+        vwap=to_price(analytics.total_vwap(trades), tick_size),
+        volume_at_price=[
+            PriceVolume(price=price, volume=volume)
+            for price, volume in zip(analytics.to_prices(traded_prices, tick_size, decimals), volumes.tolist())
+        ],
+        vwap_windows=[
+            VwapWindow(start=window, vwap=to_price(vwap, tick_size), volume=volume)
+            for window, vwap, volume in zip(window_starts.tolist(), vwaps.tolist(), window_volumes.tolist())
+        ],
+    )
 
-@app.post("/users/", response_model=UserOut)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+
+@sync_routes.post("/users/", response_model=UserOut)
+def create_user(
+    user: UserCreate, db: Session = Depends(get_db), read_cache: ReadCache = Depends(get_read_cache)
+):
     db_user = User(name=user.name)
     db.add(db_user)
     db.commit()
+    read_cache.bump(USERS_SCOPE)
     db.refresh(db_user)
     return db_user
 
 
-@app.get("/users/", response_model=List[UserOut])
-def get_users(db: Session = Depends(get_db)):
-    return db.query(User).all()
+@sync_routes.get("/users/", response_model=List[UserOut])
+def get_users(request: Request, db: Session = Depends(get_db), read_cache: ReadCache = Depends(get_read_cache)):
+    media_type = list_media_type(request)
+    version, cached = cached_read(request, read_cache, USERS_SCOPE, media_type)
+    if cached is not None:
+        return cached
+    rows = [list(row) for row in db.query(*USER_COLUMNS).order_by(User.id)]
+    return cache_read(request, read_cache, version, encode_rows(USER_FIELDS, rows, media_type), media_type)
+
+
+@sync_routes.get("/users/{user_id}/orders", response_model=List[OrderOut])
+def get_user_orders(
+    request: Request,
+    user_id: int,
+    item_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    media_type = list_media_type(request)
+    if db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    orders = list(item_priced_rows(db.execute(user_orders_query(user_id, item_id, after_id, limit)), ORDER_PRICES))
+    return Response(encode_rows(ORDER_FIELDS, orders, media_type), media_type=media_type, headers=next_page(orders, limit))
+
+
+@sync_routes.get("/users/{user_id}/trades", response_model=List[TradeOut])
+def get_user_trades(
+    request: Request,
+    user_id: int,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    media_type = list_media_type(request)
+    if db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    trades = list(item_priced_rows(db.execute(user_trades_query(user_id, after_id, limit)), TRADE_PRICES))
+    return Response(encode_rows(TRADE_FIELDS, trades, media_type), media_type=media_type, headers=next_page(trades, limit))
+
+
+# A user's orders and trades span items, and so tick sizes; each row carries its item's as a last column.
+# They are not read-cached: fills change the counterparties' views too, on whichever process matched them.
+def user_orders_query(user_id: int, item_id: Optional[int], after_id: Optional[int], limit: Optional[int]):
+    query = select(*ORDER_COLUMNS, Item.tick_size).join(Item, Item.id == ItemOrder.item_id)
+    query = query.where(ItemOrder.user_id == user_id)
+    if item_id is not None:
+        query = query.where(ItemOrder.item_id == item_id)
+    return paginate(query, ItemOrder.id, after_id, limit)
+
+
+def user_trades_query(user_id: int, after_id: Optional[int], limit: Optional[int]):
+    # One keyset page from each side's index, merged; an OR of the two would scan and sort instead
+    sides = [
+        select(paginate(select(*TRADE_COLUMNS).where(column == user_id), Trade.id, after_id, limit).subquery())
+        for column in (Trade.buyer_id, Trade.seller_id)
+    ]
+    trades = union(*sides).subquery()
+    query = select(trades, Item.tick_size).join(Item, Item.id == trades.c.item_id)
+    return paginate(query, trades.c.id, None, limit)
+
+
+def item_priced_rows(rows: Iterable, price_indexes: Tuple[int, ...]) -> Iterator[list]:
+    """Like priced_rows, for rows ending in their item's tick size, which is dropped."""
+    decimals = {}
+    for row in rows:
+        *row, tick_size = row
+        if tick_size not in decimals:
+            decimals[tick_size] = tick_decimals(tick_size)
+        yield priced_row(row, price_indexes, tick_size, decimals[tick_size])
+
+
+class Admitted(NamedTuple):
+    """A request let through admission, and when it was on the admission clock.
 
+    Handlers take their order or batch from here: declared again as a parameter, the body would be
+    validated, and its errors reported, twice.
+    """
+    body: Union[OrderCreate, OrderBatch]
+    at: float
 
-@app.post("/orders/", response_model=OrderOut)
-def create_order(order: OrderCreate, db: Session = Depends(get_db)):
-    # Validate item & user
-    item = db.query(Item).filter(Item.id == order.item_id).first()
-    if not item:
+
+def admit_order(
+    order: OrderCreate, admission: Admission = Depends(get_admission), metrics: Metrics = Depends(get_metrics)
+) -> Iterator[Admitted]:
+    """Turn an order away in memory, before it opens a database session, when its item's queue is
+    full or its user is over their rate."""
+    if not admission.enter(order.item_id):
+        metrics.rejected_orders.inc(reason="queue_full")
+        raise rejected(503, "Too many orders waiting for this item", QUEUE_RETRY_SECONDS)
+    try:
+        wait = admission.take(order.user_id)
+        if wait is not None:
+            metrics.rejected_orders.inc(reason="rate_limited")
+            raise rejected(429, "Order rate limit exceeded", wait)
+        yield Admitted(order, admission.clock())
+    finally:
+        admission.leave(order.item_id)
+
+
+def admit_batch(
+    batch: OrderBatch, admission: Admission = Depends(get_admission), metrics: Metrics = Depends(get_metrics)
+) -> Iterator[Admitted]:
+    """Admit a batch like its orders sent one by one: it takes a place in the queue of every item
+    it places orders for, and tokens from every user's bucket."""
+    entered = []
+    try:
+        for item_id in sorted({o.item_id for o in batch.orders}):
+            if not admission.enter(item_id):
+                metrics.rejected_orders.inc(len(batch.orders), reason="queue_full")
+                raise rejected(503, "Too many orders waiting for this item", QUEUE_RETRY_SECONDS)
+            entered.append(item_id)
+        for user_id, count in Counter(o.user_id for o in batch.orders).items():
+            wait = admission.take(user_id, count)
+            if wait is not None:
+                metrics.rejected_orders.inc(count, reason="rate_limited")
+                raise rejected(429, "Order rate limit exceeded", wait)
+        yield Admitted(batch, admission.clock())
+    finally:
+        for item_id in entered:
+            admission.leave(item_id)
+
+
+def check_fresh(admission: Admission, metrics: Metrics, admitted: float, orders: int = 1):
+    """Refuse orders that waited so long for their item's writer that the book has moved on."""
+    if admission.stale(admitted):
+        metrics.rejected_orders.inc(orders, reason="stale")
+        raise rejected(503, "Order waited too long to be matched", QUEUE_RETRY_SECONDS)
+
+
+def rejected(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+@sync_routes.post("/orders/", response_model=OrderPlacedOut)
+def create_order(
+    request: Request,
+    response: Response,
+    admitted: Admitted = Depends(admit_order),
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: Optional[GroupCommitter] = Depends(get_committer),
+    metrics: Metrics = Depends(get_metrics),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+    admission: Admission = Depends(get_admission),
+):
+    order = admitted.body
+    timer = PhaseTimer(metrics.order_phase_seconds)
+    with timer.phase("validate"):
+        check_owner(partition, order.item_id)
+        # Validate item & user
+        item = db.query(Item).filter(Item.id == order.item_id).first()
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        user = db.query(User).filter(User.id == order.user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        prices = order_prices(order, item.tick_size)
+
+    def process() -> Tuple[MatchResult, Optional[Future], Optional[Entry]]:
+        timer.record("queue", time.perf_counter() - queued)
+        check_fresh(admission, metrics, admitted.at)
+        with timer.phase("match"):
+            result = submit_order(matching_engine, order, prices)
+        entry = journal_entry(journal, match_records(result))
+        if committer is not None:
+            # The writer moves on to the next order while the committer batches this one
+            committed = committer.submit(lambda session: persist_journaled(session, result, journal, entry))
+        else:
+            try:
+                with timer.phase("persist"):
+                    persist_journaled(db, result, journal, entry)
+                with timer.phase("commit"):
+                    db.commit()
+            except Exception:
+                db.rollback()
+                reload_book(db, matching_engine, order.item_id)
+                raise
+            committed = None
+        with timer.phase("publish"):
+            announce_match(result, item.tick_size, trade_stats, market_feed, metrics)
+        return result, committed, entry
+
+    # Match in memory on the item's writer thread; the database only records the outcome
+    queued = time.perf_counter()
+    # Cached reads of the item go stale once the match is committed, or rolled back
+    with bumping(read_cache, [item_scope(order.item_id)]):
+        result, committed, entry = sequencer.run(order.item_id, process)
+        if committed is not None:
+            try:
+                with timer.phase("commit"):
+                    committed.result()
+            except Exception:
+                sequencer.run(order.item_id, reload_book, db, matching_engine, order.item_id)
+                raise
+    # Wait for the journal fsync off the writer thread so later orders can share it
+    with timer.phase("journal"):
+        wait_durable(journal, entry)
+    return finish_order(result, item.tick_size, timer, request, response, metrics)
+
+
+@routes.post("/orders/batch", response_model=OrderBatchOut)
+def create_order_batch(
+    admitted: Admitted = Depends(admit_batch),
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: Optional[GroupCommitter] = Depends(get_committer),
+    metrics: Metrics = Depends(get_metrics),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+    admission: Admission = Depends(get_admission),
+):
+    batch = admitted.body
+    # Validate every referenced row up front with one IN query per table
+    item_ids = {o.item_id for o in batch.orders}
+    for item_id in item_ids:
+        check_owner(partition, item_id)
+    tick_sizes = dict(db.query(Item.id, Item.tick_size).filter(Item.id.in_(item_ids)).all())
+    if item_ids - tick_sizes.keys():
         raise HTTPException(status_code=404, detail="Item not found")
-    user = db.query(User).filter(User.id == order.user_id).first()
-    if not user:
+    user_ids = {o.user_id for o in batch.orders}
+    if user_ids - {u for (u,) in db.query(User.id).filter(User.id.in_(user_ids))}:
         raise HTTPException(status_code=404, detail="User not found")
+    cancel_ids = set(batch.cancel_order_ids)
+    # Finds the items to hold; the cancels are checked again once their writers are held
+    cancelled = db.query(ItemOrder.id, ItemOrder.item_id).filter(ItemOrder.id.in_(cancel_ids)).all()
+    if len(cancelled) != len(cancel_ids):
+        raise HTTPException(status_code=404, detail="Order not found")
+    for _, item_id in cancelled:
+        check_owner(partition, item_id)
 
-    # ---- MARKET ORDERS ----
-    if order.kind == OrderKind.Market:
-        if order.side == OrderType.Bid:
-            # Match buy market against lowest-price sell limit
-            best_ask = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Ask)
-                .filter(ItemOrder.kind == OrderKind.Limit)
-                .order_by(ItemOrder.price.asc())
-                .first()
-            )
-            if best_ask:
-                # Ensure buyer and seller are different
-                if order.user_id == best_ask.user_id:
-                    # Create an ItemOrder without making a trade
-                    db_order = ItemOrder(
-                        side=order.side,
-                        kind=order.kind,
-                        price=None,
-                        item_id=order.item_id,
-                        user_id=order.user_id,
+    prices = [order_prices(order, tick_sizes[order.item_id]) for order in batch.orders]
+
+    # Cancels go first so a requote can replace its own resting orders. The batch holds the
+    # writers of every item it touches so it can be committed as one transaction.
+    touched = item_ids | {item_id for _, item_id in cancelled}
+    with sequencer.exclusive(touched), bumping(read_cache, map(item_scope, touched)):
+        check_fresh(admission, metrics, admitted.at, len(batch.orders))
+        if committer is not None:
+            # Earlier orders for these items may not have reached the database yet
+            committer.drain()
+        try:
+            if cancel_ids:
+                # Only what is still resting now that the batch holds the writers counts as cancelled
+                cancelled = db.execute(
+                    delete(ItemOrder).where(ItemOrder.id.in_(cancel_ids)).returning(ItemOrder.id, ItemOrder.item_id)
+                ).all()
+                if len(cancelled) != len(cancel_ids):
+                    raise HTTPException(status_code=404, detail="Order not found")
+                for order_id, _ in cancelled:
+                    matching_engine.cancel(order_id)
+            matched = [match_order(db, matching_engine, order, p) for order, p in zip(batch.orders, prices)]
+            records = [encode_cancel(order_id, item_id) for order_id, item_id in cancelled]
+            entry = journal_entry(journal, records + [r for result, _ in matched for r in match_records(result)])
+            confirm_entry(db, journal, entry)
+            db.flush()
+            response = OrderBatchOut(
+                cancelled=sorted(order_id for order_id, _ in cancelled),
+                results=[
+                    OrderBatchResult(
+                        order=order_response(result, tick_sizes[result.order.item_id]),
+                        trades=[trade_out(t, tick_sizes[t.item_id]) for t in trades],
                     )
-                    db.add(db_order)
-                    db.commit()
-                    db.refresh(db_order)
-                    return db_order
-
-                trade = Trade(
-                    buyer_id=order.user_id,
-                    seller_id=best_ask.user_id,
-                    item_id=order.item_id,
-                    price=best_ask.price,
-                )
-                db.add(trade)
-                db.delete(best_ask)
-                db.commit()
-                db.refresh(trade)
-                # return a pseudo order
-                return OrderOut(
-                    id=-1,
-                    side=order.side,
-                    kind=order.kind,
-                    price=best_ask.price,
-                    item_id=order.item_id,
-                    user_id=order.user_id,
-                )
-
-        elif order.side == OrderType.Ask:
-            # Match sell market against highest-price buy limit
-            best_bid = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Bid)
-                .filter(ItemOrder.kind == OrderKind.Limit)
-                .order_by(ItemOrder.price.desc())
-                .first()
+                    for result, trades in matched
+                ],
             )
-            if best_bid:
-                # Ensure buyer and seller are different
-                if order.user_id == best_bid.user_id:
-                    # Create an ItemOrder without making a trade
-                    db_order = ItemOrder(
-                        side=order.side,
-                        kind=order.kind,
-                        price=None,
-                        item_id=order.item_id,
-                        user_id=order.user_id,
-                    )
-                    db.add(db_order)
-                    db.commit()
-                    db.refresh(db_order)
-                    return db_order
-
-                trade = Trade(
-                    buyer_id=best_bid.user_id,
-                    seller_id=order.user_id,
-                    item_id=order.item_id,
-                    price=best_bid.price,
-                )
-                db.add(trade)
-                db.delete(best_bid)
-                db.commit()
-                db.refresh(trade)
-                return OrderOut(
-                    id=-1,
-                    side=order.side,
-                    kind=order.kind,
-                    price=best_bid.price,
-                    item_id=order.item_id,
-                    user_id=order.user_id,
-                )
-
-        # If no limit orders exist → keep the market order in the book
-        db_order = ItemOrder(
-            side=order.side,
-            kind=order.kind,
-            price=None,
-            item_id=order.item_id,
-            user_id=order.user_id,
+            db.commit()
+        except Exception:
+            db.rollback()
+            for item_id in touched:
+                reload_book(db, matching_engine, item_id)
+            raise
+        for order_id, item_id in cancelled:
+            market_feed.publish(item_id, [{"type": "order_removed", "order_id": order_id}])
+        for result, _ in matched:
+            record_trades(trade_stats, result)
+            metrics.record_match(result)
+            market_feed.publish(result.order.item_id, match_events(result, tick_sizes[result.order.item_id]))
+
+    wait_durable(journal, entry)
+    return response
+
+
+@contextmanager
+def bumping(read_cache: ReadCache, scopes: Iterable):
+    """Bump the scopes' versions when the block exits, however it exits."""
+    try:
+        yield
+    finally:
+        for scope in scopes:
+            read_cache.bump(scope)
+
+
+def finish_order(
+    result: MatchResult, tick_size: float, timer: PhaseTimer, request: Request, response: Response, metrics: Metrics
+) -> OrderPlacedOut:
+    with timer.phase("respond"):
+        out = order_response(result, tick_size)
+    metrics.order_seconds.observe(timer.elapsed())
+    if PROFILE_HEADER in request.headers:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return out
+
+
+def order_prices(order: OrderCreate, tick_size: float) -> Tuple[Optional[int], Optional[int]]:
+    """The order's limit and stop prices in ticks."""
+    try:
+        return limit_price(order.kind, order.price, tick_size), stop_price(order.kind, order.stop_price, tick_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def announce_match(
+    result: MatchResult, tick_size: float, trade_stats: TradeStats, market_feed: MarketFeed, metrics: Metrics
+):
+    """Aggregate and broadcast a match from its item's writer."""
+    record_trades(trade_stats, result)
+    metrics.record_match(result)
+    market_feed.publish(result.order.item_id, match_events(result, tick_size))
+
+
+def journal_entry(journal: Optional[Journal], records: List[bytes]) -> Optional[Entry]:
+    """Write records ahead of the transaction that applies them, which must `confirm_entry`."""
+    return journal.append_entry(records) if journal is not None else None
+
+
+def confirm_entry(db: Session, journal: Optional[Journal], entry: Optional[Entry]):
+    """Record in the transaction applying a journal entry that it committed.
+
+    Recovery replays only confirmed entries, so the records of a transaction that failed, or
+    never committed before a crash, don't come back.
+    """
+    if entry is not None:
+        db.add(JournalEntry(journal=journal.directory, start=entry.start, end=entry.end))
+
+
+def persist_journaled(db: Session, result: MatchResult, journal: Optional[Journal], entry: Optional[Entry]):
+    persist_match(db, result)
+    confirm_entry(db, journal, entry)
+
+
+def match_order(
+    db: Session, matching_engine: MatchingEngine, order: OrderCreate, prices: Tuple[Optional[int], Optional[int]]
+) -> Tuple[MatchResult, List[Trade]]:
+    result = submit_order(matching_engine, order, prices)
+    return result, persist_match(db, result)
+
+
+def submit_order(
+    matching_engine: MatchingEngine, order: OrderCreate, prices: Tuple[Optional[int], Optional[int]]
+) -> MatchResult:
+    price, stop = prices
+    return matching_engine.submit(
+        item_id=order.item_id,
+        user_id=order.user_id,
+        side=order.side,
+        kind=order.kind,
+        price=price,
+        quantity=order.quantity,
+        time_in_force=order.time_in_force,
+        expires_at=order.expires_at,
+        stop_price=stop,
+    )
+
+
+def persist_match(db: Session, result: MatchResult) -> List[Trade]:
+    trades = []
+    for step in result.cascade():
+        trades += persist_step(db, step, triggered=step is not result)
+    return trades
+
+
+def persist_step(db: Session, result: MatchResult, triggered: bool) -> List[Trade]:
+    book_order = result.order
+    trades = []
+    filled_ids = []
+    if result.fills:
+        # Makers may still be pending inserts from earlier orders in the same batch or cascade
+        db.flush()
+    for fill in result.fills:
+        trade = Trade(
+            buyer_id=fill.buyer_id,
+            seller_id=fill.seller_id,
+            item_id=book_order.item_id,
+            price=fill.price,
+            quantity=fill.quantity,
+            timestamp=result.timestamp,
         )
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-        return db_order
+        db.add(trade)
+        trades.append(trade)
+        if fill.maker_remaining:
+            db.query(ItemOrder).filter(ItemOrder.id == fill.maker_id).update(
+                {ItemOrder.remaining: fill.maker_remaining}, synchronize_session=False
+            )
+        else:
+            filled_ids.append(fill.maker_id)
+    if filled_ids:
+        db.query(ItemOrder).filter(ItemOrder.id.in_(filled_ids)).delete(synchronize_session=False)
+    if triggered:
+        # A triggered stop is already stored; it is now a market or limit order, or gone
+        orders = db.query(ItemOrder).filter(ItemOrder.id == book_order.id)
+        if result.rested:
+            orders.update(
+                {ItemOrder.kind: book_order.kind, ItemOrder.remaining: book_order.remaining}, synchronize_session=False
+            )
+        else:
+            orders.delete(synchronize_session=False)
+    elif result.rested:
+        db.add(ItemOrder(
+            id=book_order.id,
+            side=book_order.side,
+            kind=book_order.kind,
+            price=book_order.price,
+            quantity=book_order.quantity,
+            remaining=book_order.remaining,
+            item_id=book_order.item_id,
+            user_id=book_order.user_id,
+            time_in_force=book_order.time_in_force,
+            expires_at=book_order.expires_at,
+            stop_price=book_order.stop_price,
+        ))
+    return trades
+
 
-    # ---- LIMIT ORDERS ----
-    if order.kind == OrderKind.Limit and order.price is None:
-        raise HTTPException(status_code=400, detail="Limit orders require a price")
+def record_trades(trade_stats: TradeStats, result: MatchResult):
+    for step in result.cascade():
+        for fill in step.fills:
+            trade_stats.record(result.order.item_id, fill.price, fill.quantity, result.timestamp)
 
-    db_order = ItemOrder(
+
+def order_response(result: MatchResult, tick_size: float) -> OrderPlacedOut:
+    book_order = result.order
+    if result.cancelled:
+        # Its time in force dropped what did not fill, so it never rested or was stored and has no id
+        return OrderPlacedOut(**{**dict(order_out(book_order, tick_size)), "id": None}, status=OrderStatus.Cancelled)
+    if book_order.kind == OrderKind.Market and not result.rested:
+        # A filled market order never rests, so return a pseudo order at the trade price
+        return OrderPlacedOut(
+            id=-1,
+            side=book_order.side,
+            kind=book_order.kind,
+            price=to_price(result.fills[-1].price, tick_size) if result.fills else None,
+            quantity=book_order.quantity,
+            remaining=book_order.remaining,
+            item_id=book_order.item_id,
+            user_id=book_order.user_id,
+            time_in_force=book_order.time_in_force,
+            status=OrderStatus.Filled,
+        )
+    status = OrderStatus.Resting if result.rested else OrderStatus.Filled
+    return OrderPlacedOut(**dict(order_out(book_order, tick_size)), status=status)
+
+
+def order_out(order, tick_size: float) -> OrderOut:
+    """A book order, priced in the item's currency."""
+    return OrderOut(
+        id=order.id,
         side=order.side,
         kind=order.kind,
-        price=order.price,
+        price=to_price(order.price, tick_size),
+        quantity=order.quantity,
+        remaining=order.remaining,
         item_id=order.item_id,
         user_id=order.user_id,
+        time_in_force=order.time_in_force,
+        expires_at=order.expires_at,
+        stop_price=to_price(order.stop_price, tick_size),
     )
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-
-    # Try to match if limit
-    if db_order.kind == OrderKind.Limit:
-        if order.side == OrderType.Bid:
-            # First check for opposite Market orders
-            market_ask = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Ask)
-                .filter(ItemOrder.kind == OrderKind.Market)
-                .order_by(ItemOrder.id.asc())  # FIFO
-                .first()
-            )
-            if market_ask:
-                # Ensure buyer and seller are different
-                if db_order.user_id == market_ask.user_id:
-                    # Skip trade creation and keep the order
-                    return OrderOut(
-                        id=db_order.id,
-                        side=db_order.side,
-                        kind=db_order.kind,
-                        price=db_order.price,
-                        item_id=db_order.item_id,
-                        user_id=db_order.user_id,
-                    )
 
-                trade = Trade(
-                    buyer_id=db_order.user_id,
-                    seller_id=market_ask.user_id,
-                    item_id=order.item_id,
-                    price=db_order.price,  # trade at limit price
-                )
-                db.add(trade)
-                db.delete(market_ask)
-                db.delete(db_order)
-                db.commit()
-                db.refresh(trade)
-                return OrderOut(
-                    id=db_order.id,
-                    side=db_order.side,
-                    kind=db_order.kind,
-                    price=db_order.price,
-                    item_id=db_order.item_id,
-                    user_id=db_order.user_id,
-                )
-
-            # If no market ask, check for matching limit asks
-            matching_ask = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Ask)
-                .filter(ItemOrder.kind == OrderKind.Limit)
-                .filter(ItemOrder.price <= order.price)
-                .order_by(ItemOrder.price.asc())
-                .first()
-            )
-            if matching_ask:
-                # Ensure buyer and seller are different
-                if db_order.user_id == matching_ask.user_id:
-                    # Skip trade creation and keep the order
-                    return OrderOut(
-                        id=db_order.id,
-                        side=db_order.side,
-                        kind=db_order.kind,
-                        price=db_order.price,
-                        item_id=db_order.item_id,
-                        user_id=db_order.user_id,
-                    )
 
-                trade = Trade(
-                    buyer_id=db_order.user_id,
-                    seller_id=matching_ask.user_id,
-                    item_id=order.item_id,
-                    price=matching_ask.price,
-                )
-                db.add(trade)
-                db.delete(matching_ask)
-                db.delete(db_order)
-                db.commit()
-                db.refresh(trade)
-                return OrderOut(
-                    id=db_order.id,
-                    side=db_order.side,
-                    kind=db_order.kind,
-                    price=db_order.price,
-                    item_id=db_order.item_id,
-                    user_id=db_order.user_id,
-                )
-
-        elif order.side == OrderType.Ask:
-            # First check for opposite Market orders
-            market_bid = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Bid)
-                .filter(ItemOrder.kind == OrderKind.Market)
-                .order_by(ItemOrder.id.asc())
-                .first()
-            )
-            if market_bid:
-                # Ensure buyer and seller are different
-                if db_order.user_id == market_bid.user_id:
-                    # Skip trade creation and keep the order
-                    return OrderOut(
-                        id=db_order.id,
-                        side=db_order.side,
-                        kind=db_order.kind,
-                        price=db_order.price,
-                        item_id=db_order.item_id,
-                        user_id=db_order.user_id,
-                    )
+def trade_out(trade: Trade, tick_size: float) -> TradeOut:
+    return TradeOut(
+        id=trade.id,
+        buyer_id=trade.buyer_id,
+        seller_id=trade.seller_id,
+        item_id=trade.item_id,
+        price=to_price(trade.price, tick_size),
+        quantity=trade.quantity,
+        timestamp=trade.timestamp,
+    )
+
+
+def wait_durable(journal: Optional[Journal], entry: Optional[Entry]):
+    if entry is not None:
+        journal.wait(entry.ticket)
 
-                trade = Trade(
-                    buyer_id=market_bid.user_id,
-                    seller_id=db_order.user_id,
-                    item_id=order.item_id,
-                    price=db_order.price,  # trade at limit price
-                )
-                db.add(trade)
-                db.delete(market_bid)
-                db.delete(db_order)
-                db.commit()
-                db.refresh(trade)
-                return OrderOut(
-                    id=db_order.id,
-                    side=db_order.side,
-                    kind=db_order.kind,
-                    price=db_order.price,
-                    item_id=db_order.item_id,
-                    user_id=db_order.user_id,
-                )
-
-            # If no market bid, check for matching limit bids
-            matching_bid = (
-                db.query(ItemOrder)
-                .filter(ItemOrder.item_id == order.item_id)
-                .filter(ItemOrder.side == OrderType.Bid)
-                .filter(ItemOrder.kind == OrderKind.Limit)
-                .filter(ItemOrder.price >= order.price)
-                .order_by(ItemOrder.price.desc())
-                .first()
-            )
-            if matching_bid:
-                # Ensure buyer and seller are different
-                if db_order.user_id == matching_bid.user_id:
-                    # Skip trade creation and keep the order
-                    return OrderOut(
-                        id=db_order.id,
-                        side=db_order.side,
-                        kind=db_order.kind,
-                        price=db_order.price,
-                        item_id=db_order.item_id,
-                        user_id=db_order.user_id,
-                    )
 
-                trade = Trade(
-                    buyer_id=matching_bid.user_id,
-                    seller_id=db_order.user_id,
-                    item_id=order.item_id,
-                    price=matching_bid.price,
-                )
-                db.add(trade)
-                db.delete(matching_bid)
-                db.delete(db_order)
-                db.commit()
-                db.refresh(trade)
-                return OrderOut(
-                    id=db_order.id,
-                    side=db_order.side,
-                    kind=db_order.kind,
-                    price=db_order.price,
-                    item_id=db_order.item_id,
-                    user_id=db_order.user_id,
-                )
-
-    return db_order
-
-
-@app.get("/orders/", response_model=List[OrderOut])
-def get_orders(item_id: int = Query(...), user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    query = db.query(ItemOrder).filter(ItemOrder.item_id == item_id)
+def reload_book(db: Session, matching_engine: MatchingEngine, item_id: int):
+    rows = db.query(ItemOrder).filter(ItemOrder.item_id == item_id).order_by(ItemOrder.id)
+    matching_engine.reload_book(item_id, rows)
+
+
+@sync_routes.get("/orders/", response_model=List[OrderOut])
+def get_orders(
+    request: Request,
+    item_id: int = Query(...),
+    user_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: Session = Depends(get_db),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    if not stream:
+        media_type = list_media_type(request)
+        version, cached = cached_read(request, read_cache, item_scope(item_id), media_type)
+        if cached is not None:
+            return cached
+    tick_size = found_item(db.get(Item, item_id)).tick_size
+    query = db.query(*ORDER_COLUMNS).filter(ItemOrder.item_id == item_id)
 
     if user_id is not None:
         query = query.filter(ItemOrder.user_id == user_id)
 
-    orders = query.all()
-    return [
-        OrderOut(
-            id=o.id,
-            side=o.side,
-            kind=o.kind,
-            price=o.price,
-            item_id=o.item_id,
-            user_id=o.user_id,
-        )
-        for o in orders
-    ]
+    query = paginate(query, ItemOrder.id, after_id, limit)
+    if stream:
+        return stream_ndjson(query, ORDER_FIELDS, ORDER_PRICES, tick_size)
+
+    orders = list(priced_rows(query, ORDER_PRICES, tick_size))
+    return cache_read(
+        request, read_cache, version,
+        encode_rows(ORDER_FIELDS, orders, media_type), media_type, next_page(orders, limit),
+    )
+
+
+@sync_routes.get("/trades/", response_model=List[TradeOut])
+def get_trades(
+    request: Request,
+    item_id: int = Query(...),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+    trade_archive: Optional[TradeArchive] = Depends(get_trade_archive),
+):
+    check_owner(partition, item_id)
+    if not stream:
+        media_type = list_media_type(request)
+        version, cached = cached_read(request, read_cache, item_scope(item_id), media_type)
+        if cached is not None:
+            return cached
+    tick_size = found_item(db.get(Item, item_id)).tick_size
+    start, end = utc(start), utc(end)
+    archived = archived_trades(trade_archive, item_id, start, end, after_id, limit)
+    query = trade_window(db.query(*TRADE_COLUMNS).filter(Trade.item_id == item_id), start, end)
+    query = paginate(query, Trade.id, after_id, limit)
+    if stream:
+        return stream_ndjson(query, TRADE_FIELDS, TRADE_PRICES, tick_size, archived, limit)
+
+    trades = list(priced_rows(islice(by_id(archived, query), limit), TRADE_PRICES, tick_size))
+    return cache_read(
+        request, read_cache, version,
+        encode_rows(TRADE_FIELDS, trades, media_type), media_type, next_page(trades, limit),
+    )
 
 
+def utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Timestamps are stored as naive UTC
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
-@app.get("/trades/", response_model=List[TradeOut])
-def get_trades(item_id: int = Query(...),db: Session = Depends(get_db)):
-    return db.query(Trade).filter(Trade.item_id == item_id).all()
 
+def archived_trades(
+    trade_archive: Optional[TradeArchive],
+    item_id: int,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    after_id: Optional[int],
+    limit: Optional[int],
+) -> list:
+    """Archived trades in a time window; a request without one only reads the trades table."""
+    if trade_archive is None or (start is None and end is None):
+        return []
+    return list(islice(trade_archive.read(item_id, start, end, after_id), limit))
 
-@app.post("/orders/delete/")
-def delete_order(request: DeleteOrderRequest, db: Session = Depends(get_db)):
+
+def by_id(archived: Iterable, rows: Iterable) -> Iterator:
+    """Archived and table trades in one id order. Trades left in the table, such as ones without a
+    timestamp, may have lower ids than archived ones, so neither source simply comes first."""
+    return heapq.merge(archived, rows, key=itemgetter(0))
+
+
+def trade_window(query, start: Optional[datetime], end: Optional[datetime]):
+    if start is not None:
+        query = query.where(Trade.timestamp >= start)
+    if end is not None:
+        query = query.where(Trade.timestamp < end)
+    return query
+
+
+def paginate(query, id_column, after_id: Optional[int], limit: Optional[int]):
+    # Keyset pagination: seek past the last id seen instead of using OFFSET
+    query = query.order_by(id_column)
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def next_page(rows: List[list], limit: Optional[int]) -> dict:
+    # Rows are column lists that start with the id
+    if limit is not None and len(rows) == limit:
+        return {"X-Next-After-Id": str(rows[-1][0])}
+    return {}
+
+
+def stream_ndjson(
+    query, fields: Tuple[str, ...], price_indexes: Tuple[int, ...], tick_size: float, archived: Iterable = (),
+    limit: Optional[int] = None,
+) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON, fetching them in chunks from a server-side cursor.
+
+    `archived` trades are merged in with the query's rows by id.
+    """
+    # The request's session is closed once the handler returns, so the stream opens its own
+    bind = query.session.get_bind()
+
+    def lines():
+        with Session(bind=bind) as session:
+            rows = query.with_session(session).execution_options(stream_results=True).yield_per(STREAM_CHUNK_SIZE)
+            for row in priced_rows(islice(by_id(archived, rows), limit), price_indexes, tick_size):
+                yield dumps(dict(zip(fields, row))) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@sync_routes.get("/book/{item_id}", response_model=BookOut)
+def get_book(
+    request: Request,
+    item_id: int,
+    depth: int = Query(10, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    version, cached = cached_read(request, read_cache, item_scope(item_id))
+    if cached is not None:
+        return cached
+    tick_size = found_item(db.get(Item, item_id)).tick_size
+
+    # Reading on the writer thread sees the book between matches, never halfway through one
+    levels = sequencer.run(item_id, read_book, matching_engine, item_id, depth, tick_size)
+    return cache_read(request, read_cache, version, BOOK.dump_json(book_response(item_id, levels)))
+
+
+def read_book(matching_engine: MatchingEngine, item_id: int, depth: int, tick_size: float) -> tuple:
+    book = matching_engine.book(item_id)
+    return (
+        [book_level(l, tick_size) for l in book.bids.levels(depth)],
+        [book_level(l, tick_size) for l in book.asks.levels(depth)],
+        book.bids.order_count,
+        book.asks.order_count,
+        len(book.market_bids),
+        len(book.market_asks),
+    )
+
+
+def book_level(level: PriceLevel, tick_size: float) -> BookLevel:
+    return BookLevel(price=to_price(level.price, tick_size), quantity=level.quantity, orders=len(level))
+
+
+def mid_price(best_bid: Optional[float], best_ask: Optional[float]) -> Optional[float]:
+    if best_bid is not None and best_ask is not None:
+        return (best_bid + best_ask) / 2
+    return best_bid if best_bid is not None else best_ask
+
+
+def book_response(item_id: int, levels: tuple) -> BookOut:
+    bids, asks, bid_orders, ask_orders, market_bids, market_asks = levels
+    best_bid = bids[0].price if bids else None
+    best_ask = asks[0].price if asks else None
+
+    return BookOut(
+        item_id=item_id,
+        best_bid=best_bid,
+        best_ask=best_ask,
+        mid_price=mid_price(best_bid, best_ask),
+        bids=bids,
+        asks=asks,
+        bid_orders=bid_orders,
+        ask_orders=ask_orders,
+        market_bids=market_bids,
+        market_asks=market_asks,
+    )
+
+
+@sync_routes.post("/orders/delete/")
+def delete_order(
+    request: DeleteOrderRequest,
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: Optional[GroupCommitter] = Depends(get_committer),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
     order = db.query(ItemOrder).filter(ItemOrder.id == request.order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    item_id = order.item_id
+    check_owner(partition, item_id)
 
-    db.delete(order)
-    db.commit()
+    def cancel() -> Tuple[bool, Optional[Entry]]:
+        if committer is not None:
+            committer.drain()
+        # The order may have been filled or cancelled while this request waited for the writer
+        if not db.query(ItemOrder).filter(ItemOrder.id == request.order_id).delete(synchronize_session=False):
+            return False, None
+        entry = journal_entry(journal, [encode_cancel(request.order_id, item_id)])
+        try:
+            confirm_entry(db, journal, entry)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        matching_engine.cancel(request.order_id)
+        market_feed.publish(item_id, [{"type": "order_removed", "order_id": request.order_id}])
+        return True, entry
+
+    deleted, entry = sequencer.run(item_id, cancel)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Order not found")
+    read_cache.bump(item_scope(item_id))
+    wait_durable(journal, entry)
     return {"message": "Order deleted successfully"}
+
+
+@routes.post("/orders/cancel", response_model=MassCancelOut)
+def cancel_orders(
+    request: MassCancelRequest,
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: Optional[GroupCommitter] = Depends(get_committer),
+    read_cache: ReadCache = Depends(get_read_cache),
+    metrics: Metrics = Depends(get_metrics),
+    partition: Partition = Depends(get_partition),
+):
+    """Cancel every resting order of a user, of an item, or of a user in one item."""
+    if request.item_id is not None:
+        check_owner(partition, request.item_id)
+        item_ids = {request.item_id}
+    else:
+        item_ids = {item_id for (item_id,) in db.query(ItemOrder.item_id).filter(
+            ItemOrder.user_id == request.user_id, ItemOrder.item_id % partition.count == partition.index
+        ).distinct()}
+    if not item_ids:
+        return MassCancelOut(cancelled=[])
+    where = [ItemOrder.item_id.in_(item_ids)]
+    if request.user_id is not None:
+        where.append(ItemOrder.user_id == request.user_id)
+
+    # Like a batch, hold the writers of every item so the books and the table change together
+    with sequencer.exclusive(item_ids), bumping(read_cache, map(item_scope, item_ids)):
+        if committer is not None:
+            committer.drain()
+        try:
+            cancelled = db.execute(delete(ItemOrder).where(*where).returning(ItemOrder.id, ItemOrder.item_id)).all()
+            entry = journal_entry(journal, [encode_cancel(order_id, item_id) for order_id, item_id in cancelled])
+            confirm_entry(db, journal, entry)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        for order_id, _ in cancelled:
+            matching_engine.cancel(order_id)
+        publish_cancels(market_feed, cancelled)
+        metrics.cancelled_orders.inc(len(cancelled), reason="mass_cancel")
+    wait_durable(journal, entry)
+    return MassCancelOut(cancelled=sorted(order_id for order_id, _ in cancelled))
+
+
+def publish_cancels(market_feed: MarketFeed, cancelled: Iterable[Tuple[int, int]]):
+    by_item = defaultdict(list)
+    for order_id, item_id in cancelled:
+        by_item[item_id].append({"type": "order_removed", "order_id": order_id})
+    for item_id, events in by_item.items():
+        market_feed.publish(item_id, events)
+
+
+def expire_orders(
+    matching_engine: MatchingEngine,
+    sequencer: OrderSequencer,
+    session_factory,
+    committer: Optional[GroupCommitter],
+    journal: Optional[Journal],
+    market_feed: MarketFeed,
+    read_cache: ReadCache,
+    metrics: Metrics,
+    now: Optional[datetime] = None,
+) -> int:
+    """Take every GTD order past its expiry off the books, one task and one DELETE per item.
+
+    Returns how many orders expired.
+    """
+    def expire(item_id: int, order_ids: List[int]) -> Tuple[List[int], Optional[Future]]:
+        expired = [order.id for order in matching_engine.expire(order_ids)]
+        if not expired:
+            return expired, None
+        entry = journal_entry(journal, [encode_cancel(order_id, item_id) for order_id in expired])
+
+        def write(db: Session):
+            delete_orders(db, expired)
+            confirm_entry(db, journal, entry)
+
+        if committer is not None:
+            committed = committer.submit(write)
+        else:
+            with session_factory() as db:
+                try:
+                    write(db)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    reload_book(db, matching_engine, item_id)
+                    raise
+            committed = None
+        publish_cancels(market_feed, [(order_id, item_id) for order_id in expired])
+        return expired, committed
+
+    due = matching_engine.due(now or utcnow())
+    pending = [(item_id, sequencer.submit(item_id, expire, item_id, order_ids)) for item_id, order_ids in due.items()]
+    count = 0
+    for item_id, future in pending:
+        with bumping(read_cache, [item_scope(item_id)]):
+            expired, committed = future.result()
+            if committed is not None:
+                try:
+                    committed.result()
+                except Exception:
+                    sequencer.run(item_id, reload_book_with, committer, matching_engine, item_id)
+                    raise
+        metrics.cancelled_orders.inc(len(expired), reason="expired")
+        count += len(expired)
+    return count
+
+
+def delete_orders(db: Session, order_ids: List[int]):
+    db.query(ItemOrder).filter(ItemOrder.id.in_(order_ids)).delete(synchronize_session=False)
+
+
+@routes.get("/metrics", response_class=PlainTextResponse)
+def get_metrics_text(
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    metrics: Metrics = Depends(get_metrics),
+    admission: Admission = Depends(get_admission),
+):
+    """Prometheus text exposition of order path timings and counters."""
+    resting = Gauge("orderbook_resting_orders", "Orders resting in the book.", lambda: resting_orders(matching_engine))
+    intake = Gauge(
+        "orderbook_intake_depth", "Orders admitted for an item and not yet answered.", lambda: intake_depths(admission)
+    )
+    return PlainTextResponse(metrics.render([resting, intake]), media_type="text/plain; version=0.0.4")
+
+
+@routes.websocket("/ws/book/{item_id}")
+async def book_feed(
+    websocket: WebSocket,
+    item_id: int,
+    db: Session = Depends(get_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    partition: Partition = Depends(get_partition),
+):
+    """Send a sequenced book snapshot, then every order and trade event for the item.
+
+    A client that sees a gap in `seq` sends {"type": "resync"} to receive a fresh snapshot.
+    """
+    item = await run_in_threadpool(db.get, Item, item_id)
+    await run_in_threadpool(db.close)
+    if item is None:
+        await websocket.close(code=4404, reason="Item not found")
+        return
+    if not partition.owns(item_id):
+        await websocket.close(code=4421, reason=f"Item is matched by partition {partition.owner(item_id)}")
+        return
+    await websocket.accept()
+
+    loop = asyncio.get_running_loop()
+    subscription = None
+
+    def take_snapshot():
+        nonlocal subscription
+        if subscription is None:
+            subscription = market_feed.subscribe(item_id, loop)
+        return book_snapshot(matching_engine.book(item_id), market_feed.sequence(item_id), item.tick_size)
+
+    async def send_snapshot() -> int:
+        # Events are only published from the item's writer thread, so a snapshot taken there
+        # can't have an event slip in between the book state and its seq
+        snapshot = await asyncio.wrap_future(sequencer.submit(item_id, take_snapshot))
+        await websocket.send_json(snapshot)
+        return snapshot["seq"]
+
+    async def listen():
+        while True:
+            request = await websocket.receive_json()
+            if request.get("type") == "resync":
+                subscription.request_resync()
+
+    async def pump(last_seq: int):
+        while True:
+            message = await subscription.get()
+            if message is Subscription.RESYNC:
+                last_seq = await send_snapshot()
+            elif message["seq"] > last_seq:
+                await websocket.send_json(message)
+                last_seq = message["seq"]
+
+    try:
+        tasks = {asyncio.create_task(pump(await send_snapshot())), asyncio.create_task(listen())}
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            exception = task.exception()
+            if exception is not None and not isinstance(exception, WebSocketDisconnect):
+                raise exception
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if subscription is not None:
+            market_feed.unsubscribe(subscription)
+
+
+# ---- Async mode ----
+# Handlers await the database, the item's writer and the group committer instead of blocking
+# a threadpool thread, so open requests are limited by memory rather than by threads.
+
+
+@async_routes.post("/items/", response_model=ItemOut)
+async def create_item_async(
+    item: ItemCreate, db: AsyncSession = Depends(get_async_db), read_cache: ReadCache = Depends(get_read_cache)
+):
+    db_item = Item(name=item.name, description=item.description, tick_size=item.tick_size)
+    db.add(db_item)
+    await db.commit()
+    read_cache.bump(ITEMS_SCOPE)
+    await db.refresh(db_item)
+    return db_item
+
+
+@async_routes.get("/items/", response_model=list[ItemOut])
+async def read_items_async(
+    request: Request, db: AsyncSession = Depends(get_async_db), read_cache: ReadCache = Depends(get_read_cache)
+):
+    media_type = list_media_type(request)
+    version, cached = cached_read(request, read_cache, ITEMS_SCOPE, media_type)
+    if cached is not None:
+        return cached
+    rows = [list(row) for row in await db.execute(select(*ITEM_COLUMNS).order_by(Item.id))]
+    return cache_read(request, read_cache, version, encode_rows(ITEM_FIELDS, rows, media_type), media_type)
+
+
+@async_routes.get("/items/summary", response_model=List[ItemSummaryOut])
+async def get_items_summary_async(
+    item_ids: Optional[List[int]] = Query(None),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    partition: Partition = Depends(get_partition),
+):
+    items = (await db.execute(summary_items_query(partition, item_ids, after_id, limit))).all()
+    futures = read_tops(sequencer, matching_engine, [item_id for item_id, _, _ in items])
+    tops = {}
+    for top in await asyncio.gather(*map(asyncio.wrap_future, futures)):
+        tops.update(top)
+    return summary_response(items, tops, trade_stats, limit)
+
+
+@async_routes.get("/items/{item_id}/stats", response_model=TradeStatsOut)
+async def get_item_stats_async(
+    item_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    return stats_response(item_id, trade_stats, found_item(await db.get(Item, item_id)).tick_size)
+
+
+@async_routes.get("/items/{item_id}/candles", response_model=List[CandleOut])
+async def get_item_candles_async(
+    item_id: int,
+    interval: str = "1m",
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    check_interval(interval)
+    item = found_item(await db.get(Item, item_id))
+
+    return candles_response(trade_stats.candles(item_id, interval, limit), item.tick_size)
+
+
+@async_routes.post("/users/", response_model=UserOut)
+async def create_user_async(
+    user: UserCreate, db: AsyncSession = Depends(get_async_db), read_cache: ReadCache = Depends(get_read_cache)
+):
+    db_user = User(name=user.name)
+    db.add(db_user)
+    await db.commit()
+    read_cache.bump(USERS_SCOPE)
+    await db.refresh(db_user)
+    return db_user
+
+
+@async_routes.get("/users/", response_model=List[UserOut])
+async def get_users_async(
+    request: Request, db: AsyncSession = Depends(get_async_db), read_cache: ReadCache = Depends(get_read_cache)
+):
+    media_type = list_media_type(request)
+    version, cached = cached_read(request, read_cache, USERS_SCOPE, media_type)
+    if cached is not None:
+        return cached
+    rows = [list(row) for row in await db.execute(select(*USER_COLUMNS).order_by(User.id))]
+    return cache_read(request, read_cache, version, encode_rows(USER_FIELDS, rows, media_type), media_type)
+
+
+@async_routes.get("/users/{user_id}/orders", response_model=List[OrderOut])
+async def get_user_orders_async(
+    request: Request,
+    user_id: int,
+    item_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    media_type = list_media_type(request)
+    if await db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    rows = await db.execute(user_orders_query(user_id, item_id, after_id, limit))
+    orders = list(item_priced_rows(rows, ORDER_PRICES))
+    return Response(encode_rows(ORDER_FIELDS, orders, media_type), media_type=media_type, headers=next_page(orders, limit))
+
+
+@async_routes.get("/users/{user_id}/trades", response_model=List[TradeOut])
+async def get_user_trades_async(
+    request: Request,
+    user_id: int,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    media_type = list_media_type(request)
+    if await db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    trades = list(item_priced_rows(await db.execute(user_trades_query(user_id, after_id, limit)), TRADE_PRICES))
+    return Response(encode_rows(TRADE_FIELDS, trades, media_type), media_type=media_type, headers=next_page(trades, limit))
+
+
+@async_routes.post("/orders/", response_model=OrderPlacedOut)
+async def create_order_async(
+    request: Request,
+    response: Response,
+    admitted: Admitted = Depends(admit_order),
+    db: AsyncSession = Depends(get_async_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    trade_stats: TradeStats = Depends(get_trade_stats),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: GroupCommitter = Depends(get_committer),
+    metrics: Metrics = Depends(get_metrics),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+    admission: Admission = Depends(get_admission),
+):
+    order = admitted.body
+    timer = PhaseTimer(metrics.order_phase_seconds)
+    with timer.phase("validate"):
+        check_owner(partition, order.item_id)
+        item = found_item(await db.get(Item, order.item_id))
+        if await db.get(User, order.user_id) is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        prices = order_prices(order, item.tick_size)
+
+    def process() -> Tuple[MatchResult, Future, Optional[Entry]]:
+        timer.record("queue", time.perf_counter() - queued)
+        check_fresh(admission, metrics, admitted.at)
+        with timer.phase("match"):
+            result = submit_order(matching_engine, order, prices)
+        entry = journal_entry(journal, match_records(result))
+        committed = committer.submit(lambda session: persist_journaled(session, result, journal, entry))
+        with timer.phase("publish"):
+            announce_match(result, item.tick_size, trade_stats, market_feed, metrics)
+        return result, committed, entry
+
+    queued = time.perf_counter()
+    with bumping(read_cache, [item_scope(order.item_id)]):
+        result, committed, entry = await asyncio.wrap_future(sequencer.submit(order.item_id, process))
+        try:
+            with timer.phase("commit"):
+                await asyncio.wrap_future(committed)
+        except Exception:
+            await asyncio.wrap_future(
+                sequencer.submit(order.item_id, reload_book_with, committer, matching_engine, order.item_id)
+            )
+            raise
+    if entry is not None:
+        with timer.phase("journal"):
+            await asyncio.wrap_future(journal.durable(entry.ticket))
+    return finish_order(result, item.tick_size, timer, request, response, metrics)
+
+
+def reload_book_with(committer: GroupCommitter, matching_engine: MatchingEngine, item_id: int):
+    with committer.session_factory() as db:
+        reload_book(db, matching_engine, item_id)
+
+
+@async_routes.get("/orders/", response_model=List[OrderOut])
+async def get_orders_async(
+    request: Request,
+    item_id: int = Query(...),
+    user_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    if not stream:
+        media_type = list_media_type(request)
+        version, cached = cached_read(request, read_cache, item_scope(item_id), media_type)
+        if cached is not None:
+            return cached
+    tick_size = found_item(await db.get(Item, item_id)).tick_size
+    query = select(*ORDER_COLUMNS).where(ItemOrder.item_id == item_id)
+
+    if user_id is not None:
+        query = query.where(ItemOrder.user_id == user_id)
+
+    query = paginate(query, ItemOrder.id, after_id, limit)
+    if stream:
+        return stream_ndjson_async(db, query, ORDER_FIELDS, ORDER_PRICES, tick_size)
+
+    orders = list(priced_rows(await db.execute(query), ORDER_PRICES, tick_size))
+    return cache_read(
+        request, read_cache, version,
+        encode_rows(ORDER_FIELDS, orders, media_type), media_type, next_page(orders, limit),
+    )
+
+
+@async_routes.get("/trades/", response_model=List[TradeOut])
+async def get_trades_async(
+    request: Request,
+    item_id: int = Query(...),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+    trade_archive: Optional[TradeArchive] = Depends(get_trade_archive),
+):
+    check_owner(partition, item_id)
+    if not stream:
+        media_type = list_media_type(request)
+        version, cached = cached_read(request, read_cache, item_scope(item_id), media_type)
+        if cached is not None:
+            return cached
+    tick_size = found_item(await db.get(Item, item_id)).tick_size
+    start, end = utc(start), utc(end)
+    archived = await run_in_threadpool(archived_trades, trade_archive, item_id, start, end, after_id, limit)
+    query = trade_window(select(*TRADE_COLUMNS).where(Trade.item_id == item_id), start, end)
+    query = paginate(query, Trade.id, after_id, limit)
+    if stream:
+        return stream_ndjson_async(db, query, TRADE_FIELDS, TRADE_PRICES, tick_size, archived, limit)
+
+    trades = list(priced_rows(islice(by_id(archived, await db.execute(query)), limit), TRADE_PRICES, tick_size))
+    return cache_read(
+        request, read_cache, version,
+        encode_rows(TRADE_FIELDS, trades, media_type), media_type, next_page(trades, limit),
+    )
+
+
+def stream_ndjson_async(
+    db: AsyncSession, query, fields: Tuple[str, ...], price_indexes: Tuple[int, ...], tick_size: float,
+    archived: List[tuple] = (), limit: Optional[int] = None,
+) -> StreamingResponse:
+    bind = db.bind
+    decimals = tick_decimals(tick_size)
+
+    async def lines():
+        async with AsyncSession(bind) as session:
+            rows = await session.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+            sent = 0
+            async for row in merge_by_id(archived, rows):
+                if sent == limit:
+                    break
+                yield dumps(dict(zip(fields, priced_row(row, price_indexes, tick_size, decimals)))) + b"\n"
+                sent += 1
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def merge_by_id(archived: List[tuple], rows):
+    """`by_id` for rows streamed from an async query."""
+    pending = iter(archived)
+    waiting = next(pending, None)
+    async for row in rows:
+        while waiting is not None and waiting[0] < row[0]:
+            yield waiting
+            waiting = next(pending, None)
+        yield row
+    while waiting is not None:
+        yield waiting
+        waiting = next(pending, None)
+
+
+@async_routes.get("/book/{item_id}", response_model=BookOut)
+async def get_book_async(
+    request: Request,
+    item_id: int,
+    depth: int = Query(10, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
+    check_owner(partition, item_id)
+    version, cached = cached_read(request, read_cache, item_scope(item_id))
+    if cached is not None:
+        return cached
+    tick_size = found_item(await db.get(Item, item_id)).tick_size
+
+    levels = await asyncio.wrap_future(
+        sequencer.submit(item_id, read_book, matching_engine, item_id, depth, tick_size)
+    )
+    return cache_read(request, read_cache, version, BOOK.dump_json(book_response(item_id, levels)))
+
+
+@async_routes.post("/orders/delete/")
+async def delete_order_async(
+    request: DeleteOrderRequest,
+    db: AsyncSession = Depends(get_async_db),
+    matching_engine: MatchingEngine = Depends(get_matching_engine),
+    market_feed: MarketFeed = Depends(get_market_feed),
+    sequencer: OrderSequencer = Depends(get_sequencer),
+    journal: Optional[Journal] = Depends(get_journal),
+    committer: GroupCommitter = Depends(get_committer),
+    read_cache: ReadCache = Depends(get_read_cache),
+    partition: Partition = Depends(get_partition),
+):
+    order = await db.get(ItemOrder, request.order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    item_id = order.item_id
+    check_owner(partition, item_id)
+
+    def cancel() -> Tuple[Optional[Future], Optional[Entry]]:
+        # The book is ahead of the database here, so it decides whether the order is still open
+        if matching_engine.cancel(request.order_id) is None:
+            return None, None
+        entry = journal_entry(journal, [encode_cancel(request.order_id, item_id)])
+
+        def write(session: Session):
+            delete_orders(session, [request.order_id])
+            confirm_entry(session, journal, entry)
+
+        committed = committer.submit(write)
+        market_feed.publish(item_id, [{"type": "order_removed", "order_id": request.order_id}])
+        return committed, entry
+
+    committed, entry = await asyncio.wrap_future(sequencer.submit(item_id, cancel))
+    if committed is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    with bumping(read_cache, [item_scope(item_id)]):
+        try:
+            await asyncio.wrap_future(committed)
+        except Exception:
+            await asyncio.wrap_future(sequencer.submit(item_id, reload_book_with, committer, matching_engine, item_id))
+            raise
+    if entry is not None:
+        await asyncio.wrap_future(journal.durable(entry.ticket))
+    return {"message": "Order deleted successfully"}
+
+
+def create_app(mode: str = DB_MODE) -> FastAPI:
+    if mode not in ("sync", "async"):
+        raise ValueError("DB_MODE must be sync or async")
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,          # or ["*"] to allow all
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(async_routes if mode == "async" else sync_routes)
+    app.include_router(routes)
+    return app
+
+
+app = create_app()
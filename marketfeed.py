@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from models import STOP_KINDS
+from orderbook import BookOrder, MatchResult, OrderBook
+from ticks import to_price
+
+# Pending events per subscriber; a slow client loses events past this and sees a sequence gap
+MAX_PENDING = 10_000
+
+
+class Subscription:
+    """One websocket's view of an item's feed, fed from any thread."""
+
+    RESYNC = {"type": "resync"}
+
+    def __init__(self, item_id: int, loop: asyncio.AbstractEventLoop):
+        self.item_id = item_id
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING)
+
+    def push(self, message: dict):
+        self._loop.call_soon_threadsafe(self._put, message)
+
+    def request_resync(self):
+        self._put(self.RESYNC)
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+    def _put(self, message: dict):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+
+class MarketFeed:
+    """Per-item sequence numbers and fan-out of book and trade events to subscribers.
+
+    Events must be published from the item's sequencer thread, and snapshots taken on the
+    same thread, so that a snapshot's sequence number splits the stream exactly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequences: Dict[int, int] = defaultdict(int)
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+
+    def sequence(self, item_id: int) -> int:
+        return self._sequences[item_id]
+
+    def publish(self, item_id: int, events: List[dict]):
+        with self._lock:
+            subscribers = list(self._subscribers.get(item_id, ()))
+            for event in events:
+                self._sequences[item_id] += 1
+                message = {**event, "item_id": item_id, "seq": self._sequences[item_id]}
+                for subscription in subscribers:
+                    subscription.push(message)
+
+    def subscribe(self, item_id: int, loop: asyncio.AbstractEventLoop) -> Subscription:
+        subscription = Subscription(item_id, loop)
+        with self._lock:
+            self._subscribers[item_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.item_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.item_id]
+
+
+def order_payload(order: BookOrder, tick_size: float) -> dict:
+    return {
+        "id": order.id,
+        "side": order.side.value,
+        "kind": order.kind.value,
+        "price": to_price(order.price, tick_size),
+        "quantity": order.quantity,
+        "remaining": order.remaining,
+        "user_id": order.user_id,
+    }
+
+
+def book_snapshot(book: OrderBook, seq: int, tick_size: float) -> dict:
+    """Every resting order in priority order, tagged with the feed sequence it reflects."""
+    return {
+        "type": "snapshot",
+        "item_id": book.item_id,
+        "seq": seq,
+        "bids": [order_payload(o, tick_size) for level in book.bids.levels() for o in level.orders],
+        "asks": [order_payload(o, tick_size) for level in book.asks.levels() for o in level.orders],
+        "market_bids": [order_payload(o, tick_size) for o in book.market_bids],
+        "market_asks": [order_payload(o, tick_size) for o in book.market_asks],
+    }
+
+
+def match_events(result: MatchResult, tick_size: float) -> List[dict]:
+    events = []
+    # Stop orders are not in the book until they trigger, so only their trades and rests are events
+    for step in result.cascade():
+        for fill in step.fills:
+            events.append({
+                "type": "trade",
+                "price": to_price(fill.price, tick_size),
+                "quantity": fill.quantity,
+                "buyer_id": fill.buyer_id,
+                "seller_id": fill.seller_id,
+                "maker_order_id": fill.maker_id,
+                "maker_remaining": fill.maker_remaining,
+                "timestamp": step.timestamp.isoformat(),
+            })
+            if not fill.maker_remaining:
+                events.append({"type": "order_removed", "order_id": fill.maker_id})
+        if step.rested and step.order.kind not in STOP_KINDS:
+            events.append({"type": "order_added", "order": order_payload(step.order, tick_size)})
+    return events
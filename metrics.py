@@ -0,0 +1,186 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds; phases of a single order run from microseconds to a slow fsync
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from `collect` at scrape time, as (labels, value) pairs."""
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[dict, float]]]):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted((_labels(l), v) for l, v in self.collect()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Per label set: counts per bucket (the last one is +Inf), sum, count
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_labels(labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Metrics:
+    """Order path instrumentation, exported in the Prometheus text format."""
+
+    def __init__(self):
+        self.order_phase_seconds = Histogram(
+            "orderbook_order_phase_seconds", "Time spent in each phase of POST /orders/."
+        )
+        self.order_seconds = Histogram("orderbook_order_seconds", "Total time to handle POST /orders/.")
+        self.trades = Counter("orderbook_trades_total", "Trades executed.")
+        self.traded_quantity = Counter("orderbook_traded_quantity_total", "Quantity traded.")
+        self.self_matches = Counter(
+            "orderbook_self_match_total", "Orders that stopped matching at the same user's resting order."
+        )
+        self.orders = Counter("orderbook_orders_total", "Orders accepted.")
+        self.cancelled_orders = Counter(
+            "orderbook_cancelled_orders_total",
+            "Orders, or the unfilled part of IOC and FOK orders, cancelled other than one at a time.",
+        )
+        self.triggered_stops = Counter("orderbook_triggered_stops_total", "Stop orders triggered by a trade.")
+        self.rejected_orders = Counter(
+            "orderbook_rejected_orders_total", "Orders turned away by admission control, by reason."
+        )
+
+    def record_match(self, result):
+        item_id = result.order.item_id
+        self.orders.inc(item_id=item_id, kind=result.order.kind.value)
+        if result.triggered:
+            self.triggered_stops.inc(len(result.triggered), item_id=item_id)
+        for step in result.cascade():
+            if step.fills:
+                self.trades.inc(len(step.fills), item_id=item_id)
+                self.traded_quantity.inc(sum(f.quantity for f in step.fills), item_id=item_id)
+            if step.self_match:
+                self.self_matches.inc(item_id=item_id)
+            if step.cancelled:
+                self.cancelled_orders.inc(reason=step.order.time_in_force.value)
+
+    def render(self, gauges: Iterable[Gauge] = ()) -> str:
+        lines = []
+        for metric in (self.order_seconds, self.order_phase_seconds, self.orders, self.trades,
+                       self.traded_quantity, self.self_matches, self.cancelled_orders, self.triggered_stops,
+                       self.rejected_orders, *gauges):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class PhaseTimer:
+    """Times the phases of one request into a histogram and keeps them for a Server-Timing header."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.phases: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        self.histogram.observe(seconds, phase=name)
+        self.phases.append((name, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases)
+
+
+def resting_orders(matching_engine) -> List[Tuple[dict, float]]:
+    # Plain counter reads from outside the writers; a scrape may be one order behind
+    samples = []
+    for item_id, book in list(matching_engine.books.items()):
+        samples.append(({"item_id": item_id, "side": "Bid"}, book.bids.order_count + len(book.market_bids)))
+        samples.append(({"item_id": item_id, "side": "Ask"}, book.asks.order_count + len(book.market_asks)))
+    return samples
+
+
+def intake_depths(admission) -> List[Tuple[dict, float]]:
+    return [({"item_id": item_id}, depth) for item_id, depth in admission.depths().items()]
@@ -0,0 +1,70 @@
+from sqlalchemy import Integer, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+import models  # noqa: F401  registers the tables on Base.metadata
+from database import Base
+from ticks import DEFAULT_TICK_SIZE
+
+# Columns added after the first release, in the order they were introduced.
+# create_all() only creates missing tables, so existing databases get these via ALTER TABLE.
+ADDED_COLUMNS = [
+    ("orders", "quantity", "INTEGER NOT NULL DEFAULT 1"),
+    ("orders", "remaining", "INTEGER NOT NULL DEFAULT 1"),
+    ("trades", "quantity", "INTEGER NOT NULL DEFAULT 1"),
+    ("trades", "timestamp", "DATETIME"),
+    ("items", "tick_size", f"FLOAT NOT NULL DEFAULT {DEFAULT_TICK_SIZE}"),
+    ("orders", "time_in_force", "VARCHAR(3) NOT NULL DEFAULT 'GTC'"),
+    ("orders", "expires_at", "DATETIME"),
+    ("orders", "stop_price", "INTEGER"),
+]
+
+# Tables whose price column changed from FLOAT to INTEGER ticks of the item's tick size
+TICK_PRICE_TABLES = ["orders", "trades"]
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            if column not in {c["name"] for c in inspector.get_columns(table)}:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+        for table in TICK_PRICE_TABLES:
+            if not inspector.has_table(table):
+                continue
+            price = next(c for c in inspector.get_columns(table) if c["name"] == "price")
+            if not isinstance(price["type"], Integer):
+                convert_prices_to_ticks(conn, table, [i["name"] for i in inspector.get_indexes(table)])
+
+        # Likewise, indexes declared on existing tables are not created by create_all()
+        existing = set(inspect(conn).get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue  # create_all() makes it with its indexes
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def convert_prices_to_ticks(conn: Connection, table: str, indexes: list):
+    """Rebuild `table` with an INTEGER price column holding ticks of each row's item.
+
+    SQLite can't change a column's type in place, so the rows are copied into a new table.
+    """
+    for index in indexes:
+        conn.execute(text(f"DROP INDEX {index}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_float"))
+    new = Base.metadata.tables[table]
+    new.create(conn)
+    columns = [c.name for c in new.columns]
+    values = [
+        f"CAST(ROUND(t.price / COALESCE(i.tick_size, {DEFAULT_TICK_SIZE})) AS INTEGER)"
+        if name == "price" else f"t.{name}"
+        for name in columns
+    ]
+    conn.execute(text(
+        f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(values)} "
+        f"FROM {table}_float AS t LEFT JOIN items AS i ON i.id = t.item_id"
+    ))
+    conn.execute(text(f"DROP TABLE {table}_float"))
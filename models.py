@@ -1,9 +1,16 @@
 import enum
+from datetime import datetime, timezone
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Float, DateTime, Index
 from sqlalchemy.orm import relationship
 
 from database import Base
+from ticks import DEFAULT_TICK_SIZE
+
+
+def utcnow() -> datetime:
+    # SQLite has no time zones, so timestamps are stored as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class User(Base):
@@ -23,6 +30,7 @@ class Item(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     description = Column(String, nullable=True)
+    tick_size = Column(Float, default=DEFAULT_TICK_SIZE, nullable=False)  # prices are stored as multiples of this
 
     orders = relationship("ItemOrder", back_populates="item")
     trades = relationship("Trade", back_populates="item")
@@ -36,15 +44,46 @@ class OrderType(str, enum.Enum):
 class OrderKind(str, enum.Enum):
     Limit = "Limit"
     Market = "Market"
+    # Held out of the book until a trade at or through the stop price, then a market or limit order
+    Stop = "Stop"
+    StopLimit = "StopLimit"
+
+
+STOP_KINDS = (OrderKind.Stop, OrderKind.StopLimit)
+LIMIT_KINDS = (OrderKind.Limit, OrderKind.StopLimit)
+
+
+class TimeInForce(str, enum.Enum):
+    GTC = "GTC"  # good till cancelled
+    IOC = "IOC"  # immediate or cancel: whatever does not fill at once is cancelled
+    FOK = "FOK"  # fill or kill: fills completely at once, or not at all
+    GTD = "GTD"  # good till date: rests until expires_at
+
+
+class OrderStatus(str, enum.Enum):
+    """What became of an order when it was placed; reported back, not stored."""
+    Resting = "Resting"  # in the book, or held until its stop triggers
+    Filled = "Filled"
+    Cancelled = "Cancelled"  # an IOC or FOK order's unfilled quantity was dropped
 
 
 class ItemOrder(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_item_id_id", "item_id", "id"),
+        Index("ix_orders_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     side = Column(Enum(OrderType), nullable=False)          # Bid or Ask
-    kind = Column(Enum(OrderKind), default=OrderKind.Limit, nullable=False)  # Limit or Market
-    price = Column(Float, nullable=True)  # nullable since market orders may not need a price
+    kind = Column(Enum(OrderKind), default=OrderKind.Limit, nullable=False)  # Limit, Market, Stop or StopLimit
+    price = Column(Integer, nullable=True)  # in ticks of the item; null for market orders
+    stop_price = Column(Integer, nullable=True)  # in ticks, for stop orders; kept once they trigger
+    quantity = Column(Integer, default=1, nullable=False)
+    remaining = Column(Integer, default=1, nullable=False)  # quantity not yet filled
+    # Only GTC and GTD orders rest and are stored, besides IOC and FOK stops waiting to trigger
+    time_in_force = Column(Enum(TimeInForce), default=TimeInForce.GTC, nullable=False)
+    expires_at = Column(DateTime, nullable=True)  # for GTD orders
     item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
@@ -54,13 +93,30 @@ class ItemOrder(Base):
 
 class Trade(Base):
     __tablename__ = "trades"
+    __table_args__ = (
+        Index("ix_trades_item_id_id", "item_id", "id"),
+        Index("ix_trades_buyer_id_id", "buyer_id", "id"),
+        Index("ix_trades_seller_id_id", "seller_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
-    price = Column(Float, nullable=False)
+    price = Column(Integer, nullable=False)  # in ticks of the item
+    quantity = Column(Integer, default=1, nullable=False)
+    timestamp = Column(DateTime, default=utcnow, nullable=True)  # null for trades recorded before timestamps
 
     buyer = relationship("User", back_populates="trades_bought", foreign_keys=[buyer_id])
     seller = relationship("User", back_populates="trades_sold", foreign_keys=[seller_id])
-    item = relationship("Item", back_populates="trades")
\ No newline at end of file
+    item = relationship("Item", back_populates="trades")
+
+class JournalEntry(Base):
+    """Offsets of a journal entry whose transaction committed; recovery replays only these."""
+    __tablename__ = "journal_entries"
+    __table_args__ = (Index("ix_journal_entries_journal_start", "journal", "start"),)
+
+    id = Column(Integer, primary_key=True)
+    journal = Column(String, nullable=False)  # the journal's directory
+    start = Column(Integer, nullable=False)
+    end = Column(Integer, nullable=False)
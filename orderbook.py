@@ -0,0 +1,500 @@
+import bisect
+import heapq
+import itertools
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models import OrderType, OrderKind, STOP_KINDS, TimeInForce, utcnow
+from ticks import to_ticks
+
+
+@dataclass(eq=False)
+class BookOrder:
+    id: int
+    item_id: int
+    user_id: int
+    side: OrderType
+    kind: OrderKind
+    price: Optional[int]  # ticks
+    quantity: int = 1
+    remaining: int = 1
+    time_in_force: TimeInForce = TimeInForce.GTC
+    expires_at: Optional[datetime] = None  # GTD orders leave the book at this time
+    stop_price: Optional[int] = None  # ticks; a trade at or through it triggers a stop order
+
+
+@dataclass
+class Fill:
+    buyer_id: int
+    seller_id: int
+    price: int
+    quantity: int
+    maker_id: int  # resting order traded against
+    maker_remaining: int  # what is left of it afterwards; 0 means it left the book
+
+
+@dataclass
+class MatchResult:
+    order: BookOrder
+    timestamp: datetime
+    fills: List[Fill] = field(default_factory=list)
+    rested: bool = False
+    self_match: bool = False  # matching stopped at one of the same user's orders
+    # Stop orders this order's trades triggered, and the ones their trades triggered in turn
+    triggered: List["MatchResult"] = field(default_factory=list)
+
+    @property
+    def cancelled(self) -> int:
+        """Quantity an IOC or FOK order left unfilled, which was cancelled rather than rested.
+
+        An IOC or FOK stop rests until it triggers, and only then keeps what it fills at once.
+        """
+        if self.rested or self.order.time_in_force not in (TimeInForce.IOC, TimeInForce.FOK):
+            return 0
+        return self.order.remaining
+
+    def cascade(self) -> Iterator["MatchResult"]:
+        """This match followed by those of the stop orders it triggered, in the order they ran."""
+        yield self
+        yield from self.triggered
+
+
+class PriceLevel:
+    def __init__(self, price: int):
+        self.price = price
+        self.quantity = 0
+        self.orders: Deque[BookOrder] = deque()
+
+    def __len__(self):
+        return len(self.orders)
+
+
+class PriceLadder:
+    """One side of a book: price-sorted levels, each a FIFO queue of limit orders."""
+
+    def __init__(self, side: OrderType):
+        self.side = side
+        # Keys are stored so that the best price is always at index 0
+        self._sign = -1 if side == OrderType.Bid else 1
+        self._keys: List[int] = []
+        self._levels: Dict[int, PriceLevel] = {}
+        self.order_count = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def best_level(self) -> Optional[PriceLevel]:
+        if not self._keys:
+            return None
+        return self._levels[self._keys[0] * self._sign]
+
+    def best(self) -> Optional[BookOrder]:
+        level = self.best_level()
+        return level.orders[0] if level else None
+
+    def levels(self, depth: Optional[int] = None) -> Iterator[PriceLevel]:
+        """Iterate levels from the best price outwards, optionally only the first `depth`."""
+        for key in self._keys[:depth]:
+            yield self._levels[key * self._sign]
+
+    def add(self, order: BookOrder):
+        level = self._levels.get(order.price)
+        if level is None:
+            level = self._levels[order.price] = PriceLevel(order.price)
+            bisect.insort(self._keys, order.price * self._sign)
+        level.orders.append(order)
+        level.quantity += order.remaining
+        self.order_count += 1
+
+    def reduce(self, order: BookOrder, quantity: int):
+        """Take a partial fill off a resting order without losing its queue position."""
+        order.remaining -= quantity
+        self._levels[order.price].quantity -= quantity
+
+    def remove(self, order: BookOrder):
+        level = self._levels[order.price]
+        level.quantity -= order.remaining
+        self.order_count -= 1
+        if level.orders[0] is order:
+            level.orders.popleft()
+        else:
+            level.orders.remove(order)
+        if not level.orders:
+            del self._levels[order.price]
+            key = order.price * self._sign
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+
+class StopLadder:
+    """Stop orders of one side, kept out of the book and sorted by stop price until a trade triggers them."""
+
+    def __init__(self, side: OrderType):
+        self.side = side
+        # Keys are stored so that the stops a trade triggers are always a prefix: buy stops trigger
+        # at or above their stop price, sell stops at or below it
+        self._sign = 1 if side == OrderType.Bid else -1
+        self._keys: List[int] = []
+        self._levels: Dict[int, Deque[BookOrder]] = {}
+        self.order_count = 0
+
+    def orders(self) -> Iterator[BookOrder]:
+        for key in self._keys:
+            yield from self._levels[key * self._sign]
+
+    def add(self, order: BookOrder):
+        level = self._levels.get(order.stop_price)
+        if level is None:
+            level = self._levels[order.stop_price] = deque()
+            bisect.insort(self._keys, order.stop_price * self._sign)
+        level.append(order)
+        self.order_count += 1
+
+    def remove(self, order: BookOrder):
+        level = self._levels[order.stop_price]
+        level.remove(order)
+        self.order_count -= 1
+        if not level:
+            del self._levels[order.stop_price]
+            del self._keys[bisect.bisect_left(self._keys, order.stop_price * self._sign)]
+
+    def trigger(self, price: int) -> List[BookOrder]:
+        """Take every stop a trade at `price` triggers, nearest stop price first, in O(log n + k)."""
+        end = bisect.bisect_right(self._keys, price * self._sign)
+        if not end:
+            return []
+        triggered = [order for key in self._keys[:end] for order in self._levels.pop(key * self._sign)]
+        del self._keys[:end]
+        self.order_count -= len(triggered)
+        return triggered
+
+
+class OrderBook:
+    def __init__(self, item_id: int):
+        self.item_id = item_id
+        self.bids = PriceLadder(OrderType.Bid)
+        self.asks = PriceLadder(OrderType.Ask)
+        # Resting market orders have no price and are matched first-come first-served
+        self.market_bids: Deque[BookOrder] = deque()
+        self.market_asks: Deque[BookOrder] = deque()
+        # Stop orders are not part of the visible book
+        self.stop_bids = StopLadder(OrderType.Bid)
+        self.stop_asks = StopLadder(OrderType.Ask)
+
+    def ladder(self, side: OrderType) -> PriceLadder:
+        return self.bids if side == OrderType.Bid else self.asks
+
+    def market_queue(self, side: OrderType) -> Deque[BookOrder]:
+        return self.market_bids if side == OrderType.Bid else self.market_asks
+
+    def stop_ladder(self, side: OrderType) -> StopLadder:
+        return self.stop_bids if side == OrderType.Bid else self.stop_asks
+
+    def resting_orders(self) -> Iterator[BookOrder]:
+        """Every order the engine holds for the item, including untriggered stops."""
+        for ladder in (self.bids, self.asks):
+            for level in ladder.levels():
+                yield from level.orders
+        yield from self.market_bids
+        yield from self.market_asks
+        yield from self.stop_bids.orders()
+        yield from self.stop_asks.orders()
+
+    def add(self, order: BookOrder):
+        if order.kind in STOP_KINDS:
+            self.stop_ladder(order.side).add(order)
+        elif order.kind == OrderKind.Market:
+            self.market_queue(order.side).append(order)
+        else:
+            self.ladder(order.side).add(order)
+
+    def remove(self, order: BookOrder):
+        if order.kind in STOP_KINDS:
+            self.stop_ladder(order.side).remove(order)
+        elif order.kind == OrderKind.Market:
+            self.market_queue(order.side).remove(order)
+        else:
+            self.ladder(order.side).remove(order)
+
+    def trigger(self, fills: List[Fill]) -> List[BookOrder]:
+        """Take the stops that trades at the fills' prices trigger out of the stop ladders."""
+        prices = [fill.price for fill in fills]
+        return self.stop_bids.trigger(max(prices)) + self.stop_asks.trigger(min(prices))
+
+    def fillable(self, order: BookOrder) -> bool:
+        """Whether matching would fill the order completely, without changing the book."""
+        opposite = OrderType.Ask if order.side == OrderType.Bid else OrderType.Bid
+        makers = []
+        if order.kind == OrderKind.Limit:
+            makers.append(self.market_queue(opposite))
+        for level in self.ladder(opposite).levels():
+            if order.kind == OrderKind.Limit and not self._crosses(order, level.orders[0]):
+                break
+            makers.append(level.orders)
+        needed = order.remaining
+        for maker in itertools.chain.from_iterable(makers):
+            if maker.user_id == order.user_id:
+                return False  # matching would stop here
+            needed -= maker.remaining
+            if needed <= 0:
+                return True
+        return False
+
+    def match(self, order: BookOrder, timestamp: datetime, rest: bool = True) -> MatchResult:
+        """Walk the opposite side until the order is filled, then rest any residual unless told not to."""
+        result = MatchResult(order=order, timestamp=timestamp)
+        opposite = OrderType.Ask if order.side == OrderType.Bid else OrderType.Bid
+        ladder = self.ladder(opposite)
+        market_queue = self.market_queue(opposite)
+
+        while order.remaining:
+            if order.kind == OrderKind.Market:
+                # Market orders take the best opposite limit at its price
+                maker = ladder.best()
+                price = maker.price if maker else None
+            elif market_queue:
+                # Limit orders trade against waiting market orders first, at the limit price
+                maker = market_queue[0]
+                price = order.price
+            else:
+                maker = ladder.best()
+                if maker and not self._crosses(order, maker):
+                    maker = None
+                price = maker.price if maker else None
+
+            if maker is None:
+                break
+            # Buyer and seller must differ; a self-match stops matching and the residual rests
+            if maker.user_id == order.user_id:
+                result.self_match = True
+                break
+
+            quantity = min(order.remaining, maker.remaining)
+            if quantity == maker.remaining:
+                self.remove(maker)
+                maker.remaining = 0
+            elif maker.kind == OrderKind.Market:
+                maker.remaining -= quantity
+            else:
+                ladder.reduce(maker, quantity)
+            order.remaining -= quantity
+
+            if order.side == OrderType.Bid:
+                buyer_id, seller_id = order.user_id, maker.user_id
+            else:
+                buyer_id, seller_id = maker.user_id, order.user_id
+            result.fills.append(Fill(buyer_id, seller_id, price, quantity, maker.id, maker.remaining))
+
+        if order.remaining and rest:
+            self.add(order)
+            result.rested = True
+        return result
+
+    @staticmethod
+    def _crosses(order: BookOrder, maker: BookOrder) -> bool:
+        if order.side == OrderType.Bid:
+            return maker.price <= order.price
+        return maker.price >= order.price
+
+
+def limit_price(kind: OrderKind, price: Optional[float], tick_size: float) -> Optional[int]:
+    """An incoming order's limit price in ticks, or None for market and stop orders.
+
+    Raises ValueError for a limit order without a price or with one off the tick grid.
+    """
+    if kind in (OrderKind.Market, OrderKind.Stop):
+        return None
+    if price is None:
+        raise ValueError("Limit orders require a price")
+    return to_ticks(price, tick_size)
+
+
+def stop_price(kind: OrderKind, price: Optional[float], tick_size: float) -> Optional[int]:
+    """An incoming order's stop price in ticks, or None unless it is a stop order.
+
+    Raises ValueError for a stop order without a stop price or with one off the tick grid.
+    """
+    if kind not in STOP_KINDS:
+        return None
+    if price is None:
+        raise ValueError("Stop orders require a stop price")
+    return to_ticks(price, tick_size)
+
+
+class MatchingEngine:
+    """Holds one OrderBook per item and assigns order ids.
+
+    A book must only be touched by one thread at a time; see sequencer.OrderSequencer.
+    Engines in different processes sharing a database number orders with `id_step` set to
+    the number of processes and distinct `id_offset`s, so their ids never collide.
+    """
+
+    def __init__(self, id_step: int = 1, id_offset: int = 0):
+        self.books: Dict[int, OrderBook] = {}
+        self.orders: Dict[int, BookOrder] = {}
+        self.id_step = id_step
+        self.id_offset = id_offset
+        self.reserve_ids(0)
+        # (expires_at, order id, item id) of every GTD order, soonest first. Entries of orders that
+        # have since left the book stay until they come due and are skipped then. Shared by every
+        # writer thread, unlike the books.
+        self._expiries: List[Tuple[datetime, int, int]] = []
+        self._expiry_lock = threading.Lock()
+
+    def book(self, item_id: int) -> OrderBook:
+        book = self.books.get(item_id)
+        if book is None:
+            book = self.books[item_id] = OrderBook(item_id)
+        return book
+
+    def load(self, rows: Iterable):
+        """Rebuild every book from persisted orders, which must be given in id order."""
+        self.books.clear()
+        self.orders.clear()
+        with self._expiry_lock:
+            self._expiries.clear()
+        last_id = 0
+        for row in rows:
+            self._rest(row)
+            last_id = max(last_id, row.id)
+        self.reserve_ids(last_id)
+
+    def reserve_ids(self, last_id: int):
+        """Continue numbering orders after `last_id`."""
+        first = last_id + 1
+        self._ids = itertools.count(first + (self.id_offset - first) % self.id_step, self.id_step)
+
+    def peek_next_id(self) -> int:
+        """The id the next order will get; only safe while nothing is submitting."""
+        next_id = next(self._ids)
+        self._ids = itertools.count(next_id, self.id_step)
+        return next_id
+
+    def reload_book(self, item_id: int, rows: Iterable):
+        """Replace a single item's book, e.g. after a failed commit."""
+        book = self.books.pop(item_id, None)
+        if book is not None:
+            for order in book.resting_orders():
+                del self.orders[order.id]
+        for row in rows:
+            self._rest(row)
+
+    def submit(
+        self,
+        item_id: int,
+        user_id: int,
+        side: OrderType,
+        kind: OrderKind,
+        price: Optional[int],
+        quantity: int = 1,
+        timestamp: Optional[datetime] = None,
+        order_id: Optional[int] = None,
+        time_in_force: TimeInForce = TimeInForce.GTC,
+        expires_at: Optional[datetime] = None,
+        stop_price: Optional[int] = None,
+    ) -> MatchResult:
+        """Match a new order. `order_id` is only given when replaying already numbered orders.
+
+        A stop order waits for a later trade at or through its stop price. Every stop the order's
+        trades trigger is matched before this returns, as are those their trades trigger in turn.
+        """
+        if order_id is None:
+            order_id = next(self._ids)
+        elif order_id >= self.peek_next_id():
+            # Orders numbered here later must not reuse the given id
+            self.reserve_ids(order_id)
+        order = BookOrder(
+            id=order_id,
+            item_id=item_id,
+            user_id=user_id,
+            side=side,
+            kind=kind,
+            price=None if kind in (OrderKind.Market, OrderKind.Stop) else price,
+            quantity=quantity,
+            remaining=quantity,
+            time_in_force=time_in_force,
+            expires_at=expires_at if time_in_force == TimeInForce.GTD else None,
+            stop_price=stop_price if kind in STOP_KINDS else None,
+        )
+        book = self.book(item_id)
+        timestamp = timestamp or utcnow()
+        if kind in STOP_KINDS:
+            book.add(order)
+            result = MatchResult(order=order, timestamp=timestamp, rested=True)
+        else:
+            result = self._execute(book, order, timestamp)
+        if result.rested:
+            self.orders[order.id] = order
+            self._schedule(order)
+        self._trigger(book, result)
+        return result
+
+    def _execute(self, book: OrderBook, order: BookOrder, timestamp: datetime) -> MatchResult:
+        if order.time_in_force == TimeInForce.FOK and not book.fillable(order):
+            result = MatchResult(order=order, timestamp=timestamp)
+        else:
+            rest = order.time_in_force not in (TimeInForce.IOC, TimeInForce.FOK)
+            result = book.match(order, timestamp, rest=rest)
+        for fill in result.fills:
+            if not fill.maker_remaining:
+                del self.orders[fill.maker_id]
+        return result
+
+    def _trigger(self, book: OrderBook, result: MatchResult):
+        # Breadth first, so stops run in the order the trades that triggered them printed
+        pending = deque([result])
+        while pending:
+            step = pending.popleft()
+            if not step.fills:
+                continue
+            for stop in book.trigger(step.fills):
+                stop.kind = OrderKind.Market if stop.kind == OrderKind.Stop else OrderKind.Limit
+                triggered = self._execute(book, stop, result.timestamp)
+                if not triggered.rested:
+                    del self.orders[stop.id]
+                result.triggered.append(triggered)
+                pending.append(triggered)
+
+    def cancel(self, order_id: int) -> Optional[BookOrder]:
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self.books[order.item_id].remove(order)
+        return order
+
+    def due(self, now: datetime) -> Dict[int, List[int]]:
+        """Take the ids of orders that expire by `now`, by item; safe from any thread."""
+        due = defaultdict(list)
+        with self._expiry_lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                _, order_id, item_id = heapq.heappop(self._expiries)
+                due[item_id].append(order_id)
+        return due
+
+    def expire(self, order_ids: Iterable[int]) -> List[BookOrder]:
+        """Cancel those of one item's due orders still resting, on the item's writer thread."""
+        return [order for order in map(self.cancel, order_ids) if order is not None]
+
+    def _schedule(self, order: BookOrder):
+        if order.expires_at is not None:
+            with self._expiry_lock:
+                heapq.heappush(self._expiries, (order.expires_at, order.id, order.item_id))
+
+    def _rest(self, row):
+        order = BookOrder(
+            id=row.id,
+            item_id=row.item_id,
+            user_id=row.user_id,
+            side=row.side,
+            kind=row.kind,
+            price=row.price,
+            quantity=row.quantity,
+            remaining=row.remaining,
+            time_in_force=row.time_in_force or TimeInForce.GTC,
+            expires_at=row.expires_at,
+            stop_price=row.stop_price,
+        )
+        self.book(order.item_id).add(order)
+        self.orders[order.id] = order
+        self._schedule(order)
@@ -0,0 +1,33 @@
+import os
+from dataclasses import dataclass
+
+# Set on a response refusing an item that another partition matches; names the partition that does
+PARTITION_HEADER = "X-Partition"
+
+
+@dataclass(frozen=True)
+class Partition:
+    """The share of items one matching process owns when items are split across processes.
+
+    Items are assigned by `item_id % count`. The owner numbers its orders with ids in the same
+    residue class, so the owner of an order is known from its id alone.
+    """
+
+    index: int = 0
+    count: int = 1
+
+    @classmethod
+    def from_env(cls) -> "Partition":
+        partition = cls(int(os.getenv("PARTITION", "0")), int(os.getenv("PARTITIONS", "1")))
+        if not 0 <= partition.index < partition.count:
+            raise ValueError("PARTITION must be between 0 and PARTITIONS - 1")
+        return partition
+
+    def owner(self, item_id: int) -> int:
+        return item_id % self.count
+
+    def owns(self, item_id: int) -> bool:
+        return self.owner(item_id) == self.index
+
+    def order_owner(self, order_id: int) -> int:
+        return order_id % self.count
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Optional
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+class ReadCache:
+    """Rendered GET responses keyed by (endpoint, parameters, version of their scope), evicted LRU.
+
+    A scope is what a group of responses is read from, e.g. one item's orders and trades.
+    Writers bump its version once their change is committed, which retires every cached
+    response for the scope at once and changes the ETag clients revalidate against.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # Versions restart with the process, so ETags carry where they came from
+        self.epoch = f"{os.getpid():x}.{time.time_ns():x}"
+        self._lock = threading.Lock()
+        self._versions: Dict[Hashable, int] = defaultdict(int)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def version(self, scope: Hashable) -> int:
+        return self._versions[scope]
+
+    def bump(self, scope: Hashable):
+        with self._lock:
+            self._versions[scope] += 1
+
+    def etag(self, key: Hashable, version: int) -> str:
+        # Responses of one scope share its version, so the tag also hashes the response's key: the
+        # route, query and encoding of what was read
+        return f'"{self.epoch}-{zlib.crc32(repr(key).encode()):x}-{version}"'
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, response: CachedResponse):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # A reader that raced a writer may carry an older version; never replace a newer entry
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                return
+            self._entries[key] = (version, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,223 @@
+"""Replay historical order flow through the matching engine, with no HTTP and no database.
+
+Orders are read from CSV or JSON lines with the fields of POST /orders/ (side, kind, item_id,
+user_id, price, quantity, time_in_force, expires_at, stop_price) plus optional timestamp and order_id. A
+record with action=cancel and an order_id cancels that order, and GTD orders expire once a
+record's timestamp passes their expires_at. Matching uses the same MatchingEngine and price rules as
+the API. Run from the repository root:
+
+    python replay.py orders.csv --trades tape.csv --book book.json
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from models import OrderKind, OrderType, TimeInForce
+from orderbook import MatchingEngine, MatchResult, limit_price, stop_price
+from ticks import DEFAULT_TICK_SIZE, tick_decimals
+
+TAPE_FIELDS = ("timestamp", "item_id", "price", "quantity", "buyer_id", "seller_id", "maker_order_id", "taker_order_id")
+
+
+@dataclass
+class ReplayStats:
+    orders: int = 0
+    cancels: int = 0
+    expired: int = 0  # GTD orders that left the book when the replay clock passed their expiry
+    triggered: int = 0  # stop orders a trade triggered
+    rejected: int = 0  # limit orders without a price or off the tick grid, unknown cancels
+    trades: int = 0
+    volume: int = 0
+    seconds: float = 0.0
+
+    @property
+    def orders_per_minute(self) -> float:
+        return self.orders / self.seconds * 60 if self.seconds else 0.0
+
+
+class Replay:
+    """Feeds order records through a MatchingEngine and reports every trade to `on_trade`."""
+
+    def __init__(
+        self,
+        tick_size: float = DEFAULT_TICK_SIZE,
+        engine: Optional[MatchingEngine] = None,
+        on_trade: Optional[Callable[[dict], None]] = None,
+    ):
+        self.tick_size = tick_size
+        self.engine = engine or MatchingEngine()
+        self.on_trade = on_trade
+        self.stats = ReplayStats()
+        self._decimals = tick_decimals(tick_size)
+        # Historical flow reuses a small set of prices, so each is converted to ticks once
+        self._ticks: Dict[tuple, Optional[int]] = {}
+
+    def run(self, records: Iterable[dict]) -> ReplayStats:
+        started = time.perf_counter()
+        for record in records:
+            self.submit(record)
+        self.stats.seconds += time.perf_counter() - started
+        return self.stats
+
+    def submit(self, record: dict) -> Optional[MatchResult]:
+        timestamp = parse_timestamp(record.get("timestamp"))
+        if timestamp is not None:
+            self.expire(timestamp)
+        if record.get("action") == "cancel":
+            if self.engine.cancel(int(record["order_id"])) is None:
+                self.stats.rejected += 1
+            else:
+                self.stats.cancels += 1
+            return None
+
+        kind = OrderKind(record.get("kind") or OrderKind.Limit)
+        try:
+            price = self._price(kind, record.get("price"))
+            stop = self._stop_price(kind, record.get("stop_price"))
+        except ValueError:
+            self.stats.rejected += 1
+            return None
+        order_id = record.get("order_id")
+        time_in_force = TimeInForce(record.get("time_in_force") or TimeInForce.GTC)
+        result = self.engine.submit(
+            item_id=int(record["item_id"]),
+            user_id=int(record["user_id"]),
+            side=OrderType(record["side"]),
+            kind=kind,
+            price=price,
+            quantity=int(record.get("quantity") or 1),
+            timestamp=timestamp,
+            order_id=int(order_id) if order_id not in (None, "") else None,
+            time_in_force=time_in_force,
+            expires_at=parse_timestamp(record.get("expires_at")),
+            stop_price=stop,
+        )
+        self.stats.orders += 1
+        self.stats.triggered += len(result.triggered)
+        for step in result.cascade():
+            self.stats.trades += len(step.fills)
+            for fill in step.fills:
+                self.stats.volume += fill.quantity
+                if self.on_trade is not None:
+                    self.on_trade({
+                        "timestamp": step.timestamp.isoformat(),
+                        "item_id": step.order.item_id,
+                        "price": round(fill.price * self.tick_size, self._decimals),
+                        "quantity": fill.quantity,
+                        "buyer_id": fill.buyer_id,
+                        "seller_id": fill.seller_id,
+                        "maker_order_id": fill.maker_id,
+                        "taker_order_id": step.order.id,
+                    })
+        return result
+
+    def expire(self, now: datetime):
+        """Take GTD orders that expire by `now` off the books."""
+        for order_ids in self.engine.due(now).values():
+            self.stats.expired += len(self.engine.expire(order_ids))
+
+    def _price(self, kind: OrderKind, raw) -> Optional[int]:
+        key = (kind, raw)
+        if key not in self._ticks:
+            price = None if raw in (None, "") else float(raw)
+            self._ticks[key] = limit_price(kind, price, self.tick_size)
+        return self._ticks[key]
+
+    def _stop_price(self, kind: OrderKind, raw) -> Optional[int]:
+        return stop_price(kind, None if raw in (None, "") else float(raw), self.tick_size)
+
+    def book(self) -> list:
+        """Aggregated price levels of every book, best first."""
+        books = []
+        for item_id, book in sorted(self.engine.books.items()):
+            books.append({
+                "item_id": item_id,
+                "bids": [self._level(level) for level in book.bids.levels()],
+                "asks": [self._level(level) for level in book.asks.levels()],
+                "market_bids": len(book.market_bids),
+                "market_asks": len(book.market_asks),
+            })
+        return books
+
+    def _level(self, level) -> dict:
+        return {
+            "price": round(level.price * self.tick_size, self._decimals),
+            "quantity": level.quantity,
+            "orders": len(level),
+        }
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """ISO 8601 or epoch seconds, as the naive UTC the engine and database use."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)) or value.replace(".", "", 1).isdigit():
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def read_records(path: str) -> Iterator[dict]:
+    with open(path, newline="") as f:
+        if is_json_lines(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def is_json_lines(path: str) -> bool:
+    return path.endswith((".jsonl", ".ndjson"))
+
+
+class TapeWriter:
+    """Writes trades as CSV, or JSON lines for a .jsonl/.ndjson path."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="")
+        self.json_lines = is_json_lines(path)
+        if not self.json_lines:
+            self.writer = csv.DictWriter(self.file, fieldnames=TAPE_FIELDS)
+            self.writer.writeheader()
+
+    def __call__(self, trade: dict):
+        if self.json_lines:
+            self.file.write(json.dumps(trade) + "\n")
+        else:
+            self.writer.writerow(trade)
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("orders", help="CSV, or JSON lines (.jsonl/.ndjson), of historical orders")
+    parser.add_argument("--tick-size", type=float, default=DEFAULT_TICK_SIZE)
+    parser.add_argument("--trades", help="write the trade tape here (CSV, or JSON lines for .jsonl/.ndjson)")
+    parser.add_argument("--book", help="write the final book of every item here as JSON")
+    args = parser.parse_args()
+
+    tape = TapeWriter(args.trades) if args.trades else None
+    replay = Replay(args.tick_size, on_trade=tape)
+    try:
+        stats = replay.run(read_records(args.orders))
+    finally:
+        if tape is not None:
+            tape.close()
+    if args.book:
+        with open(args.book, "w") as f:
+            json.dump(replay.book(), f, indent=2)
+    print(json.dumps({**asdict(stats), "orders_per_minute": round(stats.orders_per_minute)}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
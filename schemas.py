@@ -1,8 +1,10 @@
-from typing import Optional
+from datetime import datetime, timezone
+from typing import List, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
-from models import OrderType, OrderKind
+from models import OrderType, OrderKind, OrderStatus, LIMIT_KINDS, STOP_KINDS, TimeInForce, utcnow
+from ticks import DEFAULT_TICK_SIZE
 
 
 class UserCreate(BaseModel):
@@ -18,6 +20,7 @@ class UserOut(UserCreate):
 class ItemCreate(BaseModel):
     name: str
     description: Optional[str] = None
+    tick_size: float = Field(default=DEFAULT_TICK_SIZE, gt=0)  # order prices must be multiples of this
 
 
 class ItemOut(ItemCreate):
@@ -31,7 +34,38 @@ class OrderCreate(BaseModel):
     kind: OrderKind = OrderKind.Limit
     item_id: int
     user_id: int
-    price: float
+    price: Optional[float] = None  # required for Limit and StopLimit, ignored otherwise
+    quantity: int = Field(default=1, gt=0)
+    time_in_force: TimeInForce = TimeInForce.GTC
+    expires_at: Optional[datetime] = None  # required for GTD, and only allowed there
+    stop_price: Optional[float] = None  # required for Stop and StopLimit, and only allowed there
+
+    @model_validator(mode="after")
+    def check_price(self) -> "OrderCreate":
+        if self.kind not in LIMIT_KINDS:
+            # Clients have always had to send one, e.g. price 0 for market orders
+            self.price = None
+        elif self.price is None:
+            raise ValueError("price is required for limit orders")
+        return self
+
+    @model_validator(mode="after")
+    def check_stop(self) -> "OrderCreate":
+        if (self.kind in STOP_KINDS) != (self.stop_price is not None):
+            raise ValueError("stop_price is required for stop orders and not allowed otherwise")
+        return self
+
+    @model_validator(mode="after")
+    def check_expiry(self) -> "OrderCreate":
+        if (self.time_in_force == TimeInForce.GTD) != (self.expires_at is not None):
+            raise ValueError("expires_at is required for GTD orders and not allowed otherwise")
+        if self.expires_at is not None:
+            if self.expires_at.tzinfo is not None:
+                # Stored and compared as naive UTC, like every other timestamp
+                self.expires_at = self.expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+            if self.expires_at <= utcnow():
+                raise ValueError("expires_at must be in the future")
+        return self
 
 
 class OrderOut(BaseModel):
@@ -41,19 +75,150 @@ class OrderOut(BaseModel):
     item_id: int
     user_id: int
     price: Optional[float]
+    quantity: int = 1
+    remaining: int = 1
+    time_in_force: TimeInForce = TimeInForce.GTC
+    expires_at: Optional[datetime] = None
+    stop_price: Optional[float] = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class OrderPlacedOut(OrderOut):
+    # None when the order was cancelled by its time in force before it rested, so it was never stored
+    id: Optional[int]
+    status: OrderStatus
+
+
 class TradeOut(BaseModel):
     id: int
     buyer_id: int
     seller_id: int
     item_id: int
     price: float
+    quantity: int = 1
+    timestamp: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
 class DeleteOrderRequest(BaseModel):
     order_id: int
+
+
+class MassCancelRequest(BaseModel):
+    user_id: Optional[int] = None
+    item_id: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_filter(self) -> "MassCancelRequest":
+        if self.user_id is None and self.item_id is None:
+            raise ValueError("Give a user_id, an item_id or both")
+        return self
+
+
+class MassCancelOut(BaseModel):
+    cancelled: List[int]
+
+
+class OrderBatch(BaseModel):
+    orders: List[OrderCreate] = []
+    cancel_order_ids: List[int] = []
+
+
+class OrderBatchResult(BaseModel):
+    order: OrderPlacedOut
+    trades: List[TradeOut]
+
+
+class OrderBatchOut(BaseModel):
+    cancelled: List[int]
+    results: List[OrderBatchResult]
+
+
+class BookLevel(BaseModel):
+    price: float
+    quantity: int
+    orders: int
+
+
+class BookOut(BaseModel):
+    item_id: int
+    best_bid: Optional[float]
+    best_ask: Optional[float]
+    mid_price: Optional[float]
+    bids: List[BookLevel]
+    asks: List[BookLevel]
+    bid_orders: int
+    ask_orders: int
+    market_bids: int
+    market_asks: int
+
+
+class ItemSummaryOut(BaseModel):
+    item_id: int
+    name: str
+    best_bid: Optional[float]
+    best_ask: Optional[float]
+    mid_price: Optional[float]
+    bid_orders: int
+    ask_orders: int
+    market_bids: int
+    market_asks: int
+    trade_count: int
+    average_price: Optional[float]
+    last_price: Optional[float]
+
+
+class TradeStatsOut(BaseModel):
+    item_id: int
+    trade_count: int
+    volume: int
+    average_price: Optional[float]
+    vwap: Optional[float]
+    last_price: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+
+
+class CandleOut(BaseModel):
+    start: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
+    trades: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class DepthPoint(BaseModel):
+    price: float
+    quantity: int  # resting at this price or better
+
+
+class PriceVolume(BaseModel):
+    price: float
+    volume: int
+
+
+class VwapWindow(BaseModel):
+    start: datetime
+    vwap: float
+    volume: int
+
+
+class AnalyticsOut(BaseModel):
+    item_id: int
+    best_bid: Optional[float]
+    best_ask: Optional[float]
+    spread: Optional[float]
+    imbalance: Optional[float]
+    bids: List[DepthPoint]
+    asks: List[DepthPoint]
+    trade_count: int
+    volume: int
+    vwap: Optional[float]
+    volume_at_price: List[PriceVolume]
+    vwap_windows: List[VwapWindow]
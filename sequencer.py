@@ -0,0 +1,109 @@
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class OrderSequencer:
+    """Runs all work for an item on one writer thread, in submission order.
+
+    Items are hashed onto a fixed set of worker threads, so each item has exactly one
+    writer and never sees two matches at once, while different items proceed in parallel.
+    When this process only owns every `stride`-th item id, ids are divided by it first so
+    its items still spread over all the threads.
+    """
+
+    def __init__(self, workers: int = 4, stride: int = 1):
+        self.workers = workers
+        self.stride = stride
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def shard(self, item_id: int) -> int:
+        return item_id // self.stride % self.workers
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for index, work_queue in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._work, args=(work_queue,), name=f"sequencer-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self):
+        with self._start_lock:
+            for work_queue in self._queues:
+                work_queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def submit(self, item_id: int, fn: Callable[..., T], *args) -> "Future[T]":
+        return self._enqueue(self.shard(item_id), fn, args)
+
+    def run(self, item_id: int, fn: Callable[..., T], *args) -> T:
+        """Run `fn` on the item's writer thread and wait for its result."""
+        return self.submit(item_id, fn, *args).result()
+
+    @contextmanager
+    def exclusive(self, item_ids: Iterable[int]):
+        """Hold the writer threads of several items while the caller works on all of them.
+
+        Writers are parked one at a time in shard order, so two overlapping callers can't
+        each hold a writer the other is waiting for.
+        """
+        with self._parked({self.shard(item_id) for item_id in item_ids}):
+            yield
+
+    def exclusive_all(self):
+        """Hold every writer thread, e.g. to snapshot all the books at one point."""
+        return self._parked(range(self.workers))
+
+    @contextmanager
+    def _parked(self, shards: Iterable[int]):
+        release = threading.Event()
+        parked: List[Future] = []
+        try:
+            for shard in sorted(shards):
+                started = threading.Event()
+
+                def park(started=started):
+                    started.set()
+                    release.wait()
+
+                parked.append(self._enqueue(shard, park, ()))
+                started.wait()
+            yield
+        finally:
+            release.set()
+            for future in parked:
+                future.result()
+
+    def _enqueue(self, shard: int, fn: Callable[..., T], args: tuple) -> "Future[T]":
+        self.start()
+        future: Future = Future()
+        self._queues[shard].put((future, fn, args))
+        return future
+
+    @staticmethod
+    def _work(work_queue: queue.Queue):
+        while True:
+            task = work_queue.get()
+            if task is _STOP:
+                return
+            future, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
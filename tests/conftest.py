@@ -1,15 +1,43 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# main's engine and lifespan use DATABASE_URL, so point it away from the committed items.db before
+# anything imports database
+TEST_DIR = tempfile.mkdtemp(prefix="orderbook-tests-")
+atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DIR}/items.db"
+
+from typing import NamedTuple
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, StaticPool
 
-from database import Base
-from main import app, get_db
+from admission import Admission
+from database import Base, GroupCommitter, create_db_engine, create_async_db_engine
+from main import create_app, get_db, get_async_db, get_matching_engine, get_trade_stats, get_market_feed, \
+    get_sequencer, get_journal, get_committer, get_metrics, get_read_cache, get_partition, \
+    get_trade_archive, get_admission
+from marketfeed import MarketFeed
+from metrics import Metrics
+from orderbook import MatchingEngine
+from partitions import Partition
+from readcache import ReadCache
+from sequencer import OrderSequencer
+from tradestats import TradeStats
 
 # Use in-memory SQLite for tests
 SQLALCHEMY_DATABASE_URL = "sqlite+pysqlite:///:memory:"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# StaticPool shares the single in-memory connection between the test and handler threads
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -28,12 +56,105 @@ def override_get_db():
         db.close()
 
 
-@pytest.fixture(scope="function")
-def client():
-    # Reset schema before each test
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+@pytest.fixture(params=["sync", "async"])
+def db_mode(request):
+    if request.param == "async":
+        pytest.importorskip("aiosqlite")
+    return request.param
+
+
+@pytest.fixture
+def session_factory(db_mode, tmp_path):
+    """Sessions on the database the client uses."""
+    if db_mode == "sync":
+        # Reset schema before each test
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        yield TestingSessionLocal
+        return
+
+    # The sync and async drivers can't share an in-memory database, so async mode uses a file
+    file_engine = create_db_engine(f"sqlite:///{tmp_path}/test.db", "wal")
+    Base.metadata.create_all(bind=file_engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+    file_engine.dispose()
+
+
+@pytest.fixture
+def app_factory(db_mode, session_factory, tmp_path):
+    """Build apps on the test database, each with its own engine, caches and writer threads."""
+    cleanups = []
+
+    def make_app(partition: Partition = Partition()):
+        app = create_app(db_mode)
+        committer = None
+        if db_mode == "sync":
+            app.dependency_overrides[get_db] = override_get_db
+        else:
+            # NullPool leaves no aiosqlite connections behind on the test client's event loop
+            async_engine = create_async_db_engine(
+                f"sqlite+aiosqlite:///{tmp_path}/test.db", "wal", poolclass=NullPool
+            )
+            AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
-    app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as c:
+            def override_get_file_db():
+                db = session_factory()
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            async def override_get_async_db():
+                async with AsyncSessionLocal() as db:
+                    yield db
+
+            app.dependency_overrides[get_db] = override_get_file_db
+            app.dependency_overrides[get_async_db] = override_get_async_db
+            committer = GroupCommitter(session_factory)
+            cleanups.append(committer.shutdown)
+
+        matching_engine = MatchingEngine(id_step=partition.count, id_offset=partition.index)
+        app.dependency_overrides[get_matching_engine] = lambda: matching_engine
+        trade_stats = TradeStats()
+        app.dependency_overrides[get_trade_stats] = lambda: trade_stats
+        market_feed = MarketFeed()
+        app.dependency_overrides[get_market_feed] = lambda: market_feed
+        sequencer = OrderSequencer(stride=partition.count)
+        app.dependency_overrides[get_sequencer] = lambda: sequencer
+        cleanups.insert(0, sequencer.shutdown)
+        app.dependency_overrides[get_journal] = lambda: None
+        app.dependency_overrides[get_committer] = lambda: committer
+        metrics = Metrics()
+        app.dependency_overrides[get_metrics] = lambda: metrics
+        read_cache = ReadCache()
+        app.dependency_overrides[get_read_cache] = lambda: read_cache
+        app.dependency_overrides[get_partition] = lambda: partition
+        app.dependency_overrides[get_trade_archive] = lambda: None
+        admission = Admission()
+        app.dependency_overrides[get_admission] = lambda: admission
+        return app
+
+    yield make_app
+    for cleanup in cleanups:
+        cleanup()
+
+
+@pytest.fixture(scope="function")
+def client(app_factory):
+    with TestClient(app_factory()) as c:
         yield c
+
+
+class Market(NamedTuple):
+    item_id: int
+    alice: int
+    bob: int
+
+
+@pytest.fixture
+def market(client) -> Market:
+    """An item and two users to trade it."""
+    item_id = client.post("/items/", json={"name": "Widget"}).json()["id"]
+    alice = client.post("/users/", json={"name": "alice"}).json()["id"]
+    bob = client.post("/users/", json={"name": "bob"}).json()["id"]
+    return Market(item_id, alice, bob)
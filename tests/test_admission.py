@@ -0,0 +1,90 @@
+from admission import Admission
+from main import get_admission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refills_at_the_user_rate():
+    clock = Clock()
+    admission = Admission(user_rate=2, user_burst=3, clock=clock)
+
+    assert [admission.take(1) for _ in range(3)] == [None, None, None]
+    assert admission.take(1) == 0.5
+    # Other users have their own buckets
+    assert admission.take(2, 3) is None
+    clock.now = 1.0
+    assert admission.take(1, 2) is None
+    assert admission.take(1) == 0.5
+
+
+def test_item_queues_are_bounded():
+    admission = Admission(max_depth=2)
+    assert admission.enter(1) and admission.enter(1)
+    assert not admission.enter(1)
+    assert admission.enter(2)
+    assert admission.depths() == {1: 2, 2: 1}
+    admission.leave(1)
+    assert admission.enter(1)
+
+
+def setup_order(client):
+    user = client.post("/users/", json={"name": "Ada"}).json()
+    item = client.post("/items/", json={"name": "Brass Coin"}).json()
+    return {"side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": 5}
+
+
+def test_rate_limited_orders_get_429_before_the_database(client):
+    admission = Admission(user_rate=0.5, user_burst=1)
+    client.app.dependency_overrides[get_admission] = lambda: admission
+    order = setup_order(client)
+
+    assert client.post("/orders/", json=order).status_code == 200
+    response = client.post("/orders/", json=order)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    # The second order of an unknown user is refused before the user is looked up
+    assert client.post("/orders/", json={**order, "user_id": 999}).status_code == 404
+    assert client.post("/orders/", json={**order, "user_id": 999}).status_code == 429
+    assert client.post("/orders/batch", json={"orders": [order]}).status_code == 429
+    assert 'orderbook_rejected_orders_total{reason="rate_limited"} 3' in client.get("/metrics").text
+
+
+def test_full_and_stale_queues_get_503(client):
+    clock = Clock()
+    admission = Admission(max_depth=1, max_age=1, clock=clock)
+    client.app.dependency_overrides[get_admission] = lambda: admission
+    order = setup_order(client)
+
+    # An order already waiting on the item fills its queue
+    admission.enter(order["item_id"])
+    response = client.post("/orders/", json=order)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert 'orderbook_intake_depth{item_id="%d"} 1' % order["item_id"] in client.get("/metrics").text
+    admission.leave(order["item_id"])
+
+    # A batch takes a place in the queue of every item it places orders on
+    admission.enter(order["item_id"])
+    response = client.post("/orders/batch", json={"orders": [order]})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert admission.depths() == {order["item_id"]: 1}
+    admission.leave(order["item_id"])
+
+    # An order that waits past max_age is dropped rather than matched
+    clock_reads = iter([0.0, 5.0])
+    admission.clock = lambda: next(clock_reads)
+    assert client.post("/orders/", json=order).status_code == 503
+    clock_reads = iter([0.0, 5.0])
+    assert client.post("/orders/batch", json={"orders": [order, order]}).status_code == 503
+    assert client.get(f"/orders/?item_id={order['item_id']}").json() == []
+    assert admission.depths() == {}
+    metrics = client.get("/metrics").text
+    assert 'orderbook_rejected_orders_total{reason="queue_full"} 2' in metrics
+    assert 'orderbook_rejected_orders_total{reason="stale"} 3' in metrics
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from analytics import KINDS, NO_PRICE, SIDES, BookColumns, TradeColumns, depth_curve, imbalance, spread, \
+    total_vwap, volume_at_price, vwap
+from archive import TradeArchive, archive_trades
+from main import get_trade_archive
+from models import OrderKind, OrderType, Trade
+
+
+def book(*orders) -> BookColumns:
+    sides, kinds, prices, remaining = zip(*orders)
+    return BookColumns(
+        id=np.arange(len(orders)),
+        side=np.array([SIDES[s] for s in sides], dtype=np.int8),
+        kind=np.array([KINDS[k] for k in kinds], dtype=np.int8),
+        price=np.array(prices),
+        remaining=np.array(remaining),
+        user_id=np.ones(len(orders), dtype=np.int32),
+    )
+
+
+def test_book_depth_spread_and_imbalance():
+    limit, market, stop = OrderKind.Limit, OrderKind.Market, OrderKind.Stop
+    columns = book(
+        (OrderType.Bid, limit, 98, 2), (OrderType.Bid, limit, 99, 1), (OrderType.Bid, limit, 98, 3),
+        (OrderType.Ask, limit, 101, 4), (OrderType.Ask, limit, 103, 1),
+        # Market and stop orders have no level in the book
+        (OrderType.Bid, market, NO_PRICE, 9), (OrderType.Ask, stop, NO_PRICE, 9),
+    )
+
+    prices, cumulative = depth_curve(columns, OrderType.Bid)
+    assert (prices.tolist(), cumulative.tolist()) == ([99, 98], [1, 6])
+    prices, cumulative = depth_curve(columns, OrderType.Ask, levels=1)
+    assert (prices.tolist(), cumulative.tolist()) == ([101], [4])
+    assert spread(columns) == 2
+    assert imbalance(columns) == pytest.approx((6 - 5) / 11)
+    assert imbalance(columns, levels=1) == pytest.approx((1 - 4) / 5)
+
+    one_sided = book((OrderType.Bid, limit, 98, 2))
+    assert spread(one_sided) is None
+    assert imbalance(one_sided) == 1
+
+
+def trades(prices, quantities, timestamps) -> TradeColumns:
+    ids = np.arange(len(prices))
+    return TradeColumns(ids, ids, ids, np.array(prices), np.array(quantities), np.array(timestamps, dtype="datetime64[us]"))
+
+
+def test_volume_at_price_and_vwap_windows():
+    columns = trades(
+        [100, 102, 100, 110, 104],
+        [1, 2, 3, 1, 5],
+        # Out of time order, with one trade from before timestamps were kept
+        ["2024-01-01T00:10", "2024-01-01T00:50", "2024-01-01T01:05", "2024-01-01T00:20", None],
+    )
+
+    prices, volumes = volume_at_price(columns)
+    assert (prices.tolist(), volumes.tolist()) == ([100, 102, 104, 110], [4, 2, 5, 1])
+    # Prices spread over far more ticks than there are trades are counted by sorting instead
+    sparse = trades([5, 10_000_000, 5], [1, 2, 3], [None] * 3)
+    assert [a.tolist() for a in volume_at_price(sparse)] == [[5, 10_000_000], [4, 2]]
+
+    starts, vwaps, volumes = vwap(columns, 3600)
+    assert starts.tolist() == [datetime(2024, 1, 1, 0), datetime(2024, 1, 1, 1)]
+    assert vwaps.tolist() == pytest.approx([(100 + 204 + 110) / 4, 100])
+    assert volumes.tolist() == [4, 3]
+    assert total_vwap(columns) == pytest.approx((100 + 204 + 300 + 110 + 520) / 12)
+    assert total_vwap(trades([], [], [])) is None
+
+
+def test_analytics_endpoint_reads_book_table_and_archive(client, session_factory, tmp_path):
+    buyer = client.post("/users/", json={"name": "Uma"}).json()
+    seller = client.post("/users/", json={"name": "Vic"}).json()
+    item = client.post("/items/", json={"name": "Zinc Coin", "tick_size": 0.1}).json()
+    order = {"item_id": item["id"], "quantity": 2}
+    for price in (1.0, 1.2):
+        client.post("/orders/", json={**order, "side": "Ask", "user_id": seller["id"], "price": price})
+        client.post("/orders/", json={**order, "side": "Bid", "user_id": buyer["id"], "price": price})
+    client.post("/orders/", json={**order, "side": "Bid", "user_id": buyer["id"], "price": 0.9})
+    client.post("/orders/", json={**order, "side": "Bid", "user_id": buyer["id"], "price": 0.8, "quantity": 3})
+    client.post("/orders/", json={**order, "side": "Ask", "user_id": seller["id"], "price": 1.3})
+
+    # Archive the first trade, a day back
+    with session_factory() as db:
+        first = db.query(Trade).order_by(Trade.id).first()
+        first.timestamp = datetime(2024, 1, 2, 12)
+        db.commit()
+        archive = TradeArchive(str(tmp_path / "archive"))
+        archive_trades(db, archive, datetime(2024, 2, 1))
+    client.app.dependency_overrides[get_trade_archive] = lambda: archive
+
+    response = client.get(f"/items/{item['id']}/analytics?interval=1d")
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["best_bid"], result["best_ask"], result["spread"]) == (0.9, 1.3, pytest.approx(0.4))
+    assert result["bids"] == [{"price": 0.9, "quantity": 2}, {"price": 0.8, "quantity": 5}]
+    assert result["asks"] == [{"price": 1.3, "quantity": 2}]
+    assert result["imbalance"] == pytest.approx(3 / 7)
+    assert (result["trade_count"], result["volume"], result["vwap"]) == (2, 4, pytest.approx(1.1))
+    assert result["volume_at_price"] == [{"price": 1.0, "volume": 2}, {"price": 1.2, "volume": 2}]
+    assert [(w["start"], w["vwap"]) for w in result["vwap_windows"]][0] == ("2024-01-02T00:00:00", 1.0)
+
+    later = client.get(f"/items/{item['id']}/analytics?levels=1&start=2024-01-03T00:00:00Z").json()
+    assert later["bids"] == [{"price": 0.9, "quantity": 2}]
+    assert later["volume_at_price"] == [{"price": 1.2, "volume": 2}]
+    assert client.get(f"/items/{item['id']}/analytics?interval=2h").status_code == 400
+    assert client.get("/items/999/analytics").status_code == 404
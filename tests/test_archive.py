@@ -0,0 +1,88 @@
+import json
+from datetime import date, datetime, timedelta
+
+from archive import ArchivedTrade, TradeArchive, archive_trades
+from main import get_trade_archive
+from models import Trade
+
+
+def test_archive_round_trips_and_merges_by_id(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    day = date(2024, 3, 1)
+    first = [ArchivedTrade(i, 1, 2, 7, 100 + i, 1, datetime(2024, 3, 1, 9, 0, i)) for i in (1, 2, 3)]
+    archive.write(7, day, first)
+    # Writing overlapping trades again, e.g. after a crash before the delete, keeps one of each
+    archive.write(7, day, first[1:] + [ArchivedTrade(5, 2, 1, 7, 99, 4, datetime(2024, 3, 1, 17, 30, 0, 250))])
+
+    assert [t.id for t in archive.read(7)] == [1, 2, 3, 5]
+    assert list(archive.read(7))[-1] == ArchivedTrade(5, 2, 1, 7, 99, 4, datetime(2024, 3, 1, 17, 30, 0, 250))
+    assert [t.id for t in archive.read(7, start=datetime(2024, 3, 1, 9, 0, 2), end=datetime(2024, 3, 1, 12))] == [2, 3]
+    assert [t.id for t in archive.read(7, after_id=2)] == [3, 5]
+    assert archive.days(7) == [day]
+    assert list(archive.read(8)) == []
+
+
+def test_windowed_trades_merge_archive_and_table(client, session_factory, tmp_path):
+    buyer = client.post("/users/", json={"name": "Sam"}).json()
+    seller = client.post("/users/", json={"name": "Tess"}).json()
+    item = client.post("/items/", json={"name": "Lead Coin"}).json()
+    for price in (10, 11, 12):
+        client.post("/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": price})
+        client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": price})
+
+    # Backdate the first two trades and move them to the archive
+    old = datetime(2024, 1, 2, 12)
+    with session_factory() as db:
+        ids = [t.id for t in db.query(Trade).order_by(Trade.id)]
+        for offset, trade_id in enumerate(ids[:2]):
+            db.query(Trade).filter(Trade.id == trade_id).update({"timestamp": old + timedelta(hours=offset)})
+        db.commit()
+        archive = TradeArchive(str(tmp_path / "archive"))
+        assert archive_trades(db, archive, datetime(2024, 2, 1)) == {item["id"]}
+        assert db.query(Trade).count() == 1
+    client.app.dependency_overrides[get_trade_archive] = lambda: archive
+
+    live = client.get(f"/trades/?item_id={item['id']}").json()
+    assert [t["price"] for t in live] == [12]
+
+    window = client.get(f"/trades/?item_id={item['id']}&start=2024-01-01T00:00:00Z").json()
+    assert [t["id"] for t in window] == ids
+    assert [t["price"] for t in window] == [10, 11, 12]
+    assert window[0]["timestamp"] == "2024-01-02T12:00:00"
+
+    page = client.get(f"/trades/?item_id={item['id']}&start=2024-01-01T00:00:00&limit=2")
+    assert [t["id"] for t in page.json()] == ids[:2]
+    rest = client.get(f"/trades/?item_id={item['id']}&start=2024-01-01T00:00:00&after_id={page.headers['X-Next-After-Id']}")
+    assert [t["id"] for t in rest.json()] == ids[2:]
+
+    early = client.get(f"/trades/?item_id={item['id']}&start=2024-01-02T12:30:00&end=2024-01-03T00:00:00").json()
+    assert [t["id"] for t in early] == ids[1:2]
+    streamed = client.get(f"/trades/?item_id={item['id']}&start=2024-01-01T00:00:00&stream=true").text.splitlines()
+    assert len(streamed) == 3
+
+
+def test_windowed_trades_merge_by_id_when_the_table_holds_lower_ids(client, session_factory, tmp_path):
+    buyer = client.post("/users/", json={"name": "Uri"}).json()
+    seller = client.post("/users/", json={"name": "Val"}).json()
+    item = client.post("/items/", json={"name": "Tin Coin"}).json()
+    for price in (10, 11, 12):
+        client.post("/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": price})
+        client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": price})
+
+    # The first trade stays in the table with the lowest id while the later two are archived
+    with session_factory() as db:
+        ids = [t.id for t in db.query(Trade).order_by(Trade.id)]
+        db.query(Trade).filter(Trade.id.in_(ids[1:])).update({"timestamp": datetime(2024, 1, 2)})
+        db.commit()
+        archive = TradeArchive(str(tmp_path / "archive"))
+        archive_trades(db, archive, datetime(2024, 2, 1))
+    client.app.dependency_overrides[get_trade_archive] = lambda: archive
+
+    window = f"/trades/?item_id={item['id']}&start=2024-01-01T00:00:00"
+    assert [t["id"] for t in client.get(window).json()] == ids
+    page = client.get(f"{window}&limit=2")
+    assert [t["id"] for t in page.json()] == ids[:2]
+    rest = client.get(f"{window}&after_id={page.headers['X-Next-After-Id']}")
+    assert [t["id"] for t in rest.json()] == ids[2:]
+    streamed = client.get(f"{window}&stream=true&limit=2").text.splitlines()
+    assert [json.loads(line)["id"] for line in streamed] == ids[:2]
@@ -0,0 +1,129 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from cluster import create_router, target
+from database import Base, create_db_engine
+from main import get_db
+from orderbook import MatchingEngine
+from partitions import Partition
+
+
+def test_target_routes_item_requests_to_owner():
+    assert target("POST", "/orders/", {}, b'{"item_id": 7}', 4) == 3
+    assert target("GET", "/orders/", {"item_id": "6"}, b"", 4) == 2
+    assert target("GET", "/trades/", {"item_id": "5"}, b"", 4) == 1
+    assert target("GET", "/book/9", {}, b"", 4) == 1
+    assert target("GET", "/items/10/candles", {}, b"", 4) == 2
+    assert target("GET", "/items/7/analytics", {}, b"", 4) == 3
+    assert target("GET", "/ws/book/11", {}, b"", 4) == 3
+    assert target("POST", "/orders/delete/", {}, b'{"order_id": 13}', 4) == 1
+    assert target("POST", "/orders/cancel", {}, b'{"user_id": 1, "item_id": 6}', 4) == 2
+    assert target("POST", "/orders/cancel", {}, b'{"user_id": 1}', 4) is None
+    # Shared lists and unparseable requests go to worker 0
+    assert target("GET", "/items/", {}, b"", 4) == 0
+    assert target("POST", "/users/", {}, b'{"name": "Ann"}', 4) == 0
+    assert target("POST", "/orders/", {}, b"not json", 4) == 0
+
+
+def test_target_refuses_batches_across_partitions():
+    single = b'{"orders": [{"item_id": 1}, {"item_id": 3}], "cancel_order_ids": [5]}'
+    assert target("POST", "/orders/batch", {}, single, 2) == 1
+    mixed = b'{"orders": [{"item_id": 1}], "cancel_order_ids": [4]}'
+    assert target("POST", "/orders/batch", {}, mixed, 2) is None
+
+
+def test_engine_numbers_orders_in_partition_residue():
+    engine = MatchingEngine(id_step=4, id_offset=3)
+    assert [engine.peek_next_id(), engine.peek_next_id()] == [3, 3]
+    engine.reserve_ids(10)
+    assert engine.peek_next_id() == 11
+    engine.reserve_ids(11)
+    assert engine.peek_next_id() == 15
+    assert MatchingEngine(id_step=4).peek_next_id() == 4
+
+
+def test_worker_refuses_other_partitions_items(app_factory):
+    client = TestClient(app_factory(Partition(index=1, count=2)))
+    user = client.post("/users/", json={"name": "Pat"}).json()
+    client.post("/items/", json={"name": "Odd Coin"})
+    even = client.post("/items/", json={"name": "Even Coin"}).json()
+
+    response = client.post("/orders/", json={"side": "Bid", "item_id": even["id"], "user_id": user["id"], "price": 10})
+    assert response.status_code == 421
+    assert response.headers["X-Partition"] == "0"
+    assert client.get(f"/book/{even['id']}").status_code == 421
+
+
+@pytest.fixture
+def cluster(app_factory, db_mode, tmp_path):
+    workers = [app_factory(Partition(index=i, count=2)) for i in range(2)]
+    engines = []
+    if db_mode == "sync":
+        # Like real workers, each gets its own connections to one file database; on the shared
+        # in-memory connection, requests fanned out to both workers at once would interleave
+        url = f"sqlite:///{tmp_path}/cluster.db"
+        engines = [create_db_engine(url, "wal") for _ in workers]
+        Base.metadata.create_all(bind=engines[0])
+        for worker, engine in zip(workers, engines):
+            worker.dependency_overrides[get_db] = session_dependency(sessionmaker(autoflush=False, bind=engine))
+    router = create_router([httpx.ASGITransport(app=worker) for worker in workers])
+    with TestClient(router) as c:
+        yield c
+    for engine in engines:
+        engine.dispose()
+
+
+def session_dependency(sessions: sessionmaker):
+    def get_worker_db():
+        db = sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    return get_worker_db
+
+
+def test_router_forwards_to_owning_worker(cluster):
+    buyer = cluster.post("/users/", json={"name": "Quinn"}).json()
+    seller = cluster.post("/users/", json={"name": "Rory"}).json()
+    items = [cluster.post("/items/", json={"name": f"Coin {i}"}).json() for i in range(2)]
+
+    for item in items:
+        ask = cluster.post("/orders/", json={
+            "side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": 10, "quantity": 2
+        })
+        assert ask.status_code == 200
+        # The owner numbers the order in its item's residue class
+        assert ask.json()["id"] % 2 == item["id"] % 2
+        bid = cluster.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 10})
+        assert bid.status_code == 200
+
+        book = cluster.get(f"/book/{item['id']}").json()
+        assert [(l["price"], l["quantity"]) for l in book["asks"]] == [(10, 1)]
+        assert cluster.get(f"/items/{item['id']}/stats").json()["trade_count"] == 1
+        assert len(cluster.get(f"/trades/?item_id={item['id']}").json()) == 1
+
+        deleted = cluster.post("/orders/delete/", json={"order_id": ask.json()["id"]})
+        assert deleted.status_code == 200
+        assert cluster.get(f"/book/{item['id']}").json()["asks"] == []
+
+    assert len(cluster.get("/items/").json()) == 2
+    # Each worker summarizes its own items and the router merges them
+    summary = cluster.get("/items/summary").json()
+    assert [(s["item_id"], s["trade_count"]) for s in summary] == [(item["id"], 1) for item in items]
+    page = cluster.get("/items/summary?limit=1")
+    assert [s["item_id"] for s in page.json()] == [items[0]["id"]]
+    assert page.headers["X-Next-After-Id"] == str(items[0]["id"])
+    for item in items:
+        cluster.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 5})
+    # A user's mass cancel reaches every worker
+    cancelled = cluster.post("/orders/cancel", json={"user_id": buyer["id"]}).json()["cancelled"]
+    assert sorted(id % 2 for id in cancelled) == [0, 1]
+    assert cluster.post("/orders/cancel", json={"user_id": buyer["id"]}).json() == {"cancelled": []}
+    response = cluster.post("/orders/batch", json={"orders": [
+        {"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 5} for item in items
+    ]})
+    assert response.status_code == 400
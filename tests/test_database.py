@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, GroupCommitter, create_db_engine
+from main import get_committer
+from migrations import upgrade
+from models import ItemOrder
+
+
+def test_wal_profile_sets_pragmas_on_every_connection(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/wal.db", "wal")
+    with engine.connect() as a, engine.connect() as b:
+        for conn in (a, b):
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    engine.dispose()
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        create_db_engine("sqlite://", "fast")
+
+
+def test_group_committer_batches_queued_writes(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/group.db", "wal")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    transactions = []
+
+    def session_factory():
+        transactions.append(1)
+        return SessionLocal()
+
+    committer = GroupCommitter(session_factory)
+    started, release = threading.Event(), threading.Event()
+
+    def write(order_id, wait=False):
+        def apply(session):
+            if wait:
+                started.set()
+                release.wait()
+            session.add(ItemOrder(id=order_id, side="Bid", kind="Limit", price=1, item_id=1, user_id=1))
+        return apply
+
+    # Everything queued while the first transaction is open goes into the next one
+    futures = [committer.submit(write(1, wait=True))]
+    started.wait()
+    futures += [committer.submit(write(i)) for i in range(2, 52)]
+    release.set()
+    for future in futures:
+        future.result()
+    committer.shutdown()
+
+    assert len(transactions) == 2
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM orders")).scalar() == 51
+    engine.dispose()
+
+
+def test_failed_group_fails_every_write(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/fail.db", "wal")
+    Base.metadata.create_all(bind=engine)
+    committer = GroupCommitter(sessionmaker(bind=engine))
+    release = threading.Event()
+    committer.submit(lambda session: release.wait())
+
+    def duplicate(session):
+        session.add(ItemOrder(id=1, side="Bid", kind="Limit", price=1, item_id=1, user_id=1))
+
+    futures = [committer.submit(duplicate) for _ in range(2)]
+    release.set()
+    for future in futures:
+        with pytest.raises(Exception):
+            future.result()
+    committer.shutdown()
+    engine.dispose()
+
+
+def test_orders_through_group_commit(client, session_factory):
+    committer = GroupCommitter(session_factory)
+    client.app.dependency_overrides[get_committer] = lambda: committer
+    item_id = client.post("/items/", json={"name": "Widget"}).json()["id"]
+    alice = client.post("/users/", json={"name": "alice"}).json()["id"]
+    bob = client.post("/users/", json={"name": "bob"}).json()["id"]
+
+    ask = client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 3})
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 10, "quantity": 2})
+    committer.shutdown()
+
+    orders = client.get(f"/orders/?item_id={item_id}").json()
+    assert [(o["id"], o["remaining"]) for o in orders] == [(ask.json()["id"], 1)]
+    assert [t["quantity"] for t in client.get(f"/trades/?item_id={item_id}").json()] == [2]
+
+
+def test_upgrade_converts_float_prices_to_ticks(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/old.db", "default")
+    with engine.begin() as conn:
+        # The schema before tick sizes, as created by an earlier release
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name VARCHAR, description VARCHAR)"))
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)"))
+        conn.execute(text(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, side VARCHAR(3) NOT NULL, kind VARCHAR(6) NOT NULL, "
+            "price FLOAT, item_id INTEGER NOT NULL, user_id INTEGER NOT NULL)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE trades (id INTEGER PRIMARY KEY, buyer_id INTEGER NOT NULL, seller_id INTEGER NOT NULL, "
+            "item_id INTEGER NOT NULL, price FLOAT NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX ix_orders_id ON orders (id)"))
+        conn.execute(text("INSERT INTO items (id, name) VALUES (1, 'Widget')"))
+        conn.execute(text("INSERT INTO orders VALUES (1, 'Bid', 'Limit', 10.07, 1, 1), (2, 'Bid', 'Market', NULL, 1, 1)"))
+        conn.execute(text("INSERT INTO trades VALUES (1, 1, 2, 1, 9.99)"))
+
+    upgrade(engine)
+    upgrade(engine)  # a second run finds nothing left to convert
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT tick_size FROM items")).scalar() == 0.01
+        assert conn.execute(text("SELECT id, price, remaining FROM orders ORDER BY id")).all() == \
+            [(1, 1007, 1), (2, None, 1)]
+        assert conn.execute(text("SELECT price, typeof(price) FROM trades")).one() == (999, "integer")
+    engine.dispose()
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+
+import encoding
+from encoding import COLUMNS_JSON, JSON, MSGPACK, negotiate
+from models import OrderType
+from schemas import OrderOut, TradeOut
+
+
+def test_negotiate():
+    assert negotiate(None) == JSON
+    assert negotiate("application/json, text/plain, */*") == JSON
+    assert negotiate(f"{COLUMNS_JSON}, application/json;q=0.5") == COLUMNS_JSON
+    assert negotiate(f"application/json;q=0.5, {COLUMNS_JSON}") == COLUMNS_JSON
+    assert negotiate("text/html") is None
+    assert negotiate(f"{COLUMNS_JSON};q=0") is None
+
+
+def test_standard_library_fallback_matches_orjson(monkeypatch):
+    pytest.importorskip("orjson")
+    rows = [[1, OrderType.Bid, 10.5, datetime(2024, 1, 2, 3, 4, 5, 6)], [2, OrderType.Ask, None, datetime(2024, 1, 2)]]
+    fields = ("id", "side", "price", "timestamp")
+    fast = encoding.encode_rows(fields, rows, JSON)
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert encoding.encode_rows(fields, rows, JSON) == fast
+
+
+@pytest.fixture
+def traded_item(client, market) -> int:
+    item_id, alice, bob = market
+    client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10.05, "quantity": 3})
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 10.1, "quantity": 2})
+    return item_id
+
+
+def test_json_rows_match_the_schemas(client, traded_item):
+    item_id = traded_item
+    orders = client.get(f"/orders/?item_id={item_id}")
+    assert orders.headers["content-type"] == JSON
+    assert [OrderOut.model_validate(o).model_dump(mode="json") for o in orders.json()] == orders.json()
+    assert orders.json()[0]["price"] == 10.05
+    trades = client.get(f"/trades/?item_id={item_id}").json()
+    assert [TradeOut.model_validate(t).model_dump(mode="json") for t in trades] == trades
+
+
+def test_columnar_encoding(client, traded_item):
+    item_id = traded_item
+    json_rows = client.get(f"/trades/?item_id={item_id}").json()
+    response = client.get(f"/trades/?item_id={item_id}", headers={"Accept": COLUMNS_JSON})
+    assert response.headers["content-type"] == COLUMNS_JSON
+    table = response.json()
+    assert [dict(zip(table["columns"], row)) for row in table["rows"]] == json_rows
+    # Each representation is cached and tagged separately
+    assert response.headers["etag"] != client.get(f"/trades/?item_id={item_id}").headers["etag"]
+    assert client.get("/users/", headers={"Accept": COLUMNS_JSON}).json()["columns"] == ["name", "id"]
+
+
+def test_msgpack_encoding(client, traded_item):
+    msgpack = pytest.importorskip("msgpack")
+    item_id = traded_item
+    response = client.get(f"/orders/?item_id={item_id}", headers={"Accept": MSGPACK})
+    table = msgpack.unpackb(response.content)
+    assert [dict(zip(table["columns"], row)) for row in table["rows"]] == client.get(f"/orders/?item_id={item_id}").json()
+
+
+def test_unacceptable_media_type(client):
+    assert client.get("/items/", headers={"Accept": "text/html"}).status_code == 406
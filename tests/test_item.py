@@ -15,3 +15,54 @@ def test_get_items(client):
     data = response.json()
     assert isinstance(data, list)
     assert any(item["name"] == "Rare Coin" for item in data)
+
+
+def test_prices_follow_the_item_tick_size(client):
+    item = client.post("/items/", json={"name": "Penny Stock", "tick_size": 0.05}).json()
+    assert item["tick_size"] == 0.05
+    user = client.post("/users/", json={"name": "alice"}).json()
+    order = {"side": "Bid", "item_id": item["id"], "user_id": user["id"], "quantity": 1}
+
+    assert client.post("/orders/", json={**order, "price": 0.15}).json()["price"] == 0.15
+    response = client.post("/orders/", json={**order, "price": 0.12})
+    assert response.status_code == 400
+    assert "tick size" in response.json()["detail"]
+    assert [level["price"] for level in client.get(f"/book/{item['id']}").json()["bids"]] == [0.15]
+
+
+def test_default_tick_size_is_one_cent(client):
+    item = client.post("/items/", json={"name": "Rare Coin"}).json()
+    assert item["tick_size"] == 0.01
+    user = client.post("/users/", json={"name": "alice"}).json()
+    response = client.post(
+        "/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": user["id"], "price": 10.005}
+    )
+    assert response.status_code == 400
+
+
+def test_items_summary(client):
+    buyer = client.post("/users/", json={"name": "Wade"}).json()
+    seller = client.post("/users/", json={"name": "Xena"}).json()
+    coin = client.post("/items/", json={"name": "Brass Coin"}).json()
+    bar = client.post("/items/", json={"name": "Steel Bar", "tick_size": 0.5}).json()
+    idle = client.post("/items/", json={"name": "Idle Coin"}).json()
+    for side, user, price in (("Ask", seller, 1.2), ("Bid", buyer, 1.2), ("Ask", seller, 1.3), ("Bid", buyer, 1.0)):
+        client.post("/orders/", json={"side": side, "item_id": coin["id"], "user_id": user["id"], "price": price})
+    client.post("/orders/", json={"side": "Ask", "item_id": bar["id"], "user_id": seller["id"], "price": 20.5})
+
+    summary = client.get("/items/summary").json()
+    assert [s["item_id"] for s in summary] == [coin["id"], bar["id"], idle["id"]]
+    assert summary[0] == {
+        "item_id": coin["id"], "name": "Brass Coin", "best_bid": 1.0, "best_ask": 1.3, "mid_price": 1.15,
+        "bid_orders": 1, "ask_orders": 1, "market_bids": 0, "market_asks": 0,
+        "trade_count": 1, "average_price": 1.2, "last_price": 1.2,
+    }
+    assert (summary[1]["best_ask"], summary[1]["mid_price"], summary[1]["trade_count"]) == (20.5, 20.5, 0)
+    assert (summary[2]["best_bid"], summary[2]["ask_orders"], summary[2]["average_price"]) == (None, 0, None)
+
+    page = client.get("/items/summary?limit=2")
+    assert [s["item_id"] for s in page.json()] == [coin["id"], bar["id"]]
+    rest = client.get(f"/items/summary?after_id={page.headers['X-Next-After-Id']}").json()
+    assert [s["item_id"] for s in rest] == [idle["id"]]
+    chosen = client.get(f"/items/summary?item_ids={idle['id']}&item_ids={coin['id']}").json()
+    assert [s["item_id"] for s in chosen] == [coin["id"], idle["id"]]
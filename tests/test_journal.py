@@ -0,0 +1,221 @@
+import os
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from journal import Journal, encode_cancel, match_records
+from main import committed_entries, get_journal, settle_entries
+from models import OrderType, OrderKind, TimeInForce
+from orderbook import MatchingEngine
+
+
+def resting(engine: MatchingEngine):
+    return sorted(
+        (o.id, o.item_id, o.user_id, o.side, o.kind, o.price, o.quantity, o.remaining)
+        for book in engine.books.values()
+        for o in book.resting_orders()
+    )
+
+
+def trade(engine: MatchingEngine, journal: Journal, rng: random.Random, orders: int):
+    for _ in range(orders):
+        item_id = rng.randrange(3)
+        if engine.orders and rng.random() < 0.2:
+            order = rng.choice(list(engine.orders.values()))
+            engine.cancel(order.id)
+            journal.wait(journal.append([encode_cancel(order.id, order.item_id)]))
+            continue
+        kind = OrderKind.Market if rng.random() < 0.1 else OrderKind.Limit
+        result = engine.submit(
+            item_id,
+            rng.randrange(5),
+            rng.choice([OrderType.Bid, OrderType.Ask]),
+            kind,
+            None if kind == OrderKind.Market else rng.randint(95, 105),
+            quantity=rng.randint(1, 4),
+        )
+        journal.wait(journal.append(match_records(result)))
+
+
+def test_snapshot_and_tail_rebuild_the_books(tmp_path):
+    rng = random.Random(9)
+    engine = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    journal.snapshot(engine)
+    trade(engine, journal, rng, 300)
+    journal.snapshot(engine)
+    trade(engine, journal, rng, 300)
+    journal.close()
+
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered)
+    assert resting(recovered) == resting(engine)
+    assert recovered.peek_next_id() == engine.peek_next_id()
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("snapshot-")]) == 1
+
+
+def test_recover_truncates_a_torn_record(tmp_path):
+    engine = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    journal.snapshot(engine)
+    trade(engine, journal, random.Random(3), 50)
+    journal.close()
+
+    segment = max(os.path.join(tmp_path, n) for n in os.listdir(tmp_path) if n.startswith("journal-"))
+    size = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        f.write(match_records(engine.submit(7, 1, OrderType.Bid, OrderKind.Limit, 1))[0][:-3])
+
+    recovered = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    assert journal.recover(recovered)
+    assert os.path.getsize(segment) == size
+    engine.cancel(engine.peek_next_id() - 1)
+    assert resting(recovered) == resting(engine)
+
+    # New records land right after the last good one
+    journal.start()
+    journal.wait(journal.append(match_records(recovered.submit(1, 1, OrderType.Ask, OrderKind.Limit, 200))))
+    journal.close()
+    again = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(again)
+    assert resting(again) == resting(recovered)
+
+
+def test_api_writes_orders_and_cancels_to_the_journal(client, tmp_path):
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    journal.snapshot(MatchingEngine())
+    client.app.dependency_overrides[get_journal] = lambda: journal
+
+    item_id = client.post("/items/", json={"name": "Widget"}).json()["id"]
+    alice = client.post("/users/", json={"name": "alice"}).json()["id"]
+    bob = client.post("/users/", json={"name": "bob"}).json()["id"]
+    kept = client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 3})
+    dropped = client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 12})
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 10})
+    client.post("/orders/delete/", json={"order_id": dropped.json()["id"]})
+    client.post("/orders/batch", json={"orders": [
+        {"side": "Bid", "item_id": item_id, "user_id": bob, "price": 9},
+    ]})
+    journal.close()
+
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered)
+    book = client.get(f"/book/{item_id}").json()
+    # The journal holds prices in ticks of the default 0.01 tick size
+    assert [(l.price, l.quantity) for l in recovered.book(item_id).asks.levels()] == [(1000, 2)]
+    assert [(l["price"], l["quantity"]) for l in book["asks"]] == [(10, 2)]
+    assert [(l.price, l.quantity) for l in recovered.book(item_id).bids.levels()] == [(900, 1)]
+    assert [(l["price"], l["quantity"]) for l in book["bids"]] == [(9, 1)]
+    assert kept.json()["id"] in recovered.orders
+
+
+def test_recovery_replays_only_committed_entries(tmp_path):
+    engine = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    offset = journal.snapshot(engine)
+    ask = journal.append_entry(match_records(engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 100, quantity=2)))
+    # A bid whose transaction failed, so it never traded as far as the database knows
+    journal.append_entry(match_records(engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 100)))
+    bid = journal.append_entry(match_records(engine.submit(1, 3, OrderType.Bid, OrderKind.Limit, 99)))
+    journal.wait(bid.ticket)
+    journal.close()
+
+    committed = [(offset, offset), (ask.start, ask.end), (bid.start, bid.end)]
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered, committed)
+    assert [(o.id, o.remaining) for o in recovered.orders.values()] == [(1, 2), (3, 1)]
+    # Without the committed entries every record is replayed, the failed bid included
+    replayed = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(replayed)
+    assert [(o.id, o.remaining) for o in replayed.orders.values()] == [(1, 1), (3, 1)]
+
+    # A committed entry the journal lost in a crash leaves recovery to the database
+    assert not Journal(str(tmp_path)).recover(MatchingEngine(), committed + [(bid.end, bid.end + 10)])
+
+
+def test_failed_commits_are_not_recovered(client, session_factory, tmp_path):
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    with session_factory() as db:
+        settle_entries(db, journal, journal.snapshot(MatchingEngine()))
+        db.commit()
+    client.app.dependency_overrides[get_journal] = lambda: journal
+
+    item_id = client.post("/items/", json={"name": "Widget"}).json()["id"]
+    alice = client.post("/users/", json={"name": "alice"}).json()["id"]
+    bob = client.post("/users/", json={"name": "bob"}).json()["id"]
+    ask = client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10}).json()
+
+    def fail(session):
+        raise RuntimeError("disk full")
+
+    event.listen(session_factory, "before_commit", fail)
+    with pytest.raises(RuntimeError):
+        client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 10})
+    with pytest.raises(RuntimeError):
+        client.post("/orders/batch", json={"orders": [{"side": "Bid", "item_id": item_id, "user_id": bob, "price": 11}]})
+    event.remove(session_factory, "before_commit", fail)
+    bid = client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 9}).json()
+    journal.close()
+
+    with session_factory() as db:
+        committed = committed_entries(db, journal)
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered, committed)
+    # The failed bids never traded with the ask, in the database or the recovered book
+    assert sorted(recovered.orders) == [ask["id"], bid["id"]]
+    assert client.get(f"/trades/?item_id={item_id}").json() == []
+    assert [o["id"] for o in client.get(f"/orders/?item_id={item_id}").json()] == [ask["id"], bid["id"]]
+
+
+def test_recovery_keeps_time_in_force(tmp_path):
+    engine = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    journal.snapshot(engine)
+    expires = datetime(2030, 5, 6, 7, 8, 9)
+    gtd = engine.submit(1, 1, OrderType.Bid, OrderKind.Limit, 90, time_in_force=TimeInForce.GTD, expires_at=expires)
+    journal.wait(journal.append(match_records(gtd)))
+    ioc = engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 95, time_in_force=TimeInForce.IOC)
+    journal.wait(journal.append(match_records(ioc)))
+    journal.close()
+
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered)
+    assert list(recovered.orders) == [gtd.order.id]
+    assert (recovered.orders[gtd.order.id].time_in_force, recovered.orders[gtd.order.id].expires_at) == (
+        TimeInForce.GTD, expires
+    )
+    assert recovered.due(expires) == {1: [gtd.order.id]}
+
+
+def test_recovery_keeps_stops_and_replays_their_triggers(tmp_path):
+    engine = MatchingEngine()
+    journal = Journal(str(tmp_path), fsync=False)
+    journal.start()
+    orders = [
+        (1, OrderType.Ask, OrderKind.Limit, 100, None),
+        (1, OrderType.Ask, OrderKind.Limit, 101, None),
+        (2, OrderType.Bid, OrderKind.Stop, None, 100),
+        (3, OrderType.Bid, OrderKind.StopLimit, 99, 101),
+    ]
+    for user_id, side, kind, price, stop in orders:
+        journal.wait(journal.append(match_records(engine.submit(1, user_id, side, kind, price, stop_price=stop))))
+    # The snapshot holds the untriggered stops, the journal after it the order that triggers one
+    journal.snapshot(engine)
+    journal.wait(journal.append(match_records(engine.submit(1, 4, OrderType.Bid, OrderKind.Limit, 100))))
+    journal.close()
+
+    recovered = MatchingEngine()
+    assert Journal(str(tmp_path)).recover(recovered)
+    assert resting(recovered) == resting(engine)
+    assert [(o.id, o.kind, o.stop_price) for o in recovered.book(1).resting_orders()] == [
+        (4, OrderKind.Limit, 101)
+    ]
@@ -0,0 +1,45 @@
+def post_order(client, side, item_id, user_id, price, quantity=1):
+    return client.post("/orders/", json={
+        "side": side, "item_id": item_id, "user_id": user_id, "price": price, "quantity": quantity,
+    }).json()
+
+
+def test_feed_sends_snapshot_then_sequenced_events(client):
+    buyer = client.post("/users/", json={"name": "Nina"}).json()
+    seller = client.post("/users/", json={"name": "Omar"}).json()
+    item = client.post("/items/", json={"name": "Platinum Coin"}).json()
+    resting = post_order(client, "Ask", item["id"], seller["id"], 100, quantity=3)
+
+    with client.websocket_connect(f"/ws/book/{item['id']}") as ws:
+        snapshot = ws.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert [o["id"] for o in snapshot["asks"]] == [resting["id"]]
+        seq = snapshot["seq"]
+
+        post_order(client, "Bid", item["id"], buyer["id"], 100, quantity=1)
+        trade = ws.receive_json()
+        assert trade["type"] == "trade" and trade["seq"] == seq + 1
+        assert (trade["maker_order_id"], trade["maker_remaining"]) == (resting["id"], 2)
+
+        client.post("/orders/delete/", json={"order_id": resting["id"]})
+        removed = ws.receive_json()
+        assert removed == {"type": "order_removed", "order_id": resting["id"], "item_id": item["id"], "seq": seq + 2}
+
+        bid = post_order(client, "Bid", item["id"], buyer["id"], 99)
+        added = ws.receive_json()
+        assert added["type"] == "order_added" and added["order"]["id"] == bid["id"]
+
+        ws.send_json({"type": "resync"})
+        resync = ws.receive_json()
+        assert resync["type"] == "snapshot" and resync["seq"] == seq + 3
+        assert [o["id"] for o in resync["bids"]] == [bid["id"]] and resync["asks"] == []
+
+
+def test_feed_rejects_unknown_item(client):
+    from starlette.websockets import WebSocketDisconnect
+    import pytest
+
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        with client.websocket_connect("/ws/book/999") as ws:
+            ws.receive_json()
+    assert disconnect.value.code == 4404
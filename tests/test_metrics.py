@@ -0,0 +1,59 @@
+from metrics import Histogram, PhaseTimer
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, phase="match")
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{phase="match",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{phase="match",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{phase="match",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{phase="match"} 4' in lines
+
+
+def test_phase_timer_server_timing():
+    timer = PhaseTimer(Histogram("phase_seconds", "Phases."))
+    timer.record("match", 0.0015)
+    with timer.phase("respond"):
+        pass
+    assert timer.server_timing().startswith("match;dur=1.500, respond;dur=")
+
+
+def test_metrics_endpoint_counts_trades_and_resting_orders(client, market):
+    item_id, alice, bob = market
+    client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 3})
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": bob, "price": 10, "quantity": 2})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert f'orderbook_trades_total{{item_id="{item_id}"}} 1' in lines
+    assert f'orderbook_traded_quantity_total{{item_id="{item_id}"}} 2' in lines
+    assert f'orderbook_resting_orders{{item_id="{item_id}",side="Ask"}} 1' in lines
+    assert 'orderbook_order_seconds_count 2' in lines
+    assert 'orderbook_order_phase_seconds_count{phase="match"} 2' in lines
+
+
+def test_self_match_is_counted(client, market):
+    item_id, alice, _ = market
+    client.post("/orders/", json={"side": "Ask", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 1})
+    response = client.post(
+        "/orders/", json={"side": "Bid", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 1}
+    )
+    assert response.json()["remaining"] == 1
+
+    lines = client.get("/metrics").text.splitlines()
+    assert f'orderbook_self_match_total{{item_id="{item_id}"}} 1' in lines
+
+
+def test_profile_header_returns_server_timing(client, market):
+    item_id, alice, _ = market
+    order = {"side": "Bid", "item_id": item_id, "user_id": alice, "price": 10, "quantity": 1}
+    assert "server-timing" not in client.post("/orders/", json=order).headers
+
+    timing = client.post("/orders/", json=order, headers={"X-Profile": "1"}).headers["server-timing"]
+    phases = [entry.split(";")[0] for entry in timing.split(", ")]
+    assert phases[:3] == ["validate", "queue", "match"]
+    assert "respond" in phases
@@ -1,3 +1,6 @@
+from datetime import datetime
+
+
 def test_create_order_bid(client):
     # Create a user
     user = client.post("/users/", json={"name": "Bob"}).json()
@@ -5,14 +8,14 @@ def test_create_order_bid(client):
     item = client.post("/items/", json={"name": "Silver Coin", "description": "Shiny"}).json()
 
     response = client.post("/orders/", json={
-        "type": "Bid",
+        "side": "Bid",
         "item_id": item["id"],
         "user_id": user["id"],
         "price": 120
     })
     assert response.status_code == 200
     data = response.json()
-    assert data["type"] == "Bid"
+    assert data["side"] == "Bid"
     assert data["item_id"] == item["id"]
 
 def test_get_orders_for_item(client):
@@ -24,3 +27,262 @@ def test_get_orders_for_item(client):
     assert response.status_code == 200
     data = response.json()
     assert isinstance(data, list)
+
+
+def test_order_batch(client):
+    maker = client.post("/users/", json={"name": "Ivan"}).json()
+    taker = client.post("/users/", json={"name": "Judy"}).json()
+    item = client.post("/items/", json={"name": "Zinc Coin"}).json()
+    stale = client.post("/orders/", json={
+        "side": "Ask", "item_id": item["id"], "user_id": maker["id"], "price": 110
+    }).json()
+
+    response = client.post("/orders/batch", json={
+        "cancel_order_ids": [stale["id"]],
+        "orders": [
+            {"side": "Ask", "item_id": item["id"], "user_id": maker["id"], "price": 105, "quantity": 2},
+            {"side": "Ask", "item_id": item["id"], "user_id": maker["id"], "price": 106, "quantity": 2},
+            {"side": "Bid", "item_id": item["id"], "user_id": taker["id"], "price": 106, "quantity": 3},
+        ],
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["cancelled"] == [stale["id"]]
+    assert [len(r["trades"]) for r in data["results"]] == [0, 0, 2]
+    assert [(t["price"], t["quantity"]) for t in data["results"][2]["trades"]] == [(105, 2), (106, 1)]
+
+    orders = client.get(f"/orders/?item_id={item['id']}").json()
+    assert [(o["price"], o["remaining"]) for o in orders] == [(106, 1)]
+
+
+def test_order_batch_rechecks_cancels_once_it_holds_the_writers(client, session_factory, monkeypatch):
+    import main
+
+    user = client.post("/users/", json={"name": "Lena"}).json()
+    item = client.post("/items/", json={"name": "Nickel Coin"}).json()
+    ask = client.post("/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": user["id"], "price": 7}).json()
+
+    sequencer = client.app.dependency_overrides[main.get_sequencer]()
+    exclusive = sequencer.exclusive
+
+    def filled_first(item_ids):
+        # The ask is taken between the batch looking it up and the batch holding its item's writer
+        client.app.dependency_overrides[main.get_matching_engine]().cancel(ask["id"])
+        with session_factory() as db:
+            main.delete_orders(db, [ask["id"]])
+            db.commit()
+        return exclusive(item_ids)
+
+    monkeypatch.setattr(sequencer, "exclusive", filled_first)
+    response = client.post("/orders/batch", json={
+        "cancel_order_ids": [ask["id"]],
+        "orders": [{"side": "Ask", "item_id": item["id"], "user_id": user["id"], "price": 8}],
+    })
+    assert response.status_code == 404
+    assert client.get(f"/orders/?item_id={item['id']}").json() == []
+
+
+def test_order_batch_rejects_unknown_user(client):
+    user = client.post("/users/", json={"name": "Ken"}).json()
+    item = client.post("/items/", json={"name": "Tin Coin"}).json()
+
+    response = client.post("/orders/batch", json={"orders": [
+        {"side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": 10},
+        {"side": "Bid", "item_id": item["id"], "user_id": user["id"] + 1, "price": 10},
+    ]})
+    assert response.status_code == 404
+    assert client.get(f"/orders/?item_id={item['id']}").json() == []
+
+
+def test_get_book(client):
+    alice = client.post("/users/", json={"name": "Alice"}).json()
+    bob = client.post("/users/", json={"name": "Bob"}).json()
+    item = client.post("/items/", json={"name": "Lead Coin"}).json()
+
+    orders = [
+        ("Bid", "Limit", 99, 2), ("Bid", "Limit", 99, 3), ("Bid", "Limit", 98, 1),
+        ("Ask", "Limit", 101, 4), ("Ask", "Limit", 103, 1),
+    ]
+    for side, kind, price, quantity in orders:
+        client.post("/orders/", json={
+            "side": side, "kind": kind, "item_id": item["id"],
+            "user_id": alice["id"] if side == "Bid" else bob["id"],
+            "price": price, "quantity": quantity,
+        })
+    # Only Alice is bidding, so her own market ask rests instead of trading
+    client.post("/orders/", json={
+        "side": "Ask", "kind": "Market", "item_id": item["id"], "user_id": alice["id"], "price": 0,
+    })
+
+    book = client.get(f"/book/{item['id']}?depth=1").json()
+    assert book["best_bid"] == 99
+    assert book["best_ask"] == 101
+    assert book["mid_price"] == 100
+    assert book["bids"] == [{"price": 99, "quantity": 5, "orders": 2}]
+    assert book["asks"] == [{"price": 101, "quantity": 4, "orders": 1}]
+    assert (book["bid_orders"], book["ask_orders"]) == (3, 2)
+    assert (book["market_bids"], book["market_asks"]) == (0, 1)
+
+    assert client.get(f"/book/{item['id'] + 1}").status_code == 404
+
+
+def test_get_orders_pagination(client):
+    user = client.post("/users/", json={"name": "Rita"}).json()
+    item = client.post("/items/", json={"name": "Chrome Coin"}).json()
+    ids = [
+        client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": p}).json()["id"]
+        for p in (1, 2, 3)
+    ]
+
+    page = client.get(f"/orders/?item_id={item['id']}&after_id={ids[0]}&limit=1").json()
+    assert [o["id"] for o in page] == [ids[1]]
+
+    streamed = client.get(f"/orders/?item_id={item['id']}&after_id={ids[0]}&stream=true").text.splitlines()
+    assert len(streamed) == 2
+
+
+def test_ioc_and_fok_orders_never_rest(client):
+    seller = client.post("/users/", json={"name": "Sid"}).json()
+    buyer = client.post("/users/", json={"name": "Tina"}).json()
+    item = client.post("/items/", json={"name": "Nickel Coin"}).json()
+    client.post("/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": 10, "quantity": 2})
+
+    def bid(**fields):
+        return client.post("/orders/", json={
+            "side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 10, "quantity": 3, **fields
+        })
+
+    fok = bid(time_in_force="FOK").json()
+    assert (fok["id"], fok["status"], fok["remaining"], fok["time_in_force"]) == (None, "Cancelled", 3, "FOK")
+    ioc = bid(time_in_force="IOC").json()
+    assert (ioc["id"], ioc["status"], ioc["remaining"]) == (None, "Cancelled", 1)
+    rested = bid(quantity=1).json()
+    assert (rested["status"], rested["remaining"]) == ("Resting", 1)
+    client.post("/orders/delete/", json={"order_id": rested["id"]})
+    assert client.get(f"/orders/?item_id={item['id']}").json() == []
+    assert len(client.get(f"/trades/?item_id={item['id']}").json()) == 1
+
+    assert bid(time_in_force="GTD").status_code == 422
+    assert bid(expires_at="2999-01-01T00:00:00Z").status_code == 422
+    assert bid(time_in_force="GTD", expires_at="2001-01-01T00:00:00Z").status_code == 422
+
+
+def test_gtd_orders_expire(client, session_factory):
+    import main
+
+    user = client.post("/users/", json={"name": "Uma"}).json()
+    item = client.post("/items/", json={"name": "Zinc Coin"}).json()
+    gtd = client.post("/orders/", json={
+        "side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": 5,
+        "time_in_force": "GTD", "expires_at": "2999-01-01T01:00:00+01:00",
+    }).json()
+    assert gtd["expires_at"] == "2999-01-01T00:00:00"
+    client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": 4})
+    assert len(client.get(f"/book/{item['id']}").json()["bids"]) == 2
+
+    dependency = lambda get: client.app.dependency_overrides[get]()
+    expired = main.expire_orders(
+        dependency(main.get_matching_engine), dependency(main.get_sequencer), session_factory,
+        dependency(main.get_committer), None, dependency(main.get_market_feed), dependency(main.get_read_cache),
+        dependency(main.get_metrics), now=datetime(2999, 1, 1),
+    )
+
+    assert expired == 1
+    assert [o["price"] for o in client.get(f"/orders/?item_id={item['id']}").json()] == [4]
+    assert [l["price"] for l in client.get(f"/book/{item['id']}").json()["bids"]] == [4]
+
+
+def test_mass_cancel(client):
+    alice = client.post("/users/", json={"name": "Vera"}).json()
+    bob = client.post("/users/", json={"name": "Walt"}).json()
+    items = [client.post("/items/", json={"name": f"Mass Coin {i}"}).json() for i in range(2)]
+    ids = {}
+    for user in (alice, bob):
+        for item in items:
+            ids[user["id"], item["id"]] = client.post("/orders/", json={
+                "side": "Bid", "item_id": item["id"], "user_id": user["id"], "price": 5
+            }).json()["id"]
+
+    one = client.post("/orders/cancel", json={"user_id": alice["id"], "item_id": items[0]["id"]}).json()
+    assert one["cancelled"] == [ids[alice["id"], items[0]["id"]]]
+    everywhere = client.post("/orders/cancel", json={"user_id": alice["id"]}).json()
+    assert everywhere["cancelled"] == [ids[alice["id"], items[1]["id"]]]
+    item = client.post("/orders/cancel", json={"item_id": items[1]["id"]}).json()
+    assert item["cancelled"] == [ids[bob["id"], items[1]["id"]]]
+
+    assert [o["user_id"] for o in client.get(f"/orders/?item_id={items[0]['id']}").json()] == [bob["id"]]
+    assert client.get(f"/book/{items[1]['id']}").json()["bids"] == []
+    assert client.post("/orders/cancel", json={}).status_code == 422
+
+
+def test_stop_orders(client):
+    seller = client.post("/users/", json={"name": "Xena"}).json()
+    stopper = client.post("/users/", json={"name": "Yuri"}).json()
+    buyer = client.post("/users/", json={"name": "Zoe"}).json()
+    item = client.post("/items/", json={"name": "Tin Coin"}).json()
+
+    def order(user, **fields):
+        return client.post("/orders/", json={"item_id": item["id"], "user_id": user["id"], "price": 1, **fields})
+
+    for price in (10, 11):
+        order(seller, side="Ask", price=price)
+    stop = order(stopper, side="Bid", kind="Stop", stop_price=10).json()
+    stop_limit = order(stopper, side="Bid", kind="StopLimit", price=12, stop_price=11).json()
+    assert (stop["kind"], stop["stop_price"], stop["price"]) == ("Stop", 10, None)
+    assert client.get(f"/book/{item['id']}").json()["bids"] == []
+    assert [o["kind"] for o in client.get(f"/orders/?item_id={item['id']}").json()][-2:] == ["Stop", "StopLimit"]
+
+    # The trade at 10 triggers the stop, whose trade at 11 triggers the stop limit, which rests
+    order(buyer, side="Bid", price=10)
+    trades = client.get(f"/trades/?item_id={item['id']}").json()
+    assert [(t["price"], t["buyer_id"]) for t in trades] == [(10, buyer["id"]), (11, stopper["id"])]
+    orders = client.get(f"/orders/?item_id={item['id']}").json()
+    assert [(o["id"], o["kind"], o["price"], o["stop_price"]) for o in orders] == [
+        (stop_limit["id"], "Limit", 12, 11)
+    ]
+    assert [l["price"] for l in client.get(f"/book/{item['id']}").json()["bids"]] == [12]
+
+    assert order(buyer, side="Bid", kind="Stop").status_code == 422
+    assert order(buyer, side="Bid", stop_price=5).status_code == 422
+    assert order(buyer, side="Bid", kind="Stop", stop_price=5.001).status_code == 400
+
+
+def test_order_price_is_checked_per_kind(client):
+    user = client.post("/users/", json={"name": "Pia"}).json()
+    item = client.post("/items/", json={"name": "Iron Coin"}).json()
+
+    def order(**fields):
+        return client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": user["id"], **fields})
+
+    missing = order()
+    assert missing.status_code == 422
+    assert len(missing.json()["detail"]) == 1  # the body is validated once, not again after admission
+    assert order(kind="StopLimit", stop_price=5).status_code == 422
+    batch = client.post("/orders/batch", json={"orders": [{"side": "Bid", "item_id": item["id"], "user_id": user["id"]}]})
+    assert (batch.status_code, len(batch.json()["detail"])) == (422, 1)
+
+    # Market and stop orders may send a placeholder price, as clients always have; it is ignored
+    assert order(kind="Market", price=0).json()["price"] is None
+    assert order(kind="Market").json()["price"] is None
+    assert order(kind="Stop", price=3, stop_price=5).json()["price"] is None
+
+
+def test_ioc_stop_orders_rest_until_triggered(client):
+    seller = client.post("/users/", json={"name": "Quin"}).json()
+    stopper = client.post("/users/", json={"name": "Rhea"}).json()
+    buyer = client.post("/users/", json={"name": "Saul"}).json()
+    item = client.post("/items/", json={"name": "Cobalt Coin"}).json()
+
+    def order(user, **fields):
+        return client.post("/orders/", json={"item_id": item["id"], "user_id": user["id"], **fields}).json()
+
+    stop = order(stopper, side="Bid", kind="Stop", stop_price=10, time_in_force="IOC", quantity=3)
+    assert (stop["status"], stop["remaining"]) == ("Resting", 3)
+    assert [o["id"] for o in client.get(f"/orders/?item_id={item['id']}").json()] == [stop["id"]]
+
+    # Once triggered it fills what it can at once and drops the rest
+    order(seller, side="Ask", price=10, quantity=2)
+    order(buyer, side="Bid", price=10)
+    trades = client.get(f"/trades/?item_id={item['id']}").json()
+    assert [(t["buyer_id"], t["quantity"]) for t in trades] == [(buyer["id"], 1), (stopper["id"], 1)]
+    assert client.get(f"/orders/?item_id={item['id']}").json() == []
@@ -0,0 +1,191 @@
+import random
+from datetime import datetime, timedelta
+
+from models import OrderType, OrderKind, TimeInForce
+from orderbook import MatchingEngine
+
+
+def reference_match(book, trades, order_id, user_id, side, kind, price):
+    """The original query-per-branch matching rules, run against a plain list."""
+    opposite = OrderType.Ask if side == OrderType.Bid else OrderType.Bid
+    sign = 1 if side == OrderType.Bid else -1
+    limits = [o for o in book if o["side"] == opposite and o["kind"] == OrderKind.Limit]
+
+    def trade(maker, trade_price):
+        buyer, seller = (user_id, maker["user_id"]) if side == OrderType.Bid else (maker["user_id"], user_id)
+        trades.append((buyer, seller, trade_price))
+        book.remove(maker)
+
+    def rest():
+        book.append({"id": order_id, "side": side, "kind": kind, "user_id": user_id,
+                     "price": None if kind == OrderKind.Market else price})
+
+    if kind == OrderKind.Market:
+        if limits:
+            maker = min(limits, key=lambda o: (o["price"] * sign, o["id"]))
+            if maker["user_id"] != user_id:
+                return trade(maker, maker["price"])
+        return rest()
+
+    markets = [o for o in book if o["side"] == opposite and o["kind"] == OrderKind.Market]
+    if markets:
+        maker = markets[0]
+        if maker["user_id"] == user_id:
+            return rest()
+        return trade(maker, price)
+
+    crossing = [o for o in limits if (o["price"] <= price if side == OrderType.Bid else o["price"] >= price)]
+    if crossing:
+        maker = min(crossing, key=lambda o: (o["price"] * sign, o["id"]))
+        if maker["user_id"] == user_id:
+            return rest()
+        return trade(maker, maker["price"])
+    return rest()
+
+
+def test_engine_matches_reference_rules():
+    rng = random.Random(7)
+    engine = MatchingEngine()
+    book, expected = [], []
+    actual = []
+
+    for _ in range(2000):
+        side = rng.choice([OrderType.Bid, OrderType.Ask])
+        kind = OrderKind.Market if rng.random() < 0.2 else OrderKind.Limit
+        user_id = rng.randint(1, 4)
+        price = rng.randint(95, 105)
+
+        result = engine.submit(1, user_id, side, kind, price)
+        actual.extend((f.buyer_id, f.seller_id, f.price) for f in result.fills)
+        reference_match(book, expected, result.order.id, user_id, side, kind, price)
+
+    assert actual == expected
+    assert sorted(engine.orders) == sorted(o["id"] for o in book)
+
+
+def test_price_time_priority():
+    engine = MatchingEngine()
+    first = engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 101).order
+    second = engine.submit(1, 2, OrderType.Ask, OrderKind.Limit, 100).order
+    third = engine.submit(1, 3, OrderType.Ask, OrderKind.Limit, 100).order
+
+    fills = [engine.submit(1, 4, OrderType.Bid, OrderKind.Limit, 105).fills[0] for _ in range(3)]
+
+    assert [f.maker_id for f in fills] == [second.id, third.id, first.id]
+    assert [f.price for f in fills] == [100, 100, 101]
+
+
+def test_limit_order_takes_resting_market_order_first():
+    engine = MatchingEngine()
+    engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 90)
+    market = engine.submit(1, 2, OrderType.Ask, OrderKind.Market, 0)
+    assert market.rested
+
+    result = engine.submit(1, 3, OrderType.Bid, OrderKind.Limit, 100)
+
+    assert result.fills[0].maker_id == market.order.id
+    assert result.fills[0].price == 100
+
+
+def test_cancel_removes_order_from_book():
+    engine = MatchingEngine()
+    ask = engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 100).order
+
+    assert engine.cancel(ask.id) is ask
+    assert engine.cancel(ask.id) is None
+    assert engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 100).rested
+
+
+def test_books_are_rebuilt_on_startup(client):
+    import main
+
+    buyer = client.post("/users/", json={"name": "Erin"}).json()
+    seller = client.post("/users/", json={"name": "Frank"}).json()
+    item = client.post("/items/", json={"name": "Copper Coin"}).json()
+    client.post("/orders/", json={"side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": 50})
+
+    db = next(client.app.dependency_overrides[main.get_db]())
+    engine = MatchingEngine()
+    engine.load(db.query(main.ItemOrder).order_by(main.ItemOrder.id))
+    client.app.dependency_overrides[main.get_matching_engine] = lambda: engine
+
+    order = client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 60}).json()
+
+    assert order["price"] == 60
+    assert client.get(f"/orders/?item_id={item['id']}").json() == []
+    assert client.get(f"/trades/?item_id={item['id']}").json()[0]["price"] == 50
+
+
+def test_sweep_fills_across_levels_and_rests_residual():
+    engine = MatchingEngine()
+    engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 100, quantity=2)
+    engine.submit(1, 2, OrderType.Ask, OrderKind.Limit, 101, quantity=3)
+    engine.submit(1, 3, OrderType.Ask, OrderKind.Limit, 103, quantity=5)
+
+    result = engine.submit(1, 4, OrderType.Bid, OrderKind.Limit, 102, quantity=6)
+
+    assert [(f.price, f.quantity) for f in result.fills] == [(100, 2), (101, 3)]
+    assert result.rested and result.order.remaining == 1
+    assert engine.book(1).bids.best_level().quantity == 1
+    assert engine.book(1).asks.best_level().price == 103
+
+
+def test_partial_fill_keeps_maker_queue_position():
+    engine = MatchingEngine()
+    first = engine.submit(1, 1, OrderType.Bid, OrderKind.Limit, 100, quantity=5).order
+    engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 100, quantity=5)
+
+    fill = engine.submit(1, 3, OrderType.Ask, OrderKind.Limit, 100, quantity=2).fills[0]
+
+    assert (fill.maker_id, fill.maker_remaining) == (first.id, 3)
+    level = engine.book(1).bids.best_level()
+    assert level.orders[0] is first and level.quantity == 8
+
+
+def test_time_in_force():
+    engine = MatchingEngine()
+    engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, 100, quantity=2)
+
+    # FOK needs the whole quantity at once, so nothing trades
+    fok = engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 100, quantity=3, time_in_force=TimeInForce.FOK)
+    assert (fok.fills, fok.rested, fok.cancelled) == ([], False, 3)
+    # IOC takes what it can and drops the rest
+    ioc = engine.submit(1, 2, OrderType.Bid, OrderKind.Limit, 100, quantity=3, time_in_force=TimeInForce.IOC)
+    assert [f.quantity for f in ioc.fills] == [2]
+    assert (ioc.rested, ioc.cancelled) == (False, 1)
+    assert engine.book(1).bids.best_level() is None
+
+    expires = datetime(2024, 1, 1, 12)
+    gtd = engine.submit(1, 3, OrderType.Bid, OrderKind.Limit, 90, time_in_force=TimeInForce.GTD, expires_at=expires)
+    gone = engine.submit(1, 3, OrderType.Bid, OrderKind.Limit, 91, time_in_force=TimeInForce.GTD, expires_at=expires)
+    engine.cancel(gone.order.id)
+    assert engine.due(expires - timedelta(seconds=1)) == {}
+    due = engine.due(expires)
+    assert due == {1: [gtd.order.id, gone.order.id]}
+    # An order cancelled before it expired is skipped
+    assert engine.expire(due[1]) == [gtd.order]
+    assert engine.book(1).bids.best_level() is None
+
+
+def test_stops_trigger_on_crossing_trades_and_cascade():
+    engine = MatchingEngine()
+    for price in (100, 101, 102):
+        engine.submit(1, 1, OrderType.Ask, OrderKind.Limit, price)
+    # Buy stops trigger at or above their stop price, sell stops at or below it
+    near = engine.submit(1, 2, OrderType.Bid, OrderKind.Stop, None, stop_price=101).order
+    far = engine.submit(1, 3, OrderType.Bid, OrderKind.StopLimit, 104, stop_price=102).order
+    sell = engine.submit(1, 4, OrderType.Ask, OrderKind.Stop, None, stop_price=90).order
+    # Stops stay out of the visible book
+    assert engine.book(1).bids.best_level() is None and engine.book(1).asks.order_count == 3
+
+    assert engine.submit(1, 5, OrderType.Bid, OrderKind.Limit, 100).triggered == []
+    result = engine.submit(1, 5, OrderType.Bid, OrderKind.Limit, 101)
+
+    # The trade at 101 triggers `near`, whose trade at 102 triggers `far` in the same call
+    assert [(step.order, step.order.kind, [f.price for f in step.fills]) for step in result.triggered] == [
+        (near, OrderKind.Market, [102]),
+        (far, OrderKind.Limit, []),
+    ]
+    assert near.id not in engine.orders and far.id in engine.orders
+    assert engine.book(1).bids.best_level().price == 104
+    assert engine.cancel(sell.id) is sell
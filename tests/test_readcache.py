@@ -0,0 +1,69 @@
+from models import ItemOrder
+from readcache import CachedResponse, ReadCache
+
+
+def test_lru_eviction_and_versions():
+    cache = ReadCache(max_entries=2)
+    cache.put("a", 0, CachedResponse(b"a"))
+    cache.put("b", 0, CachedResponse(b"b"))
+    assert cache.get("a", 0).body == b"a"  # a is now the most recently used
+    cache.put("c", 0, CachedResponse(b"c"))
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 1) is None  # cached under an older version
+
+    # A reader that raced a writer doesn't overwrite the newer response
+    cache.put("a", 2, CachedResponse(b"new"))
+    cache.put("a", 1, CachedResponse(b"old"))
+    assert cache.get("a", 2).body == b"new"
+
+
+def test_etag_revalidation(client, market):
+    item_id, alice, _ = market
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": alice, "price": 10})
+
+    for path in (f"/orders/?item_id={item_id}", f"/trades/?item_id={item_id}", f"/book/{item_id}", "/items/"):
+        first = client.get(path)
+        etag = first.headers["etag"]
+        revalidated = client.get(path, headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == etag
+        assert revalidated.content == b""
+
+    # Every route and query of an item's scope is its own representation
+    paths = (f"/orders/?item_id={item_id}", f"/orders/?item_id={item_id}&limit=1", f"/trades/?item_id={item_id}",
+             f"/book/{item_id}")
+    etags = [client.get(path).headers["etag"] for path in paths]
+    assert len(set(etags)) == len(paths)
+    assert client.get(f"/book/{item_id}", headers={"If-None-Match": etags[0]}).status_code == 200
+
+    etag = client.get(f"/orders/?item_id={item_id}").headers["etag"]
+    client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": alice, "price": 11})
+    changed = client.get(f"/orders/?item_id={item_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert [o["price"] for o in changed.json()] == [10, 11]
+
+
+def test_cached_reads_skip_the_database_until_the_item_changes(client, session_factory, market):
+    item_id, alice, _ = market
+    order_id = client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": alice, "price": 10}).json()["id"]
+    assert len(client.get(f"/orders/?item_id={item_id}").json()) == 1
+
+    # A row written behind the API's back only shows up once the item's version moves
+    with session_factory() as db:
+        db.add(ItemOrder(id=10_000, side="Ask", kind="Limit", price=5000, item_id=item_id, user_id=alice))
+        db.commit()
+    assert len(client.get(f"/orders/?item_id={item_id}").json()) == 1
+
+    client.post("/orders/delete/", json={"order_id": order_id})
+    assert [o["id"] for o in client.get(f"/orders/?item_id={item_id}").json()] == [10_000]
+
+
+def test_pagination_headers_are_cached(client, market):
+    item_id, alice, _ = market
+    ids = [
+        client.post("/orders/", json={"side": "Bid", "item_id": item_id, "user_id": alice, "price": p}).json()["id"]
+        for p in (1, 2, 3)
+    ]
+    for _ in range(2):
+        page = client.get(f"/orders/?item_id={item_id}&limit=2")
+        assert page.headers["x-next-after-id"] == str(ids[1])
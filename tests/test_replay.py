@@ -0,0 +1,92 @@
+import json
+import random
+
+from replay import Replay, TapeWriter, parse_timestamp, read_records
+
+
+def test_replay_matches_the_api(client):
+    users = [client.post("/users/", json={"name": f"user-{i}"}).json()["id"] for i in range(4)]
+    item_id = client.post("/items/", json={"name": "Widget"}).json()["id"]
+    rng = random.Random(7)
+    records = []
+    for _ in range(200):
+        record = {
+            "side": rng.choice(["Bid", "Ask"]),
+            "kind": "Market" if rng.random() < 0.1 else "Limit",
+            "item_id": item_id,
+            "user_id": rng.choice(users),
+            "price": rng.randint(95, 105) / 10,
+            "quantity": rng.randint(1, 3),
+        }
+        records.append(record)
+        client.post("/orders/", json=record)
+
+    tape = []
+    replay = Replay(on_trade=tape.append)
+    replay.run(records)
+
+    api_trades = client.get(f"/trades/?item_id={item_id}").json()
+    assert [(t["price"], t["quantity"], t["buyer_id"], t["seller_id"]) for t in tape] == \
+        [(t["price"], t["quantity"], t["buyer_id"], t["seller_id"]) for t in api_trades]
+    book = client.get(f"/book/{item_id}?depth=1000").json()
+    assert replay.book()[0]["bids"] == book["bids"]
+    assert replay.book()[0]["asks"] == book["asks"]
+
+
+def test_cancels_rejects_and_files(tmp_path):
+    orders = tmp_path / "orders.csv"
+    orders.write_text(
+        "action,order_id,timestamp,side,kind,item_id,user_id,price,quantity\n"
+        ",1,2024-01-02T03:04:05Z,Ask,Limit,1,1,10.00,2\n"
+        ",2,,Ask,Limit,1,1,10.50,1\n"
+        "cancel,2,,,,,,,\n"
+        ",3,1704164646,Bid,Limit,1,2,10.005,1\n"  # off the 0.01 grid
+        ",4,1704164646,Bid,Market,1,2,,3\n"
+    )
+    tape_path = str(tmp_path / "tape.jsonl")
+    tape = TapeWriter(tape_path)
+    replay = Replay(on_trade=tape)
+    stats = replay.run(read_records(str(orders)))
+    tape.close()
+
+    assert (stats.orders, stats.cancels, stats.rejected, stats.trades, stats.volume) == (3, 1, 1, 1, 2)
+    trades = [json.loads(line) for line in open(tape_path)]
+    assert trades == [{
+        "timestamp": "2024-01-02T03:04:06", "item_id": 1, "price": 10.0, "quantity": 2,
+        "buyer_id": 2, "seller_id": 1, "maker_order_id": 1, "taker_order_id": 4,
+    }]
+    # The market bid's residual waits for the next ask
+    assert replay.book() == [{"item_id": 1, "bids": [], "asks": [], "market_bids": 1, "market_asks": 0}]
+
+
+def test_mixed_explicit_and_implicit_order_ids_never_collide():
+    tape = []
+    replay = Replay(on_trade=tape.append)
+    replay.run([
+        {"order_id": 5, "side": "Ask", "item_id": 1, "user_id": 1, "price": 10},
+        {"side": "Ask", "item_id": 1, "user_id": 1, "price": 11},
+        {"order_id": 2, "side": "Ask", "item_id": 1, "user_id": 1, "price": 12},
+        {"side": "Bid", "item_id": 1, "user_id": 2, "price": 12, "quantity": 3},
+    ])
+
+    # Numbering carries on after the highest explicit id, so every maker is a distinct order
+    assert [(t["maker_order_id"], t["taker_order_id"]) for t in tape] == [(5, 7), (6, 7), (2, 7)]
+
+
+def test_parse_timestamp():
+    assert parse_timestamp("2024-01-02T04:04:05+01:00").isoformat() == "2024-01-02T03:04:05"
+    assert parse_timestamp(0).isoformat() == "1970-01-01T00:00:00"
+    assert parse_timestamp("") is None
+
+
+def test_gtd_orders_expire_on_the_replay_clock():
+    replay = Replay()
+    stats = replay.run([
+        {"side": "Ask", "item_id": 1, "user_id": 1, "price": 10, "timestamp": "2024-01-01T09:00:00",
+         "time_in_force": "GTD", "expires_at": "2024-01-01T10:00:00"},
+        {"side": "Ask", "item_id": 1, "user_id": 1, "price": 11, "timestamp": "2024-01-01T09:00:00"},
+        {"side": "Bid", "item_id": 1, "user_id": 2, "price": 11, "timestamp": "2024-01-01T10:00:00"},
+    ])
+
+    assert (stats.orders, stats.expired, stats.trades) == (3, 1, 1)
+    assert replay.book()[0]["asks"] == []
@@ -0,0 +1,157 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from main import get_db
+from models import ItemOrder, Trade, OrderType, OrderKind
+from orderbook import MatchingEngine
+from sequencer import OrderSequencer
+
+
+def test_same_item_runs_in_order_on_one_thread():
+    sequencer = OrderSequencer(workers=4)
+    seen = []
+
+    futures = [sequencer.submit(7, lambda i=i: seen.append((i, threading.current_thread().name))) for i in range(200)]
+    for future in futures:
+        future.result()
+    sequencer.shutdown()
+
+    assert [i for i, _ in seen] == list(range(200))
+    assert len({name for _, name in seen}) == 1
+
+
+def test_stride_spreads_a_partitions_items_over_all_threads():
+    # A process owning every fourth item would otherwise put them all on one thread
+    sequencer = OrderSequencer(workers=4, stride=4)
+    assert {sequencer.shard(item_id) for item_id in range(3, 40, 4)} == {0, 1, 2, 3}
+
+
+def test_exclusive_blocks_writers_of_held_items():
+    sequencer = OrderSequencer(workers=2)
+    events = []
+
+    with sequencer.exclusive([1, 2]):
+        future = sequencer.submit(1, lambda: events.append("writer"))
+        events.append("exclusive")
+    future.result()
+    sequencer.shutdown()
+
+    assert events == ["exclusive", "writer"]
+
+
+def test_exclusive_all_holds_every_writer_with_a_stride():
+    # Shard indexes taken as item ids would only reach shards 0 and 1 here
+    sequencer = OrderSequencer(workers=4, stride=2)
+    events = []
+
+    with sequencer.exclusive_all():
+        futures = [sequencer.submit(item_id, lambda: events.append("writer")) for item_id in range(0, 8, 2)]
+        events.append("exclusive")
+    for future in futures:
+        future.result()
+    sequencer.shutdown()
+
+    assert {sequencer.shard(item_id) for item_id in range(0, 8, 2)} == {0, 1, 2, 3}
+    assert events == ["exclusive"] + ["writer"] * 4
+
+
+def test_concurrent_matching_fills_each_maker_at_most_once():
+    engine = MatchingEngine()
+    sequencer = OrderSequencer(workers=4)
+    items = range(8)
+    makers = {}
+    for item_id in items:
+        for user_id in range(50):
+            order = engine.submit(item_id, user_id, OrderType.Ask, OrderKind.Limit, 100, quantity=2).order
+            makers[order.id] = order.quantity
+
+    def take(item_id, user_id):
+        return sequencer.run(item_id, engine.submit, item_id, 1000 + user_id, OrderType.Bid, OrderKind.Limit, 100)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda args: take(*args), [(i, u) for u in range(150) for i in items]))
+    finally:
+        sys.setswitchinterval(switch_interval)
+        sequencer.shutdown()
+
+    filled = {}
+    for result in results:
+        for fill in result.fills:
+            filled[fill.maker_id] = filled.get(fill.maker_id, 0) + fill.quantity
+    assert filled == makers
+    assert all(engine.book(item_id).asks.best() is None for item_id in items)
+    assert sum(r.rested for r in results) == 150 * len(items) - sum(makers.values())
+
+
+@pytest.fixture
+def file_client(client, db_mode, session_factory, tmp_path):
+    if db_mode == "async":
+        # Async mode already runs on a file database
+        yield client, session_factory
+        return
+
+    # Real concurrent transactions need a file database rather than the shared in-memory connection
+    engine = create_engine(f"sqlite:///{tmp_path}/stress.db", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    client.app.dependency_overrides[get_db] = override_get_db
+    yield client, SessionLocal
+    engine.dispose()
+
+
+def test_concurrent_orders_never_fill_a_resting_order_twice(file_client):
+    client, SessionLocal = file_client
+    sellers = [client.post("/users/", json={"name": f"seller-{i}"}).json()["id"] for i in range(5)]
+    buyers = [client.post("/users/", json={"name": f"buyer-{i}"}).json()["id"] for i in range(5)]
+    items = [client.post("/items/", json={"name": f"item-{i}"}).json()["id"] for i in range(4)]
+
+    asks_per_item, ask_size, bids_per_item = 20, 3, 80
+    for item_id in items:
+        for i in range(asks_per_item):
+            client.post("/orders/", json={
+                "side": "Ask", "item_id": item_id, "user_id": sellers[i % 5], "price": 100, "quantity": ask_size,
+            })
+
+    bids = [(item_id, buyers[i % 5]) for i in range(bids_per_item) for item_id in items]
+    # Switch threads as often as possible so unsynchronised matching would interleave
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(
+                lambda bid: client.post("/orders/", json={
+                    "side": "Bid", "item_id": bid[0], "user_id": bid[1], "price": 100,
+                }),
+                bids,
+            ))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert all(r.status_code == 200 for r in responses)
+
+    with SessionLocal() as db:
+        for item_id in items:
+            filled = db.query(func.sum(Trade.quantity)).filter(Trade.item_id == item_id).scalar()
+            assert filled == asks_per_item * ask_size
+            assert db.query(ItemOrder).filter(ItemOrder.item_id == item_id, ItemOrder.side == "Ask").count() == 0
+            resting_bids = db.query(ItemOrder).filter(ItemOrder.item_id == item_id, ItemOrder.side == "Bid").count()
+            assert resting_bids == bids_per_item - asks_per_item * ask_size
+
+            book = client.get(f"/book/{item_id}").json()
+            assert book["ask_orders"] == 0 and book["bid_orders"] == resting_bids
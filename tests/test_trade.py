@@ -1,3 +1,6 @@
+import json
+
+
 def test_trade_execution(client):
     buyer = client.post("/users/", json={"name": "Charlie"}).json()
     seller = client.post("/users/", json={"name": "Dave"}).json()
@@ -5,7 +8,7 @@ def test_trade_execution(client):
 
     # Seller posts ask
     client.post("/orders/", json={
-        "type": "Ask",
+        "side": "Ask",
         "item_id": item["id"],
         "user_id": seller["id"],
         "price": 100
@@ -13,7 +16,7 @@ def test_trade_execution(client):
 
     # Buyer posts bid (executes trade)
     client.post("/orders/", json={
-        "type": "Bid",
+        "side": "Bid",
         "item_id": item["id"],
         "user_id": buyer["id"],
         "price": 120
@@ -26,3 +29,103 @@ def test_trade_execution(client):
     assert trade["buyer_id"] == buyer["id"]
     assert trade["seller_id"] == seller["id"]
     assert trade["price"] == 100
+
+
+def test_order_sweeps_multiple_levels(client):
+    buyer = client.post("/users/", json={"name": "Grace"}).json()
+    seller = client.post("/users/", json={"name": "Heidi"}).json()
+    item = client.post("/items/", json={"name": "Nickel Coin"}).json()
+
+    for price, quantity in [(100, 2), (101, 2)]:
+        client.post("/orders/", json={
+            "side": "Ask",
+            "item_id": item["id"],
+            "user_id": seller["id"],
+            "price": price,
+            "quantity": quantity,
+        })
+
+    order = client.post("/orders/", json={
+        "side": "Bid",
+        "item_id": item["id"],
+        "user_id": buyer["id"],
+        "price": 101,
+        "quantity": 5,
+    }).json()
+    assert order["quantity"] == 5
+    assert order["remaining"] == 1
+
+    trades = client.get(f"/trades/?item_id={item['id']}").json()
+    assert [(t["price"], t["quantity"]) for t in trades] == [(100, 2), (101, 2)]
+
+    orders = client.get(f"/orders/?item_id={item['id']}").json()
+    assert [(o["id"], o["remaining"]) for o in orders] == [(order["id"], 1)]
+
+
+def test_item_stats_and_candles(client):
+    buyer = client.post("/users/", json={"name": "Liam"}).json()
+    seller = client.post("/users/", json={"name": "Mia"}).json()
+    item = client.post("/items/", json={"name": "Iron Coin"}).json()
+
+    for price, quantity in [(10, 1), (20, 3)]:
+        client.post("/orders/", json={
+            "side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": price, "quantity": quantity,
+        })
+        client.post("/orders/", json={
+            "side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": price, "quantity": quantity,
+        })
+
+    stats = client.get(f"/items/{item['id']}/stats").json()
+    assert stats["trade_count"] == 2
+    assert stats["volume"] == 4
+    assert stats["average_price"] == 15
+    assert stats["vwap"] == 17.5
+    assert (stats["last_price"], stats["high"], stats["low"]) == (20, 20, 10)
+
+    candles = client.get(f"/items/{item['id']}/candles?interval=1d").json()
+    assert len(candles) == 1
+    assert {k: candles[0][k] for k in ("open", "high", "low", "close", "volume", "trades")} == {
+        "open": 10, "high": 20, "low": 10, "close": 20, "volume": 4, "trades": 2,
+    }
+    assert client.get(f"/items/{item['id']}/candles?interval=7m").status_code == 400
+
+
+def test_candles_bucket_by_interval():
+    from datetime import datetime
+    from tradestats import TradeStats
+
+    stats = TradeStats()
+    stats.record(1, 10, 1, datetime(2025, 1, 1, 12, 0, 5))
+    stats.record(1, 12, 1, datetime(2025, 1, 1, 12, 0, 55))
+    stats.record(1, 11, 2, datetime(2025, 1, 1, 12, 1, 0))
+    stats.record(1, 9, 1, None)
+
+    candles = stats.candles(1, "1m", limit=10)
+    assert [(c.start.minute, c.open, c.close, c.volume) for c in candles] == [(0, 10, 12, 2), (1, 11, 11, 2)]
+    assert stats.get(1).trade_count == 4
+    assert stats.candles(1, "1h", limit=10)[0].volume == 4
+
+
+def test_trades_keyset_pagination_and_stream(client):
+    buyer = client.post("/users/", json={"name": "Pat"}).json()
+    seller = client.post("/users/", json={"name": "Quinn"}).json()
+    item = client.post("/items/", json={"name": "Cobalt Coin"}).json()
+    client.post("/orders/", json={
+        "side": "Ask", "item_id": item["id"], "user_id": seller["id"], "price": 10, "quantity": 5,
+    })
+    for _ in range(5):
+        client.post("/orders/", json={"side": "Bid", "item_id": item["id"], "user_id": buyer["id"], "price": 10})
+
+    first = client.get(f"/trades/?item_id={item['id']}&limit=2")
+    assert len(first.json()) == 2
+    after_id = first.headers["X-Next-After-Id"]
+    assert after_id == str(first.json()[-1]["id"])
+
+    rest = client.get(f"/trades/?item_id={item['id']}&after_id={after_id}&limit=10")
+    assert len(rest.json()) == 3
+    assert "X-Next-After-Id" not in rest.headers
+
+    streamed = client.get(f"/trades/?item_id={item['id']}&stream=true")
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert lines == first.json() + rest.json()
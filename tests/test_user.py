@@ -10,3 +10,38 @@ def test_get_users(client):
     assert response.status_code == 200
     data = response.json()
     assert any(user["name"] == "Bob" for user in data)
+
+
+def test_user_orders_and_trades_span_items(client):
+    buyer = client.post("/users/", json={"name": "Uma"}).json()
+    seller = client.post("/users/", json={"name": "Vic"}).json()
+    coin = client.post("/items/", json={"name": "Nickel Coin"}).json()
+    bar = client.post("/items/", json={"name": "Gold Bar", "tick_size": 0.5}).json()
+
+    def order(side, user, item, price, quantity=1):
+        return client.post("/orders/", json={
+            "side": side, "item_id": item["id"], "user_id": user["id"], "price": price, "quantity": quantity
+        }).json()
+
+    ask = order("Ask", seller, coin, 1.25, 2)
+    order("Bid", buyer, coin, 1.25)
+    order("Ask", buyer, bar, 20.5)
+    order("Bid", seller, bar, 20.5)
+    resting = order("Bid", buyer, coin, 1.1)
+
+    orders = client.get(f"/users/{buyer['id']}/orders").json()
+    assert [(o["id"], o["price"]) for o in orders] == [(resting["id"], 1.1)]
+    assert client.get(f"/users/{seller['id']}/orders?item_id={coin['id']}").json()[0]["id"] == ask["id"]
+    assert client.get(f"/users/{seller['id']}/orders?item_id={bar['id']}").json() == []
+
+    # Bought one item and sold the other, each priced in its own item's ticks
+    trades = client.get(f"/users/{buyer['id']}/trades").json()
+    assert [(t["item_id"], t["price"], t["buyer_id"] == buyer["id"]) for t in trades] == [
+        (coin["id"], 1.25, True), (bar["id"], 20.5, False)
+    ]
+    page = client.get(f"/users/{buyer['id']}/trades?limit=1")
+    assert [t["id"] for t in page.json()] == [trades[0]["id"]]
+    rest = client.get(f"/users/{buyer['id']}/trades?after_id={page.headers['X-Next-After-Id']}&limit=1").json()
+    assert [t["id"] for t in rest] == [trades[1]["id"]]
+
+    assert client.get("/users/999/trades").status_code == 404
@@ -0,0 +1,26 @@
+from decimal import Decimal
+from typing import Optional
+
+# Tick size for items created without one, and for rows migrated from float prices
+DEFAULT_TICK_SIZE = 0.01
+
+
+def to_ticks(price: float, tick_size: float) -> int:
+    """Convert an API price to whole ticks; raises ValueError when it is not on the tick grid."""
+    # Decimal of the shortest repr, so 0.3 / 0.1 is exactly 3 rather than 2.9999999999999996
+    ticks = Decimal(repr(price)) / Decimal(repr(tick_size))
+    if ticks != ticks.to_integral_value():
+        raise ValueError(f"Price {price} is not a multiple of the tick size {tick_size}")
+    return int(ticks)
+
+
+def to_price(ticks: Optional[float], tick_size: float) -> Optional[float]:
+    """Convert ticks, or an average of them, back to an API price."""
+    if ticks is None:
+        return None
+    return float(Decimal(repr(ticks)) * Decimal(repr(tick_size)))
+
+
+def tick_decimals(tick_size: float) -> int:
+    """Decimal places of a tick size; rounding ticks * tick_size to these gives the exact price."""
+    return max(0, -Decimal(repr(tick_size)).normalize().as_tuple().exponent)
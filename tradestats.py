@@ -0,0 +1,128 @@
+import copy
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+# Candle intervals maintained for every item, in seconds
+INTERVALS = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+# Oldest buckets are dropped past this, so memory stays bounded per item and interval
+MAX_CANDLES = 10_000
+
+
+@dataclass
+class Candle:
+    start: datetime
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+    trades: int
+
+
+class ItemStats:
+    """Running aggregates for one item, updated trade by trade. Prices are in ticks."""
+
+    def __init__(self):
+        self.trade_count = 0
+        self.volume = 0
+        self.price_total = 0  # sum of trade prices, for the unweighted average
+        self.notional = 0  # sum of price * quantity, for the VWAP
+        self.last_price: Optional[int] = None
+        self.high: Optional[int] = None
+        self.low: Optional[int] = None
+        self.candles: Dict[str, "OrderedDict[int, Candle]"] = {name: OrderedDict() for name in INTERVALS}
+
+    @property
+    def average_price(self) -> Optional[float]:
+        return self.price_total / self.trade_count if self.trade_count else None
+
+    @property
+    def vwap(self) -> Optional[float]:
+        return self.notional / self.volume if self.volume else None
+
+    def record(self, price: int, quantity: int, timestamp: Optional[datetime]):
+        self.trade_count += 1
+        self.volume += quantity
+        self.price_total += price
+        self.notional += price * quantity
+        self.last_price = price
+        self.high = price if self.high is None else max(self.high, price)
+        self.low = price if self.low is None else min(self.low, price)
+
+        # Trades recorded before timestamps existed only count towards the totals
+        if timestamp is None:
+            return
+        epoch = int(timestamp.replace(tzinfo=timezone.utc).timestamp())
+        for name, seconds in INTERVALS.items():
+            self._add_to_candle(self.candles[name], epoch - epoch % seconds, price, quantity)
+
+    @staticmethod
+    def _add_to_candle(candles: "OrderedDict[int, Candle]", start: int, price: int, quantity: int):
+        candle = candles.get(start)
+        if candle is None:
+            candles[start] = Candle(
+                start=datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None),
+                open=price,
+                high=price,
+                low=price,
+                close=price,
+                volume=quantity,
+                trades=1,
+            )
+            if len(candles) > MAX_CANDLES:
+                candles.popitem(last=False)
+            return
+        candle.high = max(candle.high, price)
+        candle.low = min(candle.low, price)
+        candle.close = price
+        candle.volume += quantity
+        candle.trades += 1
+
+
+class TradeStats:
+    """Per-item trade aggregates and OHLCV candles, so reads never touch the trades table."""
+
+    def __init__(self):
+        self.items: Dict[int, ItemStats] = {}
+        self.lock = threading.Lock()
+
+    def load(self, rows: Iterable):
+        """Rebuild from persisted trades, which must be given in id order."""
+        with self.lock:
+            self.items.clear()
+            for row in rows:
+                self._item(row.item_id).record(row.price, row.quantity, row.timestamp)
+
+    def record(self, item_id: int, price: int, quantity: int, timestamp: Optional[datetime]):
+        with self.lock:
+            self._item(item_id).record(price, quantity, timestamp)
+
+    def get(self, item_id: int) -> ItemStats:
+        """Return a consistent copy of the item's aggregates."""
+        with self.lock:
+            stats = self.items.get(item_id)
+            return copy.copy(stats) if stats else ItemStats()
+
+    def candles(self, item_id: int, interval: str, limit: int) -> List[Candle]:
+        """Return the latest `limit` candles, oldest first."""
+        with self.lock:
+            stats = self.items.get(item_id)
+            if stats is None:
+                return []
+            candles = stats.candles[interval]
+            return [copy.copy(c) for c in list(candles.values())[-limit:]]
+
+    def _item(self, item_id: int) -> ItemStats:
+        stats = self.items.get(item_id)
+        if stats is None:
+            stats = self.items[item_id] = ItemStats()
+        return stats